@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from pw_manager import compression, kdf
+from pw_manager.db import Database
+from pw_manager.utils import utils, key_cache
+from benchmarks.engine import generate_entry, PASSWORD, DEFAULT_KDF_ITERATIONS, DEFAULT_SEED
+
+
+"""
+Compares the compression algorithms of the binary format: the size of the database file, and how long a full
+write, a read and a read that decrypts every entry take with each of them.
+
+Every algorithm writes the same synthetic entries, so the sizes can be compared directly. The time a sync needs
+for a full upload over a link is about the file size divided by the bandwidth, see "seconds_at_1_mbit".
+
+Usage: python -m benchmarks.compression [--sizes 1000,100000] [--algorithms none,zlib,lzma] [--output results.json]
+
+The results are printed (or written to --output) as json:
+
+{
+    "environment": {...},
+    "results": [
+        {"entries": 1000, "compression": "zlib", "file_bytes": ..., "ratio": ..., "write_ms": ..., "read_ms": ...,
+         "read_all_ms": ..., "seconds_at_1_mbit": ...},
+        ...
+    ]
+}
+"""
+
+
+DEFAULT_SIZES = (1000, 100000)
+
+
+def median_ms(function, samples: int) -> float:
+    timings = []
+
+    for _ in range(samples):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings) * 1000
+
+
+def open_vault(path: str) -> Database:
+    key_cache.wipe()
+
+    db = Database(path, PASSWORD)
+    db.read()
+
+    return db
+
+
+def read_all(path: str) -> None:
+    for entry in open_vault(path).get_all_entries():
+        entry.password
+
+
+def benchmark(folder: str, entries: int, algorithm: str, args) -> dict:
+    """
+    Writes a vault with an algorithm and measures it
+    :param folder: Where to put the vault
+    :param entries: The amount of entries
+    :param algorithm: The compression
+    :param args: The parsed arguments
+    :return: The results
+    """
+    path = os.path.join(folder, f"{entries}-{algorithm}.db")
+    rng = random.Random(args.seed)
+
+    db = Database(path, PASSWORD, kdf_parameters=kdf.KdfParameters(kdf.ALGORITHM_PBKDF2_SHA512_256, iterations=args.kdf_iterations),
+                  compression=algorithm)
+    db.create()
+    db.read()
+
+    with db.transaction():
+        for i in range(entries):
+            db.add_database_entry(**generate_entry(rng, i), should_write=False)
+
+    # every entry is decrypted now, so the writes measure serializing, compressing and encrypting all of them
+    write_ms = median_ms(db.write, args.samples)
+
+    file_bytes = os.path.getsize(path)
+
+    result = {
+        "entries": entries,
+        "compression": algorithm,
+        "file_bytes": file_bytes,
+        "ratio": None,
+        "write_ms": write_ms,
+        "read_ms": median_ms(lambda: open_vault(path), args.samples),
+        "read_all_ms": median_ms(lambda: read_all(path), args.samples),
+        "seconds_at_1_mbit": file_bytes * 8 / 1000000
+    }
+
+    os.remove(path)
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the compression of the binary format")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Comma separated vault sizes in entries")
+    parser.add_argument("--algorithms", default=",".join(compression.ALGORITHMS), help=f"Comma separated algorithms out of {', '.join(compression.ALGORITHMS)}")
+    parser.add_argument("--samples", type=int, default=3, help="Runs of every measurement")
+    parser.add_argument("--kdf-iterations", type=int, default=DEFAULT_KDF_ITERATIONS, help="PBKDF2 iterations of the generated vaults")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed of the synthetic vaults")
+    parser.add_argument("--output", help="Write the json results to this file instead of printing them")
+
+    args = parser.parse_args()
+
+    algorithms = [algorithm for algorithm in args.algorithms.split(",") if algorithm]
+
+    for algorithm in algorithms:
+        if algorithm not in compression.ALGORITHMS:
+            parser.error(f"Unknown algorithm {algorithm}")
+
+    work_folder = tempfile.mkdtemp(prefix="pw_manager_benchmark_")
+
+    # the cache of known databases must not end up in the real data folder
+    utils.get_data_folder = lambda: work_folder
+
+    try:
+        results = []
+
+        for size in map(int, args.sizes.split(",")):
+            uncompressed_bytes = None
+
+            for algorithm in algorithms:
+                print(f"{size} entries, {algorithm}", file=sys.stderr)
+
+                result = benchmark(work_folder, size, algorithm, args)
+
+                if algorithm == compression.NONE:
+                    uncompressed_bytes = result.get("file_bytes")
+
+                if uncompressed_bytes:
+                    result["ratio"] = result.get("file_bytes") / uncompressed_bytes
+
+                results.append(result)
+
+        report = {
+            "environment": {
+                "python": sys.version.split()[0],
+                "zlib_level": compression.ZLIB_LEVEL,
+                "lzma_preset": compression.LZMA_PRESET,
+                "seed": args.seed,
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+            },
+            "results": results
+        }
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
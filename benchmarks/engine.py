@@ -0,0 +1,348 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, the peak rss is reported as null there
+    resource = None
+
+from pw_manager import kdf
+from pw_manager.db import Database
+from pw_manager.db_entry import DatabaseEntry
+from pw_manager.utils import utils, key_cache
+
+
+"""
+Benchmarks the hot paths of the Database engine on deterministic synthetic vaults.
+
+For every vault size a vault is generated once, and every operation then runs in its own process on a fresh
+copy of it, so the peak rss of that process belongs to that operation (including the vault it had to load).
+The vaults use a fixed, cheap kdf so the results show the cost of the engine and not of the kdf.
+
+Usage: python -m benchmarks.engine [--sizes 10,1000,100000,1000000] [--operations read,write,...] [--output results.json]
+
+The results are printed (or written to --output) as json:
+
+{
+    "environment": {...},
+    "results": [
+        {"entries": 1000, "operation": "read", "samples": 3, "min_ms": ..., "p50_ms": ..., "p90_ms": ..., "p99_ms": ...,
+         "max_ms": ..., "mean_ms": ..., "ops_per_second": ..., "entries_per_second": ..., "file_bytes": ...,
+         "peak_rss_bytes": ...},
+        ...
+    ]
+}
+"""
+
+
+DEFAULT_SIZES = (10, 1000, 100000, 1000000)
+DEFAULT_KDF_ITERATIONS = 1000
+DEFAULT_SEED = 1337
+
+PASSWORD = "benchmark password"
+
+# operations that work on the whole vault, they are slow on big vaults and get fewer samples
+FULL_OPERATIONS = ("create", "read", "write")
+ENTRY_OPERATIONS = ("add_database_entry", "update_entry", "delete_entry", "search", "generate_password")
+OPERATIONS = FULL_OPERATIONS + ENTRY_OPERATIONS
+
+SEARCH_TERMS = ("example", "user1", "42", "website-99", "nothing matches this")
+
+
+def generate_entry(rng: random.Random, i: int) -> dict:
+    """
+    Generates the fields of a synthetic entry
+    :param rng: The random generator, seeded so every run generates the same vault
+    :param i: The number of the entry
+    :return: The fields of the entry
+    """
+    return {
+        "website_or_usage": f"website-{i}.example.com",
+        "username": f"user{i}@example.com",
+        "description": "".join(rng.choices(string.ascii_letters + " ", k=rng.randint(0, 40))),
+        "password": "".join(rng.choices(string.ascii_letters + string.digits + string.punctuation, k=rng.randint(12, 32)))
+    }
+
+
+def get_kdf_parameters(args) -> kdf.KdfParameters:
+    return kdf.KdfParameters(kdf.ALGORITHM_PBKDF2_SHA512_256, iterations=args.kdf_iterations)
+
+
+def generate_vault(path: str, entries: int, args) -> None:
+    """
+    Creates a vault with synthetic entries
+    :param path: Where to create the vault
+    :param entries: The amount of entries
+    :param args: The parsed arguments
+    """
+    rng = random.Random(args.seed)
+
+    db = Database(path, PASSWORD, kdf_parameters=get_kdf_parameters(args))
+    db.create()
+    db.read()
+
+    with db.transaction():
+        for i in range(entries):
+            db.add_database_entry(**generate_entry(rng, i), should_write=False)
+
+
+def get_peak_rss() -> int | None:
+    if resource is None:
+        return None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # linux reports kilobytes, macos bytes
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def percentile(sorted_samples: list[float], percent: float) -> float:
+    """
+    Gets a percentile with the nearest rank method
+    :param sorted_samples: The samples, sorted
+    :param percent: The percentile from 0 to 100
+    :return: The sample at that percentile
+    """
+    rank = max(1, int(-(-percent * len(sorted_samples) // 100)))
+    return sorted_samples[rank - 1]
+
+
+def open_vault(path: str) -> Database:
+    # every unlock derives the key again, like opening the vault in a new session would
+    key_cache.wipe()
+
+    db = Database(path, PASSWORD)
+    db.read()
+
+    return db
+
+
+def run_operation(operation: str, path: str, entries: int, samples: int, args) -> list[float]:
+    """
+    Runs an operation a few times on a vault and times every run
+    :param operation: One of OPERATIONS
+    :param path: The path of the vault to run it on
+    :param entries: The amount of entries in the vault
+    :param samples: How often to run it
+    :param args: The parsed arguments
+    :return: The seconds every run took
+    """
+    rng = random.Random(args.seed + 1)
+    timings = []
+
+    if operation == "create":
+        folder = tempfile.mkdtemp(dir=os.path.dirname(path))
+
+        for i in range(samples):
+            db = Database(os.path.join(folder, f"{i}.db"), PASSWORD, kdf_parameters=get_kdf_parameters(args))
+
+            start = time.perf_counter()
+            db.create()
+            timings.append(time.perf_counter() - start)
+
+        return timings
+
+    if operation == "read":
+        for _ in range(samples):
+            start = time.perf_counter()
+            open_vault(path)
+            timings.append(time.perf_counter() - start)
+
+        return timings
+
+    if operation == "generate_password":
+        random.seed(args.seed)
+
+        for _ in range(samples):
+            start = time.perf_counter()
+            utils.generate_password(32, [string.ascii_letters, string.digits, string.punctuation])
+            timings.append(time.perf_counter() - start)
+
+        return timings
+
+    db = open_vault(path)
+
+    for i in range(samples):
+        if operation == "write":
+            start = time.perf_counter()
+            db.write()
+
+        elif operation == "add_database_entry":
+            fields = generate_entry(rng, entries + i)
+
+            start = time.perf_counter()
+            db.add_database_entry(**fields)
+
+        elif operation == "update_entry":
+            all_entries = db.get_all_entries()
+
+            old_entry = all_entries[rng.randrange(len(all_entries))]
+            new_entry = DatabaseEntry(**generate_entry(rng, entries + i))
+
+            start = time.perf_counter()
+            db.update_entry(old_entry, new_entry)
+
+        elif operation == "delete_entry":
+            all_entries = db.get_all_entries()
+
+            if not all_entries:
+                break
+
+            entry = all_entries[rng.randrange(len(all_entries))]
+
+            start = time.perf_counter()
+            db.delete_entry(entry)
+
+        elif operation == "search":
+            term = SEARCH_TERMS[i % len(SEARCH_TERMS)]
+
+            # what utils.get_entry does: list the sorted entries, then search for the term that was entered
+            start = time.perf_counter()
+            db.get_sorted_entries()
+            db.search_entries(term)
+
+        else:
+            raise ValueError(f"Unknown operation {operation}")
+
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def summarize(operation: str, entries: int, timings: list[float], file_bytes: int, peak_rss: int | None) -> dict:
+    sorted_timings = sorted(timings)
+    total = sum(timings)
+
+    result = {
+        "entries": entries,
+        "operation": operation,
+        "samples": len(timings),
+        "min_ms": sorted_timings[0] * 1000,
+        "p50_ms": percentile(sorted_timings, 50) * 1000,
+        "p90_ms": percentile(sorted_timings, 90) * 1000,
+        "p99_ms": percentile(sorted_timings, 99) * 1000,
+        "max_ms": sorted_timings[-1] * 1000,
+        "mean_ms": total / len(timings) * 1000,
+        "ops_per_second": len(timings) / total if total else None,
+        "entries_per_second": None,
+        "file_bytes": file_bytes,
+        "peak_rss_bytes": peak_rss
+    }
+
+    if operation in ("read", "write") and total:
+        result["entries_per_second"] = entries * len(timings) / total
+
+    return result
+
+
+def run_worker(args) -> None:
+    """
+    Runs a single operation in this process and prints its summary as json
+    """
+    samples = args.full_samples if args.operation in FULL_OPERATIONS else args.samples
+
+    timings = run_operation(args.operation, args.vault, args.entries, samples, args)
+
+    print(json.dumps(summarize(args.operation, args.entries, timings, os.path.getsize(args.vault), get_peak_rss())))
+
+
+def run_in_process(arguments: list[str]) -> str:
+    return subprocess.run([sys.executable, "-m", "benchmarks.engine"] + arguments, check=True, stdout=subprocess.PIPE, text=True).stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the Database engine")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Comma separated vault sizes in entries")
+    parser.add_argument("--operations", default=",".join(OPERATIONS), help=f"Comma separated operations out of {', '.join(OPERATIONS)}")
+    parser.add_argument("--samples", type=int, default=100, help="Runs of every operation on single entries")
+    parser.add_argument("--full-samples", type=int, default=3, help="Runs of create, read and write")
+    parser.add_argument("--kdf-iterations", type=int, default=DEFAULT_KDF_ITERATIONS, help="PBKDF2 iterations of the generated vaults")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed of the synthetic vaults")
+    parser.add_argument("--output", help="Write the json results to this file instead of printing them")
+
+    # used internally to run every operation in its own process
+    parser.add_argument("--generate", help=argparse.SUPPRESS)
+    parser.add_argument("--operation", help=argparse.SUPPRESS)
+    parser.add_argument("--vault", help=argparse.SUPPRESS)
+    parser.add_argument("--entries", type=int, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    work_folder = tempfile.mkdtemp(prefix="pw_manager_benchmark_")
+
+    # the cache of known databases must not end up in the real data folder
+    utils.get_data_folder = lambda: work_folder
+
+    try:
+        if args.generate:
+            generate_vault(args.generate, args.entries, args)
+            return
+
+        if args.operation:
+            run_worker(args)
+            return
+
+        operations = [operation for operation in args.operations.split(",") if operation]
+
+        for operation in operations:
+            if operation not in OPERATIONS:
+                parser.error(f"Unknown operation {operation}")
+
+        common_arguments = ["--samples", str(args.samples), "--full-samples", str(args.full_samples),
+                            "--kdf-iterations", str(args.kdf_iterations), "--seed", str(args.seed)]
+
+        results = []
+
+        for size in map(int, args.sizes.split(",")):
+            base_vault = os.path.join(work_folder, f"{size}.db")
+
+            print(f"Generating a vault with {size} entries...", file=sys.stderr)
+            run_in_process(["--generate", base_vault, "--entries", str(size)] + common_arguments)
+
+            for operation in operations:
+                print(f"  {operation}", file=sys.stderr)
+
+                vault = os.path.join(work_folder, f"{size}-{operation}.db")
+                shutil.copyfile(base_vault, vault)
+
+                results.append(json.loads(run_in_process(["--operation", operation, "--vault", vault, "--entries", str(size)] + common_arguments)))
+
+                os.remove(vault)
+
+            os.remove(base_vault)
+
+        report = {
+            "environment": {
+                "python": platform.python_version(),
+                "implementation": platform.python_implementation(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "kdf": get_kdf_parameters(args).to_dict(),
+                "seed": args.seed,
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+            },
+            "results": results
+        }
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import gc
+import json
+import tracemalloc
+
+from pw_manager.db_entry import DatabaseEntry
+
+
+"""
+Compares the memory used by DatabaseEntry objects with the old layout that had a per instance __dict__,
+and the peak memory of building entries from json with and without keeping the list of raw dicts around.
+
+Usage: python -m benchmarks.entry_memory [--entries 1000000]
+"""
+
+
+class DictDatabaseEntry:
+    """
+    The layout DatabaseEntry had before it used __slots__
+    """
+    def __init__(self, website_or_usage: str, username: str, description: str, password: str, entry_id: str):
+        self.entry_id = entry_id
+        self.website_or_usage = website_or_usage
+        self.username = username
+        self.description = description
+        self.password = password
+
+        self.sealed_content = None
+        self.unseal_function = None
+
+
+def generate_raw_entries(amount: int) -> list[dict]:
+    return [{
+        "id": f"{i:032x}",
+        "website_or_usage": f"website-{i}.example.com",
+        "username": f"user{i}@example.com",
+        "description": f"Synthetic entry number {i}",
+        "password": f"password-{i * 7919 % 1000003:07d}"
+    } for i in range(amount)]
+
+
+def measure(func) -> (int, int):
+    """
+    Measures the memory of whatever the function returns
+    :param func: The function to run
+    :return: The memory still used by the result and the peak memory while running the function
+    """
+    gc.collect()
+    tracemalloc.start()
+
+    result = func()
+
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del result
+    gc.collect()
+
+    return current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory benchmark for DatabaseEntry")
+    parser.add_argument("--entries", type=int, default=1000000, help="Amount of synthetic entries")
+    args = parser.parse_args()
+
+    raw_entries = generate_raw_entries(args.entries)
+    raw_json = json.dumps(raw_entries)
+
+    dict_current, _ = measure(lambda: [DictDatabaseEntry(website_or_usage=raw.get("website_or_usage"),
+                                                         username=raw.get("username"),
+                                                         description=raw.get("description"),
+                                                         password=raw.get("password"),
+                                                         entry_id=raw.get("id")) for raw in raw_entries])
+
+    slots_current, _ = measure(lambda: [DatabaseEntry.from_dict(raw) for raw in raw_entries])
+
+    del raw_entries
+
+    def read_with_raw_list():
+        raw_list = json.loads(raw_json)
+        return [DatabaseEntry.from_dict(raw) for raw in raw_list]
+
+    _, raw_list_peak = measure(read_with_raw_list)
+    _, object_hook_peak = measure(lambda: json.loads(raw_json, object_hook=DatabaseEntry.from_dict))
+
+    print(f"Entries: {args.entries}")
+    print()
+    print("Entry objects (without the field strings):")
+    print(f"  __dict__: {dict_current / 1024 / 1024:8.1f} MiB ({dict_current / args.entries:.0f} bytes per entry)")
+    print(f"  __slots__: {slots_current / 1024 / 1024:7.1f} MiB ({slots_current / args.entries:.0f} bytes per entry)")
+    print(f"  Saved: {(1 - slots_current / dict_current) * 100:.0f}%")
+    print()
+    print("Peak memory while building entries from json (with the field strings):")
+    print(f"  Raw list of dicts kept alive: {raw_list_peak / 1024 / 1024:8.1f} MiB")
+    print(f"  Entries created while parsing: {object_hook_peak / 1024 / 1024:7.1f} MiB")
+    print(f"  Saved: {(1 - object_hook_peak / raw_list_peak) * 100:.0f}%")
+
+
+if __name__ == '__main__':
+    main()
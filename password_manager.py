@@ -1,10 +1,23 @@
+import argparse
+
 import colorama
 
+from pw_manager import instrumentation
 from pw_manager.ui import main_screen
 from pw_manager.utils import utils
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Password manager")
+    parser.add_argument("--trace", help=f"Record timings of the hot paths and write them to this file when exiting, "
+                                        f"like the {instrumentation.ENV_TRACE} environment variable")
+    parser.add_argument("--trace-format", choices=(instrumentation.FORMAT_JSON, instrumentation.FORMAT_PROMETHEUS),
+                        help="Format of the trace file, guessed from its extension by default")
+    args = parser.parse_args()
+
+    if args.trace:
+        instrumentation.enable(args.trace, args.trace_format)
+
     colorama.init()
     main_screen.show()
     utils.exit_pw_manager()
@@ -0,0 +1,70 @@
+import lzma
+import zlib
+
+from pw_manager.utils import errors
+
+
+"""
+Compression of the chunks of the binary format before they get encrypted.
+
+Ciphertext doesn't compress, so this is the only place where it helps. The json lines of a chunk repeat a lot
+(hex ids, websites, usernames with the same domain), so they usually shrink to less than half, which makes
+the file smaller to write and much faster to sync over slow links. The compression of a database is stored in
+the flags of its header (see vault_format.py), read() picks it up from there.
+
+Supported algorithms:
+    none    the chunks are stored as they are
+    zlib    deflate with ZLIB_LEVEL, fast and good enough for most databases
+    lzma    xz with LZMA_PRESET, the smallest files but slower writes
+"""
+
+
+NONE = "none"
+ZLIB = "zlib"
+LZMA = "lzma"
+
+ALGORITHMS = (NONE, ZLIB, LZMA)
+
+ZLIB_LEVEL = 6
+LZMA_PRESET = 6
+
+
+def check_algorithm(algorithm: str) -> None:
+    if algorithm not in ALGORITHMS:
+        raise errors.DatabaseFormatException(f"Unsupported compression {algorithm}")
+
+
+def compress(data: bytes, algorithm: str) -> bytes:
+    """
+    Compresses data
+    :param data: The data
+    :param algorithm: One of ALGORITHMS
+    :return: The compressed data
+    """
+    if algorithm == ZLIB:
+        return zlib.compress(data, ZLIB_LEVEL)
+
+    if algorithm == LZMA:
+        return lzma.compress(data, preset=LZMA_PRESET)
+
+    return data
+
+
+def decompress(data: bytes, algorithm: str) -> bytes:
+    """
+    Decompresses data
+    :param data: The compressed data
+    :param algorithm: The algorithm it was compressed with
+    :return: The data
+    """
+    try:
+        if algorithm == ZLIB:
+            return zlib.decompress(data)
+
+        if algorithm == LZMA:
+            return lzma.decompress(data)
+
+    except (zlib.error, lzma.LZMAError):
+        raise errors.DatabaseFormatException("A chunk of the database file can't be decompressed")
+
+    return data
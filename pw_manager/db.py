@@ -1,45 +1,159 @@
 import base64
+import contextlib
 import pathlib
 import os
 import json
+import mmap
+import threading
 
 import bcrypt
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
 
+from pw_manager import vault_format
+from pw_manager import kdf
+from pw_manager import compression as compression_module
+from pw_manager import instrumentation
 from pw_manager.utils import errors
-from pw_manager.utils import utils, constants
-from pw_manager.db_entry import DatabaseEntry
+from pw_manager.utils import utils, constants, key_cache
+from pw_manager.db_entry import DatabaseEntry, SEALED_FIELDS, next_modification_clock, get_legacy_entry_id
+from pw_manager.search_index import SearchIndex, FIELDS_WITHOUT_PASSWORD, matches
+from pw_manager.write_behind import WriteBehindWorker, DEFAULT_DELAY
 
 
 """
-File structure of database.db:
+New databases are stored in the binary format described in vault_format.py. Databases in the json format
+below keep working and can be converted with Database.convert().
+
+File structure of database.db in the json format:
 
 {
     "salt": "some_salt",
-    "content": "Giant_encrypted_blob_of_text"
+    "kdf": {"algorithm": "pbkdf2-sha512_256", "iterations": 100000},  <- see kdf.py, files without it use exactly this
+    "format": "per_entry",
+    "index": "Encrypted_list_of_ids_websites_or_usages_and_modification_clocks",
+    "entries": {
+        "id": "Encrypted_username_description_and_password",
+        ...
+    }
 }
+encrypted_journal_record
+encrypted_journal_record
+...
+
+Every entry has a unique id that stays the same for its whole lifetime, also when it gets updated, and a
+modification clock that moves forward with every change (see db_entry.next_modification_clock()). Merge syncs
+use both to match entries of different copies of a database and to pick the newer change of a conflict.
+Only the index is decrypted when reading, the other fields of an entry are decrypted once they are accessed.
+Databases written before the per entry format have a single "content" field instead of "format", "index" and
+"entries", which holds the whole encrypted list of entries. They still get read and are converted to the per
+entry format on the next full write.
+
+The journal records are appended after the json document (or the body of the binary format), one encrypted record per line. Each record
+describes a single add, update or delete that happened after the content was written and is replayed
+over the content when reading. Writing the full content again compacts the journal away.
+
+Appending and writing happen under a lock file next to the database file (LOCK_SUFFIX). Before either, a db
+takes over what other dbs on the same file persisted since it read or changed the file the last time: records
+they appended get replayed and the numbering continues after them, and a file they replaced gets read again.
+Entries this db changed and didn't persist yet keep its version, which is also the one the file gets. So
+neither an append nor a full write ever drops the changes of another db. Replaying never fails because of the
+numbering: records are applied in the order of the file, and records with unexpected numbers or that can't be
+applied get the journal compacted on the next write.
 
+Content of a journal record before encryption:
 
+{
+    "seq": 0,
+    "op": "add" | "update" | "delete",
+    "entry": {"id": "id_of_the_entry", ...}  <- only the id for "delete"
+}
 """
 
 
+FORMAT_PER_ENTRY = "per_entry"
+FORMAT_BINARY = "binary"
+
+LOCK_SUFFIX = ".lock"
+
+# The journal gets compacted into the content once it is bigger than this many bytes...
+JOURNAL_MAX_BYTES = 1024 * 1024
+# ...or once it has more records than this ratio of the amount of entries (but at least JOURNAL_MIN_RECORDS)
+JOURNAL_MAX_RATIO = 0.5
+JOURNAL_MIN_RECORDS = 64
+
+
 class Database:
-    def __init__(self, path: str, password: str):
+    def __init__(self, path: str, password: str, journaled: bool = True, search_fields: tuple = FIELDS_WITHOUT_PASSWORD, fsync_directory: bool = False,
+                 storage_format: str = FORMAT_BINARY, read_only: bool = False, kdf_parameters: kdf.KdfParameters = None,
+                 compression: str = compression_module.NONE):
         self.path = path
         self.password = password
+        self.storage_format = storage_format
+        self.journaled = journaled
+        self.search_fields = search_fields
+        self.fsync_directory = fsync_directory
+
+        # read only dbs memory map binary files and can't be changed
+        self.read_only = read_only
+        self.mapping: mmap.mmap | None = None
 
         self.salt: bytes = bytes()
 
+        # calibrated for this machine by create() if not given, read from the file by read()
+        self.kdf_parameters: kdf.KdfParameters | None = kdf_parameters
+
+        # compression of the chunks of the binary format (see compression.py), read from the file by read()
+        compression_module.check_algorithm(compression)
+        self.compression = compression
+
         self.content: list[DatabaseEntry] = list()
 
+        # id of an entry -> its position in content
+        self.entry_positions: dict[str, int] = dict()
+
+        self.journal_records: int = 0
+        self.journal_size: int = 0
+
+        # journal records that were skipped while replaying because they couldn't be applied
+        self.skipped_journal_records: int = 0
+
+        # (device, inode, size) of the file after this db read or changed it the last time
+        self.file_identity: tuple | None = None
+        self.file_lock_depth: int = 0
+
+        # set if there are changes that were never written or the journal can't be appended to anymore
+        self.needs_full_write: bool = False
+
+        # id of an entry that was changed but not persisted yet -> number of its last change (counted by
+        # change_counter), its version wins over the changes of other dbs on the same file
+        self.unpersisted_changes: dict[str, int] = dict()
+        self.change_counter: int = 0
+
+        self.in_transaction: bool = False
+
+        # journal records of changes that still have to be persisted
+        self.pending_records: list[dict] = list()
+
+        # write_lock guards the entries and pending records, io_lock makes sure only one thread writes the file
+        self.write_lock = threading.RLock()
+        self.io_lock = threading.RLock()
+
+        self.write_behind: WriteBehindWorker | None = None
+
+        # built by read() and kept up to date by every change afterwards
+        self.search_index: SearchIndex | None = None
+        self.search_index_thread: threading.Thread | None = None
+
+        # built the first time it is needed and dropped whenever the entries change
+        self.sorted_entries: list[DatabaseEntry] | None = None
+
     # ====================== Database functions =================================
 
     def create(self) -> None:
         """
-        Creates a database with the path and password given in the constructor
+        Creates a database with the path, password, storage format and kdf given in the constructor. Without
+        a kdf the parameters get calibrated so that unlocking takes about kdf.DEFAULT_TARGET_SECONDS on this machine
         """
         path = pathlib.Path(self.path)
         if not path.parent.exists():
@@ -50,70 +164,103 @@ class Database:
         if os.path.exists(self.path):
             raise errors.DatabaseAlreadyFoundException
 
-        content = {
-            "salt": self.salt.decode(),
-            "content": "[]"
-        }
+        if self.kdf_parameters is None:
+            self.kdf_parameters = kdf.calibrate()
 
-        content["content"] = self.encrypt_content(content["content"])
+        with self.io_lock:
+            self.__write_file__()
 
-        with open(self.path, "w+") as f:
-            json.dump(content, f, indent=2)
+        self.__build_search_index__()
 
         utils.add_db_path_to_cache(str(path.absolute()))
 
     def read(self) -> None:
         """
-        Reads the database with the password and salt of this db
+        Reads the database with the password and salt of this db and replays its journal. Read only dbs
+        memory map files in the binary format, so only the pages of the entries that get accessed are read.
+        The search index gets built in the background afterwards, search_entries() waits for it
+        """
+        self.__read_file__()
+
+        # building the search index takes about as long as reading the file, so it happens while the entries get listed
+        self.search_index_thread = threading.Thread(target=self.__build_search_index_in_background__, name="search-index", daemon=True)
+        self.search_index_thread.start()
+
+        constants.db_file = self
+
+    def __read_file__(self) -> None:
+        """
+        Reads the database file into this db, see read()
         """
         path = pathlib.Path(self.path)
 
         if not path.exists():
             raise errors.DatabasePathDoesNotExistException
 
-        with open(str(path.absolute())) as f:
-            db_content: dict = json.load(f)
+        with instrumentation.span("db.read") as read_span:
+            try:
+                with open(str(path.absolute()), "rb") as f:
+                    file_stat = os.fstat(f.fileno())
+                    self.file_identity = (file_stat.st_dev, file_stat.st_ino, file_stat.st_size)
 
-        self.salt = db_content.get("salt").encode()
+                    read_span.add("bytes", file_stat.st_size)
 
-        raw_list = json.loads(self.decrypt_content(db_content.get("content")))
+                    is_binary = vault_format.is_binary_vault(f.read(len(vault_format.MAGIC)))
+                    f.seek(0)
 
-        for entry in raw_list:
-            self.content.append(DatabaseEntry(website_or_usage=entry.get("website_or_usage"),
-                                              username=entry.get("username"),
-                                              description=entry.get("description"),
-                                              password=entry.get("password")))
+                    if is_binary and self.read_only:
+                        # only the index gets read, the data chunks stay in the page cache until an entry needs them
+                        self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-        constants.db_file = self
+                        with instrumentation.span("db.read.entries"):
+                            journal = self.__read_binary_content__(self.mapping)
+
+                    elif is_binary:
+                        with instrumentation.span("db.read.entries"):
+                            journal = self.__read_binary_content__(f)
+
+                    else:
+                        with instrumentation.span("db.read.file"):
+                            file_content = f.read().decode()
+
+                if not is_binary:
+                    with instrumentation.span("db.read.parse"):
+                        db_content, journal = self.__split_file_content__(file_content)
+
+                    del file_content
+
+                    self.salt = db_content.get("salt").encode()
+                    self.kdf_parameters = kdf.KdfParameters.from_dict(db_content.get("kdf"))
+                    self.storage_format = FORMAT_PER_ENTRY
+
+                    with instrumentation.span("db.read.entries"):
+                        if db_content.get("format") == FORMAT_PER_ENTRY:
+                            self.__read_per_entry_content__(db_content)
+                        else:
+                            self.__read_legacy_content__(db_content)
+
+            except InvalidToken:
+                key_cache.wipe(self.get_absolute_path())
+                raise
+
+            with instrumentation.span("db.read.journal"):
+                self.__replay_journal__(journal)
+
+            read_span.add("entries", len(self.content))
 
     def write(self) -> None:
         """
-        Writes the database to file
+        Writes the database to file. This also compacts the journal
         """
+        self.__check_writable__()
+
         path = pathlib.Path(self.path)
 
         if not path.exists():
             raise errors.DatabasePathDoesNotExistException
 
-        with open(str(path.absolute())) as f:
-            db_content: dict = json.load(f)
-
-        raw_data = []
-
-        for entry in self.content:
-            raw_data.append({
-                "website_or_usage": entry.website_or_usage,
-                "username": entry.username,
-                "description": entry.description,
-                "password": entry.password
-            })
-
-        with open(str(path.absolute()), "w") as f:
-            db_content["salt"] = self.salt.decode()
-
-            db_content["content"] = self.encrypt_content(json.dumps(raw_data))
-
-            json.dump(db_content, f, indent=2)
+        with self.io_lock:
+            self.__write_file__()
 
     def add_database_entry(self, website_or_usage: str, description: str, username: str, password: str, should_write: bool = True) -> None:
         """
@@ -124,11 +271,15 @@ class Database:
         :param password: The password
         :param should_write: If we should write to disk
         """
+        self.__check_writable__()
 
-        self.content.append(DatabaseEntry(website_or_usage=website_or_usage, description=description, username=username, password=password))
+        entry = DatabaseEntry(website_or_usage=website_or_usage, description=description, username=username, password=password,
+                              modified=next_modification_clock())
 
-        if should_write:
-            self.write()
+        with self.write_lock:
+            self.__insert_entry__(entry)
+
+            self.__save_change__({"op": "add", "entry": entry.to_dict()}, should_write)
 
     def get_all_entries(self) -> list[DatabaseEntry]:
         """
@@ -137,19 +288,93 @@ class Database:
         """
         return self.content
 
+    def iter_entry_fields(self, entries: list[DatabaseEntry] = None):
+        """
+        Produces the fields of entries one after another without unsealing them, so going through all entries
+        of a lazily loaded db only keeps the few decrypted chunks in memory that are needed right now
+        :param entries: The entries, in the order of the db for the least memory. All entries if not given
+        :return: Generator of (entry, dict of the website or usage and the sealed fields)
+        """
+        entries = list(self.content if entries is None else entries)
+
+        for entry, line in zip(entries, self.__iter_data_lines__(entries)):
+            _, username, description, password = json.loads(line)
+
+            yield entry, {"website_or_usage": entry.website_or_usage, "username": username, "description": description, "password": password}
+
+    def get_entry_by_id(self, entry_id: str) -> DatabaseEntry:
+        """
+        Gets an entry by its id
+        :param entry_id: The id of the entry
+        :return: The entry
+        """
+        return self.content[self.__get_position__(entry_id)]
+
+    def get_sorted_entries(self) -> list[DatabaseEntry]:
+        """
+        Gets all entries sorted by their website or usage. The sorted list is cached until the entries change
+        :return: A sorted list of all entries
+        """
+        if self.sorted_entries is None:
+            self.sorted_entries = sorted(self.content)
+
+        return self.sorted_entries
+
+    def search_entries(self, term: str) -> list[DatabaseEntry]:
+        """
+        Searches for all entries where one of the search fields of this db contains the term, ignoring the case.
+        The search index narrows down the candidates, only they get checked against their fields
+        :param term: The term to search for
+        :return: A sorted list of all matching entries
+        """
+        term = term.lower()
+
+        self.__wait_for_search_index__()
+
+        if self.search_index is None:
+            self.__build_search_index__()
+
+        candidates = self.search_index.get_candidates(term)
+
+        if candidates is None:
+            entries = self.content
+        else:
+            # in the order of the db, so the sealed fields of the candidates are decrypted chunk by chunk
+            entries = [self.content[position] for position in sorted(self.entry_positions[entry_id] for entry_id in candidates)]
+
+        result_list = []
+
+        for entry, fields in self.__iter_search_fields__(entries):
+            if matches(tuple((fields.get(field) or "").lower() for field in self.search_fields), term):
+                result_list.append(entry)
+
+        return sorted(result_list)
+
+    def set_search_fields(self, search_fields: tuple) -> None:
+        """
+        Changes the fields searched by search_entries() and builds the search index for them again
+        :param search_fields: The fields, see search_index.ALL_FIELDS and search_index.FIELDS_WITHOUT_PASSWORD
+        """
+        with self.write_lock:
+            self.search_fields = search_fields
+
+            self.__build_search_index__()
+
     def update_entry(self, old_entry: DatabaseEntry, new_entry: DatabaseEntry, should_write: bool = True) -> None:
         """
-        Updates an entry
+        Updates an entry. The updated entry takes over the id of the old one
         :param old_entry: The old entry
         :param new_entry: The updated entry
         :param should_write: If we should write to disk
         """
+        self.__check_writable__()
+
+        with self.write_lock:
+            new_entry.modified = next_modification_clock(self.get_entry_by_id(old_entry.entry_id).modified)
 
-        index = self.content.index(old_entry)
-        self.content[index] = new_entry
+            self.__replace_entry__(old_entry.entry_id, new_entry)
 
-        if should_write:
-            self.write()
+            self.__save_change__({"op": "update", "entry": new_entry.to_dict()}, should_write)
 
     def delete_entry(self, entry: DatabaseEntry, should_write: bool = True) -> None:
         """
@@ -157,30 +382,1092 @@ class Database:
         :param entry: Entry to delete
         :param should_write: If we should write to disk
         """
+        self.__check_writable__()
+
+        with self.write_lock:
+            self.__remove_entry__(entry.entry_id)
+
+            self.__save_change__({"op": "delete", "entry": {"id": entry.entry_id}}, should_write)
+
+    def merge_entries(self, changed_entries: list[DatabaseEntry], deleted_entry_ids: list[str]) -> None:
+        """
+        Takes over the result of a merge sync in a single write. Changed entries are added or replace the entry
+        with their id and keep their modification clock, because they are changes that were made somewhere else
+        :param changed_entries: Entries to add or replace
+        :param deleted_entry_ids: Ids of the entries to delete
+        """
+        with self.transaction():
+            with self.write_lock:
+                for entry in changed_entries:
+                    if entry.entry_id in self.entry_positions:
+                        self.__replace_entry__(entry.entry_id, entry)
+                        self.__save_change__({"op": "update", "entry": entry.to_dict()}, True)
+                    else:
+                        self.__insert_entry__(entry)
+                        self.__save_change__({"op": "add", "entry": entry.to_dict()}, True)
+
+                for entry_id in deleted_entry_ids:
+                    self.__remove_entry__(entry_id)
+                    self.__save_change__({"op": "delete", "entry": {"id": entry_id}}, True)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Groups any number of changes into a single write. The changes made inside the with block are only
+        written once the block is left, and the entries are rolled back if an exception is raised in it or
+        while writing. Nested transactions are part of the outermost one. In write behind mode the write
+        happens in the background like every other change.
+
+        with db.transaction():
+            db.add_database_entry(...)
+            db.delete_entry(...)
+        """
+        self.__check_writable__()
+
+        if self.in_transaction:
+            yield self
+            return
+
+        old_content = list(self.content)
+        old_needs_full_write = self.needs_full_write
+        old_unpersisted_changes = dict(self.unpersisted_changes)
+
+        # the write may have taken over changes of other dbs into the content that gets rolled back
+        old_file_state = (self.file_identity, self.journal_records, self.journal_size)
+
+        self.in_transaction = True
+
+        try:
+            yield self
+
+            self.in_transaction = False
+
+            if self.needs_full_write:
+                self.__request_persist__()
+
+        except BaseException:
+            with self.write_lock:
+                self.content = old_content
+                self.needs_full_write = old_needs_full_write
+                self.unpersisted_changes = old_unpersisted_changes
+
+                self.file_identity, self.journal_records, self.journal_size = old_file_state
+
+                self.entry_positions = {entry.entry_id: i for i, entry in enumerate(self.content)}
+
+                self.sorted_entries = None
+
+                if self.search_index is not None:
+                    self.__build_search_index__()
+            raise
+
+        finally:
+            self.in_transaction = False
+
+    def convert(self, storage_format: str, compression: str = None) -> None:
+        """
+        Converts the database file to another storage format
+        :param storage_format: FORMAT_BINARY or FORMAT_PER_ENTRY
+        :param compression: The compression of the binary format, the current one if not given. The json format
+                            isn't compressed, its fields are encrypted one by one and too small to gain anything
+        """
+        if storage_format not in (FORMAT_BINARY, FORMAT_PER_ENTRY):
+            raise errors.DatabaseFormatException(f"Unknown storage format {storage_format}")
+
+        if compression is not None:
+            compression_module.check_algorithm(compression)
+
+        self.__check_writable__()
+
+        self.flush()
+
+        with self.io_lock:
+            self.storage_format = storage_format
+
+            if compression is not None:
+                self.compression = compression
+
+            self.__write_file__()
+
+    def rekey(self, kdf_parameters: kdf.KdfParameters = None) -> None:
+        """
+        Encrypts the database again with a new salt and kdf, for example after the machine got faster
+        :param kdf_parameters: The new kdf, calibrated for this machine with the configured algorithm if not given
+        """
+        self.__check_writable__()
+
+        if kdf_parameters is None:
+            kdf_parameters = kdf.calibrate()
+
+        kdf_parameters.check()
+
+        self.flush()
+
+        with self.io_lock, self.__lock_file__():
+            self.__catch_up_file__()
+
+            with self.write_lock:
+                # the sealed entries can only be decrypted with the old key, so all of them get decrypted first
+                self.__take_over_entries__(self.__get_plain_entries__(self))
+
+                key_cache.wipe(self.get_absolute_path())
+
+                self.salt = bcrypt.gensalt()
+                self.kdf_parameters = kdf_parameters
+
+            self.__write_content__()
+
+            # the decrypted entries are dropped again, reading the new file only decrypts the index
+            self.content = list()
+            self.entry_positions = dict()
+            self.journal_records = 0
+            self.journal_size = 0
+
+            self.search_index = None
+            self.sorted_entries = None
+
+            self.__read_file__()
+
+            self.__build_search_index__()
+
+    def enable_write_behind(self, delay: float = DEFAULT_DELAY) -> None:
+        """
+        Lets a background thread persist the changes instead of writing them before add_database_entry,
+        update_entry and delete_entry return. flush() has to be called before anything else uses the file
+        :param delay: Seconds without a new change before the changes get persisted
+        """
+        self.__check_writable__()
+
+        if self.write_behind is None:
+            self.write_behind = WriteBehindWorker(self.__persist_pending__, delay=delay)
+
+    def disable_write_behind(self) -> None:
+        """
+        Persists everything that is still pending and stops the background writer
+        """
+        if self.write_behind is not None:
+            self.write_behind.stop()
+            self.write_behind = None
+
+    def flush(self) -> None:
+        """
+        Blocks until every change is persisted if the db is in write behind mode
+        """
+        if self.write_behind is not None:
+            self.write_behind.flush()
+
+    def lock(self, keep_session_key: bool = False) -> None:
+        """
+        Locks the database by wiping its session key and the decrypted entries from memory.
+        Pending changes get persisted first
+        :param keep_session_key: Keeps the cached key of the file, for when another instance of the same file
+                                 is still in use
+        """
+        self.disable_write_behind()
+        self.__wait_for_search_index__()
+
+        if not keep_session_key:
+            key_cache.wipe(self.get_absolute_path())
+
+        self.content = list()
+        self.entry_positions = dict()
+        self.password = ""
+
+        self.search_index = None
+        self.sorted_entries = None
+
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+        if constants.db_file is self:
+            constants.db_file = None
+
+    def get_absolute_path(self) -> str:
+        """
+        Gets the absolute path of this db
+        :return: The absolute path
+        """
+        return str(pathlib.Path(self.path).absolute())
+
+    def __check_writable__(self) -> None:
+        if self.read_only:
+            raise errors.DatabaseReadOnlyException
+
+    def __get_position__(self, entry_id: str) -> int:
+        position = self.entry_positions.get(entry_id)
+
+        if position is None:
+            raise ValueError(f"There is no entry with the id {entry_id}")
+
+        return position
+
+    def __insert_entry__(self, entry: DatabaseEntry) -> None:
+        self.entry_positions[entry.entry_id] = len(self.content)
+        self.content.append(entry)
+
+        self.__on_entry_added__(entry)
+
+    def __replace_entry__(self, entry_id: str, new_entry: DatabaseEntry) -> None:
+        position = self.__get_position__(entry_id)
+
+        self.__on_entry_removed__(self.content[position])
+
+        new_entry.entry_id = entry_id
+        self.content[position] = new_entry
+
+        self.__on_entry_added__(new_entry)
+
+    def __remove_entry__(self, entry_id: str) -> None:
+        position = self.__get_position__(entry_id)
+        del self.entry_positions[entry_id]
+
+        removed_entry = self.content[position]
+
+        # the last entry takes the place of the removed one, so nothing has to be shifted
+        last_entry = self.content.pop()
+
+        if last_entry is not removed_entry:
+            self.content[position] = last_entry
+            self.entry_positions[last_entry.entry_id] = position
+
+        self.__on_entry_removed__(removed_entry)
+
+    def __on_entry_added__(self, entry: DatabaseEntry) -> None:
+        self.sorted_entries = None
+
+        if self.search_index is not None:
+            for _, fields in self.__iter_search_fields__([entry]):
+                self.search_index.add(entry.entry_id, fields)
+
+    def __on_entry_removed__(self, entry: DatabaseEntry) -> None:
+        self.sorted_entries = None
+
+        if self.search_index is not None:
+            for _, fields in self.__iter_search_fields__([entry]):
+                self.search_index.remove(entry.entry_id, fields)
+
+    def __build_search_index__(self) -> None:
+        """
+        Builds the search index over all entries. The website or usage is already decrypted with the index of the
+        file, only sealed search fields have to be decrypted, and they are streamed chunk by chunk without
+        unsealing the entries
+        """
+        search_index = SearchIndex(self.search_fields)
+
+        for entry, fields in self.__iter_search_fields__(self.content):
+            search_index.add(entry.entry_id, fields)
+
+        self.search_index = search_index
+
+    def __build_search_index_in_background__(self) -> None:
+        # no entry can change while the index is built, it would miss the change
+        with self.write_lock, instrumentation.span("db.search_index") as index_span:
+            try:
+                self.__build_search_index__()
+            except (InvalidToken, InvalidTag, ValueError, errors.DatabaseFormatException):
+                # a damaged entry is left to the first search, which builds the index again and gets the error itself
+                return
+
+            index_span.add("entries", len(self.content))
+
+    def __wait_for_search_index__(self) -> None:
+        if self.search_index_thread is not None:
+            self.search_index_thread.join()
+            self.search_index_thread = None
+
+    def __iter_search_fields__(self, entries: list[DatabaseEntry]):
+        """
+        Produces the fields of entries that can be searched, see iter_entry_fields()
+        :param entries: The entries
+        :return: Generator of (entry, dict of the fields)
+        """
+        if not any(field in SEALED_FIELDS for field in self.search_fields):
+            return ((entry, {"website_or_usage": entry.website_or_usage}) for entry in entries)
+
+        return self.iter_entry_fields(entries)
+
+    # ======================= File format stuff ====================================
+
+    def __write_binary_content__(self, content: list[DatabaseEntry], f) -> None:
+        """
+        Writes the salt and the given entries in the binary format. Entries are serialized, chunked, encrypted
+        in parallel and written as they are produced, so only a few chunks are in memory at once. Entries that
+        are still sealed stay sealed, their chunks are only decrypted to copy their lines over
+        :param content: The entries to write
+        :param f: The file to write to, opened in binary mode
+        """
+        header = vault_format.pack_header(self.salt, self.kdf_parameters, self.compression)
+
+        f.write(header)
+
+        # the chunk counts are only known at the end
+        counts_offset = f.tell()
+        f.write(vault_format.CHUNK_COUNTS.pack(0, 0))
+
+        entry_chunks = []
+
+        data_chunks = vault_format.iter_chunks(self.__iter_data_lines__(content), on_line=entry_chunks.append)
+        data_chunk_count = self.__write_chunks__(f, header, vault_format.SECTION_DATA, data_chunks)
+
+        index_chunks = vault_format.iter_chunks(json.dumps([entry.entry_id, entry.website_or_usage, chunk, entry.modified]).encode() + b"\n"
+                                                for entry, chunk in zip(content, entry_chunks))
+        index_chunk_count = self.__write_chunks__(f, header, vault_format.SECTION_INDEX, index_chunks)
+
+        end_offset = f.tell()
+
+        f.seek(counts_offset)
+        f.write(vault_format.CHUNK_COUNTS.pack(index_chunk_count, data_chunk_count))
+        f.seek(end_offset)
+
+    def __write_chunks__(self, f, context: bytes, section: bytes, chunks) -> int:
+        """
+        Encrypts chunks in parallel and writes them as blobs in order
+        :param f: The file to write to
+        :param context: The header of the file
+        :param section: The section of the chunks
+        :param chunks: Iterable of (number, chunk, is_last) like vault_format.iter_chunks() produces it
+        :return: The number of chunks that were written
+        """
+        def encrypt_chunk(item) -> bytes:
+            number, chunk, is_last = item
+            return self.encrypt_record(self.__compress_chunk__(chunk, self.compression), vault_format.get_chunk_associated_data(context, section, number, is_last))
+
+        chunk_count = 0
+
+        for blob in vault_format.parallel_imap(encrypt_chunk, chunks):
+            f.write(vault_format.pack_blob(blob))
+            chunk_count += 1
+
+        return chunk_count
+
+    def __iter_data_lines__(self, content: list[DatabaseEntry]):
+        """
+        Produces the data line of every entry. Chunks of sealed entries are decrypted in parallel ahead of
+        where they are needed and dropped once their last entry was produced
+        :param content: The entries
+        :return: Generator of the data lines
+        """
+        # read only once per entry, the entry might get unsealed by another thread in the meantime
+        sealed_contents = [entry.sealed_content for entry in content]
+        unseal_functions = [entry.unseal_function for entry in content]
+
+        sealed_chunks = []
+        last_uses = {}
+
+        for position, sealed_content in enumerate(sealed_contents):
+            if isinstance(sealed_content, vault_format.SealedChunk):
+                if id(sealed_content) not in last_uses:
+                    sealed_chunks.append(sealed_content)
+
+                last_uses[id(sealed_content)] = position
+
+        decrypted_chunks = zip(sealed_chunks, vault_format.parallel_imap(self.__decrypt_chunk_lines__, sealed_chunks))
+        ready_chunks = {}
+
+        for position, (entry, sealed_content) in enumerate(zip(content, sealed_contents)):
+            if isinstance(sealed_content, vault_format.SealedChunk):
+                key = id(sealed_content)
+
+                while key not in ready_chunks:
+                    sealed_chunk, lines = next(decrypted_chunks)
+                    ready_chunks[id(sealed_chunk)] = lines
+
+                yield ready_chunks[key][entry.entry_id]
+
+                if last_uses[key] == position:
+                    del ready_chunks[key]
+
+            else:
+                unseal_function = unseal_functions[position]
+
+                # entries read from a json file or version 1 are sealed on their own and stay sealed
+                if sealed_content is not None and unseal_function is not None:
+                    fields = unseal_function(sealed_content, entry.entry_id)
+                else:
+                    fields = entry.get_sealed_fields()
+
+                yield json.dumps([entry.entry_id, fields.get("username"), fields.get("description"), fields.get("password")]).encode() + b"\n"
+
+    def __read_binary_content__(self, f) -> str:
+        """
+        Reads the entries of a database file in the binary format. The file is read blob by blob, and only the
+        index chunks get decrypted, in parallel and one window of chunks at a time. Data chunks of a memory mapped
+        file aren't read at all, they only remember where they are in the mapping
+        :param f: The database file opened in binary mode or the memory mapping of it, at its start
+        :return: The raw journal after the body
+        """
+        header = vault_format.read_header(f)
+
+        self.salt = header.get("salt")
+        self.kdf_parameters = header.get("kdf_parameters")
+        self.compression = header.get("compression")
+        self.storage_format = FORMAT_BINARY
+
+        if header.get("version") == 1:
+            return self.__read_binary_v1_content__(f.read(), header, 0)
+
+        counts = f.read(vault_format.CHUNK_COUNTS.size)
+
+        if len(counts) != vault_format.CHUNK_COUNTS.size:
+            raise errors.DatabaseFormatException("The database file is truncated")
+
+        index_chunk_count, data_chunk_count = vault_format.CHUNK_COUNTS.unpack(counts)
+
+        if header.get("version") == 2:
+            context = header.get("raw") + counts
+            sections = (vault_format.SECTION_INDEX, vault_format.SECTION_DATA)
+        else:
+            context = header.get("raw")
+            sections = (vault_format.SECTION_DATA, vault_format.SECTION_INDEX)
+
+        index_chunks = []
+        sealed_chunks = []
+
+        for section in sections:
+            if section == vault_format.SECTION_INDEX:
+                for i in range(index_chunk_count):
+                    index_chunks.append((vault_format.read_blob(f), vault_format.get_chunk_associated_data(context, section, i, i == index_chunk_count - 1)))
+            else:
+                for i in range(data_chunk_count):
+                    associated_data = vault_format.get_chunk_associated_data(context, section, i, i == data_chunk_count - 1)
+
+                    if f is self.mapping:
+                        start, end = vault_format.skip_blob(f)
+                        sealed_chunks.append(vault_format.SealedChunk(self.mapping, associated_data, start, end, self.compression))
+                    else:
+                        sealed_chunks.append(vault_format.SealedChunk(vault_format.read_blob(f), associated_data, compression=self.compression))
+
+        unseal_function = self.__unseal_chunk_entry__
+
+        # index lines before version 4 have no modification clock
+        for entry_id, website_or_usage, chunk, *modified in self.__iter_index_lines__(index_chunks):
+            if chunk >= data_chunk_count:
+                raise errors.DatabaseFormatException("An entry points to a chunk that doesn't exist")
+
+            self.__insert_entry__(DatabaseEntry.from_sealed(entry_id=entry_id,
+                                                            website_or_usage=website_or_usage,
+                                                            sealed_content=sealed_chunks[chunk],
+                                                            unseal_function=unseal_function,
+                                                            modified=modified[0] if modified else 0))
+
+        return f.read().decode()
+
+    def __iter_index_lines__(self, index_chunks: list):
+        """
+        Decrypts the index chunks in parallel and parses their lines one after another. The list of encrypted
+        chunks is emptied while reading, so every chunk only stays in memory until it was parsed
+        :param index_chunks: List of (blob, associated data) of every index chunk
+        :return: Generator of [id, website_or_usage, number of the data chunk, modification clock]
+        """
+        def take_chunks():
+            index_chunks.reverse()
+
+            while index_chunks:
+                yield index_chunks.pop()
+
+        def open_index_chunk(item) -> bytes:
+            blob, associated_data = item
+            return self.__decompress_chunk__(self.decrypt_record(blob, associated_data), self.compression)
+
+        for index_chunk in vault_format.parallel_imap(open_index_chunk, take_chunks()):
+            for line in index_chunk.splitlines():
+                yield json.loads(line)
+
+    def __read_binary_v1_content__(self, data: bytes, header: dict, offset: int) -> str:
+        """
+        Reads the entries of a database file in version 1 of the binary format, which has the index in a single
+        blob and every entry in its own blob
+        :param data: The content of the database file
+        :param header: The unpacked header
+        :param offset: The offset of the body
+        :return: The raw journal after the body
+        """
+        entry_count, offset = vault_format.unpack_uint32(data, offset)
+        raw_index, offset = vault_format.unpack_blob(data, offset)
+
+        index: list = json.loads(self.decrypt_record(raw_index, header.get("raw") + vault_format.pack_uint32(entry_count)))
+
+        if len(index) != entry_count:
+            raise errors.DatabaseFormatException("The index doesn't match the amount of entries")
+
+        unseal_function = self.__unseal_binary_v1_entry__
+
+        for raw_entry in index:
+            sealed_content, offset = vault_format.unpack_blob(data, offset)
+
+            self.__insert_entry__(DatabaseEntry.from_sealed(entry_id=raw_entry.get("id"),
+                                                            website_or_usage=raw_entry.get("website_or_usage"),
+                                                            sealed_content=sealed_content,
+                                                            unseal_function=unseal_function))
+
+        return data[offset:].decode()
+
+    def __decrypt_chunk_lines__(self, sealed_chunk: vault_format.SealedChunk) -> dict[str, bytes]:
+        """
+        Decrypts a data chunk into the raw lines of its entries
+        :param sealed_chunk: The chunk to decrypt
+        :return: A dict of the id of every entry in the chunk to its line
+        """
+        lines = {}
+
+        for line in self.__open_sealed_chunk__(sealed_chunk).splitlines(keepends=True):
+            lines[json.loads(line)[0]] = line
+
+        return lines
+
+    def __unseal_chunk_entry__(self, sealed_chunk: vault_format.SealedChunk, entry_id: str) -> dict:
+        # the whole chunk gets decrypted once, and every entry takes its fields out of it when it gets unsealed
+        if sealed_chunk.entries is None:
+            sealed_chunk.entries = {fields[0]: fields for fields in map(json.loads, self.__open_sealed_chunk__(sealed_chunk).splitlines())}
+
+        _, username, description, password = sealed_chunk.entries.pop(entry_id)
+
+        return {"username": username, "description": description, "password": password}
+
+    def __open_sealed_chunk__(self, sealed_chunk: vault_format.SealedChunk) -> bytes:
+        # the chunk keeps the compression of the file it came from, the db might have been converted since
+        return self.__decompress_chunk__(self.decrypt_record(sealed_chunk.blob, sealed_chunk.associated_data), sealed_chunk.compression)
+
+    @staticmethod
+    def __compress_chunk__(chunk: bytes, compression: str) -> bytes:
+        if compression == compression_module.NONE:
+            return chunk
+
+        with instrumentation.span("compression.compress", bytes=len(chunk)):
+            return compression_module.compress(chunk, compression)
+
+    @staticmethod
+    def __decompress_chunk__(chunk: bytes, compression: str) -> bytes:
+        if compression == compression_module.NONE:
+            return chunk
+
+        with instrumentation.span("compression.decompress", bytes=len(chunk)):
+            return compression_module.decompress(chunk, compression)
+
+    def __unseal_binary_v1_entry__(self, sealed_content: bytes, entry_id: str) -> dict:
+        return json.loads(self.decrypt_record(sealed_content, entry_id.encode()))
+
+    def __unseal_json_entry__(self, sealed_content: str, entry_id: str) -> dict:
+        return json.loads(self.decrypt_content(sealed_content))
+
+    def __serialize_content__(self, content: list[DatabaseEntry]) -> dict:
+        """
+        Serializes the salt and the given entries into the per entry format. Entries that are still
+        sealed keep their encrypted fields, so only entries that got decrypted are encrypted again
+        :param content: The entries to serialize
+        :return: The json document of the database file
+        """
+        index = []
+        entries = {}
+
+        for entry in content:
+            entry_id = entry.entry_id
+
+            index.append({"id": entry_id, "website_or_usage": entry.website_or_usage, "modified": entry.modified})
+
+            # read only once, the entry might get unsealed by another thread in the meantime
+            sealed_content = entry.sealed_content
+
+            if isinstance(sealed_content, str):
+                entries[entry_id] = sealed_content
+            else:
+                entries[entry_id] = self.encrypt_content(json.dumps(entry.get_sealed_fields()))
+
+        return {
+            "salt": self.salt.decode(),
+            "kdf": self.kdf_parameters.to_dict(),
+            "format": FORMAT_PER_ENTRY,
+            "index": self.encrypt_content(json.dumps(index)),
+            "entries": entries
+        }
+
+    def __write_file__(self) -> None:
+        """
+        Atomically replaces the database file with the current content of this db and compacts the journal
+        away. Only the changes other dbs persisted since this db read or changed the file get read, and a crash
+        while writing leaves either the old or the new file behind. Has to be called with the io_lock held
+        """
+        with self.__lock_file__():
+            if os.path.exists(self.get_absolute_path()):
+                # a compaction must not drop what other dbs appended or wrote in the meantime
+                self.__catch_up_file__()
+
+            self.__write_content__()
+
+    def __write_content__(self) -> None:
+        """
+        Replaces the database file with the current content of this db, see __write_file__().
+        Has to be called with the io_lock and the file lock held
+        """
+        with self.write_lock:
+            content = list(self.content)
+            change_count = self.change_counter
+
+            # everything that is pending is part of the content that gets written
+            self.pending_records = list()
+            self.needs_full_write = False
+
+        if self.storage_format == FORMAT_BINARY:
+            mode = "wb"
+
+            def write_content(f) -> None:
+                with instrumentation.span("db.write.content"):
+                    self.__write_binary_content__(content, f)
+
+        else:
+            mode = "w"
+
+            def write_content(f) -> None:
+                with instrumentation.span("db.write.content"):
+                    json.dump(self.__serialize_content__(content), f, indent=2)
+                    f.write("\n")
+
+        with instrumentation.span("db.write", entries=len(content)) as write_span:
+            try:
+                utils.write_file_atomically(self.get_absolute_path(), write_content, fsync_directory=self.fsync_directory, mode=mode)
+            except BaseException:
+                self.needs_full_write = True
+                raise
+
+            self.file_identity = self.__get_file_identity__()
+
+            write_span.add("bytes", self.file_identity[2])
+
+        self.journal_records = 0
+        self.journal_size = 0
+
+        self.__forget_persisted_changes__(change_count)
+
+    def __read_per_entry_content__(self, db_content: dict) -> None:
+        """
+        Reads the entries of a database file in the per entry format. Only the index gets decrypted
+        :param db_content: The json document of the database file
+        """
+        entries: dict = db_content.get("entries")
+        unseal_function = self.__unseal_json_entry__
+
+        def to_entry(raw_entry: dict) -> DatabaseEntry:
+            return DatabaseEntry.from_sealed(entry_id=raw_entry.get("id"),
+                                             website_or_usage=raw_entry.get("website_or_usage"),
+                                             sealed_content=entries.get(raw_entry.get("id")),
+                                             unseal_function=unseal_function,
+                                             modified=raw_entry.get("modified", 0))
+
+        # the entries are created while parsing, so the list of raw dicts never exists as a whole
+        for entry in json.loads(self.decrypt_content(db_content.get("index")), object_hook=to_entry):
+            self.__insert_entry__(entry)
+
+    def __read_legacy_content__(self, db_content: dict) -> None:
+        """
+        Reads the entries of a database file that stores all of them in a single encrypted blob
+        :param db_content: The json document of the database file
+        """
+        legacy_ids = set()
+
+        def to_entry(raw_entry: dict) -> DatabaseEntry:
+            if raw_entry.get("id") is None:
+                raw_entry["id"] = get_legacy_entry_id(raw_entry, lambda entry_id: entry_id in legacy_ids)
+
+            legacy_ids.add(raw_entry.get("id"))
+
+            return DatabaseEntry.from_dict(raw_entry)
+
+        for entry in json.loads(self.decrypt_content(db_content.get("content")), object_hook=to_entry):
+            self.__insert_entry__(entry)
+
+    # ======================= Journal stuff ========================================
+
+    @staticmethod
+    def __split_file_content__(file_content: str) -> (dict, str):
+        """
+        Splits the content of the database file into the json document and the journal after it
+        :param file_content: The content of the database file
+        :return: The parsed json document and the raw journal
+        """
+        db_content, end = json.JSONDecoder().raw_decode(file_content)
+
+        return db_content, file_content[end:]
+
+    def __save_change__(self, record: dict, should_write: bool) -> None:
+        """
+        Queues a single change to be persisted, either right away or by the background writer.
+        Has to be called with the write_lock held
+        :param record: The journal record describing the change
+        :param should_write: If we should write to disk
+        """
+        self.change_counter += 1
+        self.unpersisted_changes[record.get("entry").get("id")] = self.change_counter
+
+        if not should_write or self.in_transaction:
+            self.needs_full_write = True
+            return
+
+        self.pending_records.append(record)
+
+        self.__request_persist__()
+
+    def __request_persist__(self) -> None:
+        if self.write_behind is not None:
+            self.write_behind.schedule()
+        else:
+            self.__persist_pending__()
+
+    def __persist_pending__(self) -> None:
+        """
+        Persists the pending changes by appending them to the journal. Falls back to a full write if journaling
+        is disabled, the journal got too big or there are older changes that were never written
+        """
+        with self.io_lock:
+            with self.write_lock:
+                records, self.pending_records = self.pending_records, list()
+                change_count = self.change_counter
+                full_write = self.needs_full_write or not self.journaled
+
+            if full_write:
+                self.__write_file__()
+                return
+
+            if not records:
+                return
+
+            path = pathlib.Path(self.path)
+
+            with self.__lock_file__():
+                try:
+                    if not path.exists():
+                        raise errors.DatabasePathDoesNotExistException
+
+                    can_append = self.__catch_up_file__()
+
+                except BaseException:
+                    # the in memory entries already contain the changes, so a full write persists them as well
+                    self.needs_full_write = True
+                    raise
+
+                max_records = max(JOURNAL_MIN_RECORDS, int(len(self.content) * JOURNAL_MAX_RATIO))
+
+                # the file was taken over already, so the full write doesn't need to catch up again
+                if not can_append or self.needs_full_write or self.journal_records + len(records) > max_records:
+                    self.__write_content__()
+                    return
+
+                encrypted_records = ""
+
+                for i, record in enumerate(records):
+                    record["seq"] = self.journal_records + i
+
+                    encrypted_records += self.encrypt_content(json.dumps(record)) + "\n"
+
+                if self.journal_size + len(encrypted_records) > JOURNAL_MAX_BYTES:
+                    self.__write_content__()
+                    return
+
+                try:
+                    with instrumentation.span("db.journal.append", records=len(records), bytes=len(encrypted_records)):
+                        with open(str(path.absolute()), "a") as f:
+                            f.write(encrypted_records)
+
+                            f.flush()
+                            os.fsync(f.fileno())
+
+                except BaseException:
+                    self.needs_full_write = True
+                    raise
+
+                self.journal_records += len(records)
+                self.journal_size += len(encrypted_records)
+
+                device, inode, size = self.file_identity
+                self.file_identity = (device, inode, size + len(encrypted_records))
+
+                self.__forget_persisted_changes__(change_count)
+
+    def __forget_persisted_changes__(self, change_count: int) -> None:
+        """
+        Forgets the entries whose last change is persisted now
+        :param change_count: The change_counter when the persisted changes were taken
+        """
+        with self.write_lock:
+            self.unpersisted_changes = {entry_id: number for entry_id, number in self.unpersisted_changes.items() if number > change_count}
+
+    def __catch_up_file__(self) -> bool:
+        """
+        Takes over the changes other dbs on the same file persisted since this db read or changed the file the last
+        time. Their journal records get replayed and the numbering continues after them, a file they replaced gets
+        read again. Entries this db changed and didn't persist yet keep the version of this db.
+        Has to be called with the io_lock and the file lock held
+        :return: If the journal can be appended to, False if the file has to be written in full
+        """
+        if self.file_identity is None:
+            return False
+
+        device, inode, size = self.file_identity
+        current_device, current_inode, current_size = self.__get_file_identity__()
+
+        if (current_device, current_inode) != (device, inode) or current_size < size:
+            return self.__take_over_replaced_file__()
+
+        if current_size == size:
+            return True
+
+        with open(self.get_absolute_path(), "rb") as f:
+            f.seek(size)
+            appended = f.read(current_size - size)
+
+        # a partially written record stays in the file until the next full write, nothing can be appended after it
+        complete_size = appended.rfind(b"\n") + 1
+
+        with self.write_lock:
+            self.__replay_journal_lines__(appended[:complete_size].decode(errors="replace").split("\n")[:-1], self.unpersisted_changes)
+
+        self.file_identity = (device, inode, size + complete_size)
+
+        return complete_size == len(appended)
+
+    def __take_over_replaced_file__(self) -> bool:
+        """
+        Reads the database file again after another db replaced it and takes over its entries, except the ones this
+        db changed and didn't persist yet. Has to be called with the io_lock and the file lock held
+        :return: If the journal of the file can be appended to, False if it has to be written in full
+        """
+        replaced_db = Database(self.path, self.password, journaled=self.journaled, search_fields=self.search_fields)
+
+        try:
+            replaced_db.__read_file__()
+
+            # the entries of the other file are decrypted with its key, which doesn't have to be the one of this db
+            entries = self.__get_plain_entries__(replaced_db)
+
+        except (InvalidToken, InvalidTag, ValueError, errors.DatabaseFormatException):
+            # the file can't be read with the password of this db anymore, the full write replaces it again
+            return False
+
+        finally:
+            replaced_db.lock(keep_session_key=True)
+
+        with self.write_lock:
+            entries = [entry for entry in entries if entry.entry_id not in self.unpersisted_changes]
+            taken_over_ids = {entry.entry_id for entry in entries}
+
+            # entries this db changed were created in memory, so none of them is sealed with the old key
+            for entry_id in self.unpersisted_changes:
+                if entry_id in self.entry_positions and entry_id not in taken_over_ids:
+                    entries.append(self.get_entry_by_id(entry_id))
+
+            self.__take_over_entries__(entries)
+
+            # the other db may have encrypted the file with a new key (see rekey()), which is kept
+            self.salt = replaced_db.salt
+            self.kdf_parameters = replaced_db.kdf_parameters
+
+        self.file_identity = replaced_db.file_identity
+        self.journal_records = replaced_db.journal_records
+        self.journal_size = replaced_db.journal_size
+
+        if replaced_db.needs_full_write:
+            self.needs_full_write = True
+
+        # records of this db can only be appended to a file with the same format
+        return (replaced_db.storage_format, replaced_db.compression) == (self.storage_format, self.compression)
+
+    @staticmethod
+    def __get_plain_entries__(db) -> list[DatabaseEntry]:
+        """
+        Decrypts all entries of a db
+        :param db: The db
+        :return: The entries with all of their fields decrypted
+        """
+        return [DatabaseEntry(website_or_usage=fields.get("website_or_usage"), username=fields.get("username"),
+                              description=fields.get("description"), password=fields.get("password"),
+                              entry_id=entry.entry_id, modified=entry.modified)
+                for entry, fields in db.iter_entry_fields()]
+
+    def __take_over_entries__(self, entries: list[DatabaseEntry]) -> None:
+        """
+        Replaces all entries of this db. Has to be called with the write_lock held
+        :param entries: The new entries
+        """
+        self.content = list()
+        self.entry_positions = dict()
+
+        self.sorted_entries = None
 
-        self.content.pop(self.content.index(entry))
+        # entries that are taken over are decrypted already, so they are added to a new index one by one
+        if self.search_index is not None:
+            self.search_index = SearchIndex(self.search_fields)
 
-        if should_write:
-            self.write()
+        for entry in entries:
+            self.__insert_entry__(entry)
+
+    def __get_file_identity__(self) -> tuple:
+        file_stat = os.stat(self.get_absolute_path())
+
+        return file_stat.st_dev, file_stat.st_ino, file_stat.st_size
+
+    @contextlib.contextmanager
+    def __lock_file__(self):
+        """
+        Holds the lock file of this db, so other processes don't append or write at the same time. Can be nested,
+        only the outermost one locks. Has to be called with the io_lock held
+        """
+        if self.file_lock_depth > 0:
+            self.file_lock_depth += 1
+
+            try:
+                yield
+            finally:
+                self.file_lock_depth -= 1
+
+            return
+
+        with utils.lock_file(self.get_absolute_path() + LOCK_SUFFIX):
+            self.file_lock_depth = 1
+
+            try:
+                yield
+            finally:
+                self.file_lock_depth = 0
+
+    def __replay_journal__(self, journal: str) -> None:
+        """
+        Applies the records of a journal to the content of this db
+        :param journal: The raw journal that came after the json document in the database file
+        """
+        lines = journal.split("\n")
+
+        # everything after the last newline is a record that was only partially written, so it gets dropped
+        # and the journal has to be compacted before anything can be appended again
+        if lines.pop().strip():
+            self.needs_full_write = True
+
+        self.__replay_journal_lines__(lines)
+
+    def __replay_journal_lines__(self, lines: list[str], skipped_entry_ids=()) -> None:
+        """
+        Applies complete journal records to the content of this db
+        :param lines: The lines of the records
+        :param skipped_entry_ids: Ids of entries whose records are counted but not applied
+        """
+        for line in lines:
+            if not line.strip():
+                continue
+
+            self.journal_records += 1
+            self.journal_size += len(line) + 1
+
+            try:
+                record: dict = json.loads(self.decrypt_content(line.strip()))
+
+                # two dbs appended with the same numbers, the records are still valid changes in the order of the file
+                if not isinstance(record, dict) or record.get("seq") != self.journal_records - 1:
+                    self.needs_full_write = True
+
+                if record.get("entry").get("id") in skipped_entry_ids:
+                    continue
+
+                self.__apply_journal_record__(record)
+
+            except (InvalidToken, ValueError, AttributeError, errors.DatabaseJournalCorruptedException):
+                # a record that can't be applied must not make the whole database unreadable
+                self.skipped_journal_records += 1
+                self.needs_full_write = True
+
+    def __apply_journal_record__(self, record: dict) -> None:
+        """
+        Applies a single journal record to the content of this db
+        :param record: The decrypted journal record
+        """
+        op = record.get("op")
+        raw_entry: dict = record.get("entry")
+
+        try:
+            if op == "add" and raw_entry.get("id") in self.entry_positions:
+                # the same record was appended twice
+                self.__replace_entry__(raw_entry.get("id"), DatabaseEntry.from_dict(raw_entry))
+
+            elif op == "add":
+                if raw_entry.get("id") is None:
+                    raw_entry["id"] = get_legacy_entry_id(raw_entry, lambda entry_id: entry_id in self.entry_positions)
+
+                self.__insert_entry__(DatabaseEntry.from_dict(raw_entry))
+
+            elif op == "update":
+                self.__replace_entry__(self.__get_record_entry_id__(record.get("old", raw_entry)), DatabaseEntry.from_dict(raw_entry))
+
+            elif op == "delete":
+                self.__remove_entry__(self.__get_record_entry_id__(raw_entry))
+
+            else:
+                raise errors.DatabaseJournalCorruptedException
+
+        except ValueError:
+            raise errors.DatabaseJournalCorruptedException
+
+    def __get_record_entry_id__(self, raw_entry: dict) -> str:
+        """
+        Gets the id of the entry a journal record points to
+        :param raw_entry: The entry of the journal record
+        :return: The id of the entry
+        """
+        if "id" in raw_entry:
+            return raw_entry.get("id")
+
+        # records that were written before entries had ids point to the entry by its values
+        return self.content[self.content.index(DatabaseEntry.from_dict(raw_entry))].entry_id
 
     # ======================= Encryption stuff =====================================
 
     def __gen_fernet_key__(self) -> bytes:
         """
-        Generates a key using the password and salt of this db
+        Generates a key using the password, salt and kdf of this db
         :return: Key in bytes
         """
-        byte_password = self.password.encode()
+        with instrumentation.span("kdf.derive"):
+            return base64.urlsafe_b64encode(self.kdf_parameters.derive(self.password.encode(), self.salt))
 
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA512_256(),
-            length=32,
-            salt=self.salt,
-            iterations=100000,
-            backend=default_backend()
-        )
+    def __get_keys__(self) -> key_cache.SessionKeys:
+        """
+        Gets the keys of this db. The key is only derived once per session and cached afterwards
+        :return: The keys
+        """
+        kdf_params = self.kdf_parameters.as_tuple()
 
-        return base64.urlsafe_b64encode(kdf.derive(byte_password))
+        keys = key_cache.get(self.get_absolute_path(), self.salt, kdf_params, self.password)
+
+        if keys is None:
+            keys = key_cache.put(self.get_absolute_path(), self.salt, kdf_params, self.password, self.__gen_fernet_key__())
+
+        return keys
+
+    def __get_fernet__(self) -> Fernet:
+        return self.__get_keys__().fernet
+
+    def encrypt_record(self, data: bytes, associated_data: bytes) -> bytes:
+        """
+        Encrypts data for the binary format
+        :param data: The data to encrypt
+        :param associated_data: Data that isn't encrypted but has to be the same when decrypting
+        :return: The nonce followed by the ciphertext
+        """
+        nonce = os.urandom(vault_format.NONCE_LENGTH)
+
+        with instrumentation.span("aead.encrypt", bytes=len(data)):
+            return nonce + self.__get_keys__().aead.encrypt(nonce, data, associated_data)
+
+    def decrypt_record(self, record: bytes, associated_data: bytes) -> bytes:
+        """
+        Decrypts data of the binary format
+        :param record: The nonce followed by the ciphertext
+        :param associated_data: The associated data it was encrypted with
+        :return: The decrypted data
+        """
+        try:
+            with instrumentation.span("aead.decrypt", bytes=len(record)):
+                return self.__get_keys__().aead.decrypt(record[:vault_format.NONCE_LENGTH], record[vault_format.NONCE_LENGTH:], associated_data)
+        except InvalidTag:
+            # wrong password or a modified file, raised as InvalidToken like with the json format
+            raise InvalidToken
 
     def encrypt_content(self, content: str) -> str:
         """
@@ -188,8 +1475,10 @@ class Database:
         :param content: String to encrypt
         :return: Encrypted string
         """
-        fernet = Fernet(self.__gen_fernet_key__())
-        encrypted_data = fernet.encrypt(content.encode())
+        fernet = self.__get_fernet__()
+
+        with instrumentation.span("fernet.encrypt", bytes=len(content)):
+            encrypted_data = fernet.encrypt(content.encode())
 
         return encrypted_data.decode()
 
@@ -199,7 +1488,9 @@ class Database:
         :param content: String to decrypt
         :return: Decrypted String
         """
-        fernet = Fernet(self.__gen_fernet_key__())
-        decrypted_data = fernet.decrypt(content.encode())
+        fernet = self.__get_fernet__()
+
+        with instrumentation.span("fernet.decrypt", bytes=len(content)):
+            decrypted_data = fernet.decrypt(content.encode())
 
         return decrypted_data.decode()
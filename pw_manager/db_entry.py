@@ -1,5 +1,60 @@
+import hashlib
+import json
+import time
+import uuid
+
+
+# Fields that are encrypted on their own per entry and only decrypted when they are accessed
+SEALED_FIELDS = ("username", "description", "password")
+
+
+def generate_entry_id() -> str:
+    """
+    Generates a new unique id for an entry
+    :return: The id
+    """
+    return uuid.uuid4().hex
+
+
+def get_legacy_entry_id(raw_entry: dict, is_taken) -> str:
+    """
+    Gets the id of an entry from a file that didn't store ids yet. It is derived from the fields, so every
+    installation that reads the same file gives the entry the same id and merge syncs can match it
+    :param raw_entry: The dict of the entry
+    :param is_taken: Function that checks if an id is used by another entry already, which happens for entries
+                     with exactly the same fields. They are numbered in the order of the file
+    :return: The id
+    """
+    fields = [raw_entry.get("website_or_usage"), raw_entry.get("username"), raw_entry.get("description"), raw_entry.get("password")]
+    number = 0
+
+    while True:
+        entry_id = hashlib.sha256(json.dumps(fields + [number]).encode()).hexdigest()[:32]
+
+        if not is_taken(entry_id):
+            return entry_id
+
+        number += 1
+
+
+def next_modification_clock(previous: int = 0) -> int:
+    """
+    Gets the modification clock of an entry that gets changed now. It is the time in milliseconds, but always
+    ahead of the clock the entry had before, so a change is never older than the one it replaced
+    :param previous: The modification clock the entry had before
+    :return: The new modification clock
+    """
+    return max(time.time_ns() // 1000000, previous + 1)
+
+
 class DatabaseEntry:
-    def __init__(self, website_or_usage: str, username: str, description: str, password: str):
+    # no per instance __dict__, which saves about a third of the memory of every entry (see benchmarks/entry_memory.py)
+    __slots__ = ("entry_id", "modified", "website_or_usage", "username", "description", "password", "sealed_content", "unseal_function")
+
+    def __init__(self, website_or_usage: str, username: str, description: str, password: str, entry_id: str = None, modified: int = 0):
+        self.entry_id = entry_id if entry_id is not None else generate_entry_id()
+        # modification clock of the last change, 0 for entries that were never changed since clocks were stored
+        self.modified = modified
         self.website_or_usage = website_or_usage
         self.username = username
         self.description = description
@@ -7,6 +62,70 @@ class DatabaseEntry:
             raise AttributeError("AHH WARUM KEIN STRING")
         self.password = password
 
+        self.sealed_content = None
+        self.unseal_function = None
+
+    @staticmethod
+    def from_sealed(entry_id: str, website_or_usage: str, sealed_content: str, unseal_function, modified: int = 0):
+        """
+        Creates an entry whose sealed fields are only decrypted once one of them gets accessed
+        :param entry_id: The id of the entry
+        :param website_or_usage: The website or usage
+        :param sealed_content: The encrypted sealed fields
+        :param unseal_function: Function that decrypts the sealed content and id of an entry into a dict of the sealed fields
+        :param modified: The modification clock of the entry
+        :return: The entry
+        """
+        entry = DatabaseEntry.__new__(DatabaseEntry)
+
+        entry.entry_id = entry_id
+        entry.modified = modified
+        entry.website_or_usage = website_or_usage
+        entry.sealed_content = sealed_content
+        entry.unseal_function = unseal_function
+
+        return entry
+
+    def __getattr__(self, name):
+        # only gets called for attributes that aren't set, which are the sealed fields of a lazily loaded entry
+        if name not in SEALED_FIELDS or self.sealed_content is None:
+            raise AttributeError(name)
+
+        self.__unseal__()
+
+        return getattr(self, name)
+
+    def __unseal__(self) -> None:
+        """
+        Decrypts the sealed fields of this entry
+        """
+        sealed_fields: dict = self.unseal_function(self.sealed_content, self.entry_id)
+
+        self.username = sealed_fields.get("username")
+        self.description = sealed_fields.get("description")
+        self.password = sealed_fields.get("password")
+
+        self.sealed_content = None
+        self.unseal_function = None
+
+    def is_sealed(self) -> bool:
+        """
+        Checks if the sealed fields of this entry weren't decrypted yet
+        :return: If the entry is still sealed
+        """
+        return self.sealed_content is not None
+
+    def get_sealed_fields(self) -> dict:
+        """
+        Gets the fields that are encrypted on their own in the per entry format
+        :return: The sealed fields as a dict
+        """
+        return {
+            "username": self.username,
+            "description": self.description,
+            "password": self.password
+        }
+
     def __eq__(self, other):
         if not isinstance(other, DatabaseEntry):
             return False
@@ -23,3 +142,32 @@ class DatabaseEntry:
             return False
 
         return self.website_or_usage < other.website_or_usage
+
+    def to_dict(self) -> dict:
+        """
+        Converts the entry to the dict that is stored in the database file
+        :return: The entry as a dict
+        """
+        return {
+            "id": self.entry_id,
+            "modified": self.modified,
+            "website_or_usage": self.website_or_usage,
+            "username": self.username,
+            "description": self.description,
+            "password": self.password
+        }
+
+    @staticmethod
+    def from_dict(raw_entry: dict):
+        """
+        Creates an entry from the dict that is stored in the database file. Entries from files that didn't
+        store ids yet get a new one
+        :param raw_entry: The dict of the entry
+        :return: The entry
+        """
+        return DatabaseEntry(website_or_usage=raw_entry.get("website_or_usage"),
+                             username=raw_entry.get("username"),
+                             description=raw_entry.get("description"),
+                             password=raw_entry.get("password"),
+                             entry_id=raw_entry.get("id"),
+                             modified=raw_entry.get("modified", 0))
@@ -0,0 +1,215 @@
+import contextlib
+import hashlib
+import socket
+import threading
+import time
+
+import paramiko
+
+
+"""
+Keeps one authenticated SSH transport with an open SFTP session per server and user for the whole session,
+so repeated syncs don't pay for the TCP connect, key exchange and authentication every time.
+
+Connections send keepalives so firewalls don't drop them while they are unused, and get closed once they were
+unused for IDLE_TIMEOUT seconds. A connection that died is noticed before it gets used and replaced by a new one.
+close_all() gets called by utils.exit_pw_manager().
+"""
+
+
+PORT = 22
+CONNECT_TIMEOUT = 15
+KEEPALIVE_INTERVAL = 30
+IDLE_TIMEOUT = 300
+
+
+class Connection:
+    def __init__(self, ssh: paramiko.SSHClient):
+        self.ssh = ssh
+        self.sftp: paramiko.SFTPClient = ssh.open_sftp()
+
+        self.last_used: float = time.monotonic()
+        self.in_use: int = 0
+
+    def is_alive(self) -> bool:
+        transport = self.ssh.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self) -> None:
+        try:
+            self.sftp.close()
+        finally:
+            self.ssh.close()
+
+
+class ConnectionPool:
+    def __init__(self, keepalive_interval: int = KEEPALIVE_INTERVAL, idle_timeout: float = IDLE_TIMEOUT):
+        """
+        :param keepalive_interval: Seconds between keepalive packets of an open connection
+        :param idle_timeout: Seconds a connection stays open without being used
+        """
+        self.keepalive_interval = keepalive_interval
+        self.idle_timeout = idle_timeout
+
+        # (server, port, username, digest of the password) -> connection
+        self.connections: dict[tuple, Connection] = dict()
+
+        self.condition = threading.Condition()
+        self.reaper: threading.Thread | None = None
+
+    @contextlib.contextmanager
+    def session(self, server: str, username: str, password: str, port: int = PORT, timeout: float = None):
+        """
+        Gets the SFTP session of a server, connecting to it only if there is no open connection yet.
+        If the connection breaks while the session is used, it gets closed so the next call starts over
+
+        with pool.session(server, username, password) as sftp:
+            sftp.stat(path)
+
+        :param server: The server
+        :param username: The username
+        :param password: The password
+        :param port: The port
+        :param timeout: Seconds a single sftp request may take before it fails, no limit if not given. Only applies
+                        to this session, the connection gets its previous timeout back afterwards
+        :return: Context manager of the paramiko.SFTPClient
+        """
+        key = (server, port, username, hashlib.sha256(password.encode()).digest())
+
+        connection = self.__acquire__(key, server, username, password, port)
+        channel = connection.sftp.get_channel()
+        previous_timeout = channel.gettimeout()
+
+        try:
+            channel.settimeout(timeout)
+
+            yield connection.sftp
+        except BaseException as e:
+            # errors like a missing remote file leave the connection usable
+            if not connection.is_alive() or isinstance(e, (paramiko.SSHException, EOFError, socket.timeout)):
+                self.__discard__(key, connection)
+            raise
+        finally:
+            channel.settimeout(previous_timeout)
+            self.__release__(connection)
+
+    def close(self, server: str) -> None:
+        """
+        Closes every connection to a server
+        :param server: The server
+        """
+        with self.condition:
+            keys = [key for key in self.connections.keys() if key[0] == server]
+            connections = [self.connections.pop(key) for key in keys]
+
+        for connection in connections:
+            connection.close()
+
+    def close_all(self) -> None:
+        """
+        Closes every connection
+        """
+        with self.condition:
+            connections = list(self.connections.values())
+            self.connections.clear()
+
+            self.condition.notify_all()
+
+        for connection in connections:
+            connection.close()
+
+    def __acquire__(self, key: tuple, server: str, username: str, password: str, port: int) -> Connection:
+        with self.condition:
+            connection = self.connections.get(key)
+
+            if connection is not None and connection.in_use == 0 and not connection.is_alive():
+                del self.connections[key]
+                connection.close()
+                connection = None
+
+            if connection is not None:
+                connection.in_use += 1
+                return connection
+
+        # connecting takes a while, so it happens without holding the lock
+        connection = self.__connect__(server, username, password, port)
+
+        with self.condition:
+            existing_connection = self.connections.get(key)
+
+            if existing_connection is not None and existing_connection.is_alive():
+                # another thread connected at the same time
+                existing_connection.in_use += 1
+                connection.close()
+                return existing_connection
+
+            self.connections[key] = connection
+            connection.in_use += 1
+
+            self.__start_reaper__()
+
+            return connection
+
+    def __release__(self, connection: Connection) -> None:
+        with self.condition:
+            connection.in_use -= 1
+            connection.last_used = time.monotonic()
+
+            self.condition.notify_all()
+
+    def __discard__(self, key: tuple, connection: Connection) -> None:
+        with self.condition:
+            if self.connections.get(key) is connection:
+                del self.connections[key]
+
+        connection.close()
+
+    def __connect__(self, server: str, username: str, password: str, port: int) -> Connection:
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+        try:
+            ssh.connect(hostname=server, username=username, password=password, port=port, timeout=CONNECT_TIMEOUT,
+                        banner_timeout=CONNECT_TIMEOUT, auth_timeout=CONNECT_TIMEOUT)
+
+            ssh.get_transport().set_keepalive(self.keepalive_interval)
+
+            return Connection(ssh)
+
+        except BaseException:
+            ssh.close()
+            raise
+
+    def __start_reaper__(self) -> None:
+        # has to be called with the condition held
+        if self.reaper is None or not self.reaper.is_alive():
+            self.reaper = threading.Thread(target=self.__reap__, name="sftp-connection-reaper", daemon=True)
+            self.reaper.start()
+
+    def __reap__(self) -> None:
+        while True:
+            with self.condition:
+                if not self.connections:
+                    self.reaper = None
+                    return
+
+                now = time.monotonic()
+
+                expired = [(key, connection) for key, connection in self.connections.items()
+                           if connection.in_use == 0 and now - connection.last_used >= self.idle_timeout]
+
+                for key, _ in expired:
+                    del self.connections[key]
+
+                if not expired:
+                    next_expiry = min(connection.last_used + self.idle_timeout for connection in self.connections.values())
+                    self.condition.wait(max(next_expiry - now, 1))
+
+            for _, connection in expired:
+                try:
+                    connection.close()
+                except (OSError, paramiko.SSHException):
+                    pass
+
+
+pool = ConnectionPool()
@@ -1,7 +1,13 @@
-import pathlib
+import contextlib
+import hashlib
+import os
+import shutil
 
+from pw_manager import instrumentation
 from pw_manager.db import Database
-from pw_manager.utils import utils, errors
+from pw_manager.db_sync import delta, manifest, merge
+from pw_manager.db_sync.connection_pool import pool
+from pw_manager.utils import utils, errors, constants
 
 import paramiko
 
@@ -12,38 +18,236 @@ class Options:
 
 
 def check_credentials(server: str, username: str, password: str) -> bool:
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
+    """
+    Checks if the credentials work by connecting to the server. The connection is kept open for the syncs that follow.
+    Raises an OSError or paramiko.SSHException if the server can't be reached
+    :param server: The server
+    :param username: The username
+    :param password: The password
+    :return: If the credentials work
+    """
     try:
-        ssh.connect(hostname=server, username=username, password=password, port=22)
-        return True
+        with pool.session(server, username, password):
+            return True
     except paramiko.ssh_exception.AuthenticationException:
         return False
 
 
-def sync(db: Database, action: Options, server: str, username: str, password: str, path: str):
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-    ssh.connect(hostname=server, username=username, password=password, port=22)
-
-    sftp = ssh.open_sftp()
+def sync(db: Database, action: Options, server: str, username: str, password: str, path: str, timeout: float = None) -> bool:
+    """
+    Uploads or downloads the database file. Nothing gets transferred if the manifest of the remote file shows
+    that both files are the same already
+    :param db: The database
+    :param action: Options.UPLOAD or Options.DOWNLOAD
+    :param server: The server
+    :param username: The username
+    :param password: The password
+    :param path: The path of the database file on the server
+    :param timeout: Seconds a single sftp request may take before it fails, no limit if not given
+    :return: If a file was transferred, False if both files were the same already
+    """
+    with instrumentation.span("sync.upload" if action == Options.UPLOAD else "sync.download") as sync_span:
+        with contextlib.ExitStack() as stack:
+            # only the first sync connects, the ones after it reuse the connection
+            with instrumentation.span("sync.connect"):
+                sftp = stack.enter_context(pool.session(server, username, password, timeout=timeout))
+
+            with instrumentation.span("sync.manifest"):
+                remote_manifest = manifest.read_remote_manifest(sftp, path)
+                local_manifest = manifest.get_local_manifest(db.path)
+
+            if local_manifest is not None and local_manifest.matches(remote_manifest):
+                sync_span.add("skipped", 1)
+                return False
+
+            if action == Options.UPLOAD:
+                sync_span.add("bytes", upload_file(sftp, db.path, path, local_manifest, remote_manifest))
+
+            elif action == Options.DOWNLOAD:
+                # the current file is kept as db.path + ".old"
+                sync_span.add("bytes", download_file(sftp, path, db.path, remote_manifest, db.password))
+
+            return True
+
+
+def merge_sync(db: Database, server: str, username: str, password: str, path: str) -> merge.MergeResult:
+    """
+    Merges the local and the remote database entry by entry against the state both had after the last merge sync
+    (see merge.py), takes the merged entries over into db and uploads the result. Nothing gets transferred if
+    the manifest of the remote file shows that both files are the same already
+    :param db: The database, it stays open and gets the merged entries
+    :param server: The server
+    :param username: The username
+    :param password: The password
+    :param path: The path of the database file on the server
+    :return: What the merge changed on both sides and its conflicts
+    """
+    # changes that are still being written in the background have to be part of the merge
+    db.flush()
+
+    base_path = get_base_path(db, server, path)
+    result = merge.MergeResult()
+
+    with instrumentation.span("sync.merge") as sync_span, contextlib.ExitStack() as stack:
+        with instrumentation.span("sync.connect"):
+            sftp = stack.enter_context(pool.session(server, username, password))
+
+        with instrumentation.span("sync.manifest"):
+            remote_manifest = manifest.read_remote_manifest(sftp, path)
+            local_manifest = manifest.get_local_manifest(db.path)
+
+        if local_manifest.matches(remote_manifest):
+            sync_span.add("skipped", 1)
+
+            if not os.path.exists(base_path):
+                save_base(db, base_path)
+
+            return result
 
-    if action == Options.UPLOAD:
         try:
             sftp.stat(path)
+            remote_exists = True
         except FileNotFoundError:
+            remote_exists = False
+
+        if remote_exists:
+            remote_path = db.path + ".remote"
+
+            # the local file has most blocks of the remote one, so only the differences get downloaded
+            shutil.copyfile(db.path, remote_path)
+
+            remote_db = base_db = None
+
+            try:
+                sync_span.add("bytes", download_file(sftp, path, remote_path, remote_manifest, db.password))
+
+                remote_db = open_copy(remote_path, db.password)
+                base_db = open_copy(base_path, db.password) if os.path.exists(base_path) else None
+
+                with instrumentation.span("sync.merge.entries"):
+                    result = merge.three_way_merge(base_db.get_all_entries() if base_db is not None else [],
+                                                   db.get_all_entries(),
+                                                   remote_db.get_all_entries())
+
+            finally:
+                for copy in (remote_db, base_db):
+                    if copy is not None:
+                        copy.lock()
+
+                for leftover_path in (remote_path, remote_path + ".old"):
+                    if os.path.exists(leftover_path):
+                        os.remove(leftover_path)
+
+            if result.changes_local():
+                db.merge_entries(result.local_changes, result.local_deletions)
+                db.flush()
+
+                local_manifest = manifest.get_local_manifest(db.path)
+
+        else:
+            result.remote_additions = len(db.get_all_entries())
+
+        # somebody else uploaded while merging, the merge has to be done again with their upload
+        if remote_exists and not manifest.is_same_upload(manifest.read_remote_manifest(sftp, path), remote_manifest):
+            raise errors.RemoteDatabaseChangedException
+
+        sync_span.add("bytes", upload_file(sftp, db.path, path, local_manifest, remote_manifest))
+
+        save_base(db, base_path)
+
+        return result
+
+
+def upload_file(sftp, local_path: str, path: str, local_manifest: manifest.Manifest, remote_manifest: manifest.Manifest | None) -> int:
+    """
+    Uploads the database file and writes its manifest
+    :param sftp: The sftp client
+    :param local_path: The local database file
+    :param path: The path of the database file on the server
+    :param local_manifest: The manifest of the local file
+    :param remote_manifest: The manifest of the remote file or None if there is none
+    :return: The amount of bytes that were sent
+    """
+    try:
+        sftp.stat(path)
+    except FileNotFoundError:
+        try:
             sftp.mkdir(path.rsplit("/", maxsplit=1)[0])
+        except OSError:
+            # the directory exists already, only the file doesn't
+            pass
+
+    # the manifest would describe the old content while the file gets changed
+    manifest.remove_remote_manifest(sftp, path)
+
+    sent = delta.upload(sftp, local_path, path)
+
+    local_manifest.generation = remote_manifest.generation + 1 if remote_manifest is not None else 1
+    local_manifest.writer = manifest.get_writer_id()
 
-        sftp.put(db.path, path)
+    remote_mtime = sftp.stat(path).st_mtime
+    local_manifest.mtime = int(remote_mtime) if remote_mtime is not None else None
 
-    elif action == Options.DOWNLOAD:
-        pathlib.Path(db.path + ".old").unlink(missing_ok=True)
+    manifest.write_remote_manifest(sftp, path, local_manifest)
+
+    return sent
+
+
+def download_file(sftp, path: str, local_path: str, remote_manifest: manifest.Manifest | None, password: str) -> int:
+    """
+    Downloads the database file. Without a signature file it has to match the manifest, and without a manifest
+    as well it has to open with the password, otherwise the local file is kept
+    :param sftp: The sftp client
+    :param path: The path of the database file on the server
+    :param local_path: The local file to replace
+    :param remote_manifest: The manifest of the remote file or None if there is none
+    :param password: The password of the database
+    :return: The amount of bytes that were received
+    """
+    def validate(downloaded_path: str) -> None:
+        open_copy(downloaded_path, password).lock()
+
+    try:
+        expected_hash = bytes.fromhex(remote_manifest.hash) if remote_manifest is not None else None
+    except ValueError:
+        expected_hash = None
 
-        pathlib.Path(db.path).rename(db.path + ".old")
-        sftp.get(path, db.path)
+    return delta.download(sftp, path, local_path, expected_hash, validate)
+
+
+def get_base_path(db: Database, server: str, path: str) -> str:
+    """
+    Gets where the state after the last merge sync with a remote file is kept
+    :param db: The database
+    :param server: The server
+    :param path: The path of the database file on the server
+    :return: The path of the local base file
+    """
+    return f"{db.path}.{hashlib.sha256(f'{server}:{path}'.encode()).hexdigest()[:16]}.base"
+
+
+def save_base(db: Database, base_path: str) -> None:
+    def write_content(f) -> None:
+        with open(db.path, "rb") as db_file:
+            shutil.copyfileobj(db_file, f)
+
+    utils.write_file_atomically(base_path, write_content, mode="wb")
+
+
+def open_copy(path: str, password: str) -> Database:
+    """
+    Opens another copy of a database read only, without making it the current database
+    :param path: The path of the copy
+    :param password: The password
+    :return: The read database, it has to be locked once it isn't needed anymore
+    """
+    current_db = constants.db_file
+
+    try:
+        copy = Database(path, password, read_only=True)
+        copy.read()
+    finally:
+        constants.db_file = current_db
 
-    sftp.close()
-    ssh.close()
+    return copy
 
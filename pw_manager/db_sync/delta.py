@@ -0,0 +1,694 @@
+import glob
+import hashlib
+import itertools
+import os
+import shutil
+import stat
+import struct
+
+from paramiko.sftp import CMD_EXTENDED, int64
+
+from pw_manager.utils import utils
+
+
+"""
+Delta transfers of database files over plain SFTP.
+
+SFTP can't run anything on the server, so the block signatures of the remote file are stored next to it in
+a signature file (SIGNATURE_SUFFIX). Every upload writes it, and it also describes the remote file: it holds
+the size, modification time and sha256 of the file it belongs to. If it is missing or doesn't match the remote
+file anymore (for example because an older version uploaded the file), the whole file is downloaded.
+
+Upload:   The local file is searched for the blocks of the remote file the same way, and a part file is built
+          from them and the rest of the local file. The found blocks are copied on the server with the copy-data
+          extension (OpenSSH 9.0 and newer), so only the rest is sent. Servers without it get the whole file. The
+          remote file itself is never written to, a file that is half old and half new would otherwise be left
+          behind by an interrupted upload, which other installations would then download.
+Download: The local file is searched for the remote blocks with a rolling checksum like rsync does, so blocks
+          that moved are found as well. Only the remote blocks that aren't found get read. The result has to
+          match the sha256 in the signature file, otherwise the whole file is downloaded.
+
+Whole files are transferred in TRANSFER_CHUNK_SIZE chunks into a part file next to the destination, which is
+only renamed over the destination once it is complete, so an interrupted transfer never leaves a partial database
+behind. The name of a part file contains the version of the file it belongs to, and the next transfer of the
+same version continues where the interrupted one stopped:
+
+Upload:   remote_path + "." + first 16 hex digits of the sha256 of the file + PART_SUFFIX. The end of a remote part
+          file may have gaps from pipelined writes that were never confirmed, so the part is compared with the
+          local file and the upload continues at the first byte that differs. Servers with the check-file
+          extension hash the part themselves, otherwise it is read back up to the first difference. Nothing
+          else is read back: the server confirms every write, and the copied blocks were checked against the
+          signature file, which has to still belong to the remote file once they are copied. The part is only
+          renamed over the remote file with the size of the local file, the signature file is written after that.
+Download: local_path + "." + the same digits of the sha256 from the signature file (or the size and mtime of the
+          remote file without one) + PART_SUFFIX. The sha256 is computed while receiving, starting with the part
+          that is already there, and has to match the signature file before the part replaces the local file.
+          Without a signature file (an interrupted upload leaves none behind) it has to match the expected hash
+          the caller got from the manifest, and without that the caller has to check that the part opens. A part
+          that can't be verified at all never replaces the local file.
+
+Signature file:
+    magic           4 bytes     b"PWMS"
+    version         u16
+    block size      u32
+    file size       u64
+    file mtime      u64         of the remote file, to notice when it got changed by someone else
+    file sha256     32 bytes
+    blocks          ceil(file size / block size) * (weak checksum u32, strong checksum 16 bytes)
+"""
+
+
+SIGNATURE_SUFFIX = ".sig"
+SIGNATURE_MAGIC = b"PWMS"
+SIGNATURE_VERSION = 1
+
+SIGNATURE_HEADER = struct.Struct("<4sHIQQ32s")
+BLOCK_SIGNATURE = struct.Struct("<I16s")
+
+BLOCK_SIZE = 4096
+
+PART_SUFFIX = ".part"
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+
+# an interrupted upload is compared in blocks of this size if the server hashes the part itself
+RESUME_HASH_BLOCK_SIZE = 64 * 1024
+HASH_SIZE = 32
+
+# bytes the rolling checksum searches without finding a single block before giving up. The binary format encrypts
+# everything again on a full write, so there is nothing to find then and a full download is faster
+MAX_BLIND_SEARCH = 256 * 1024
+
+
+class Signature:
+    __slots__ = ("block_size", "file_size", "file_mtime", "file_hash", "weak_checksums", "strong_checksums")
+
+    def __init__(self, block_size: int, file_size: int, file_mtime: int, file_hash: bytes, weak_checksums: list[int], strong_checksums: list[bytes]):
+        self.block_size = block_size
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+        self.file_hash = file_hash
+        self.weak_checksums = weak_checksums
+        self.strong_checksums = strong_checksums
+
+    def to_bytes(self) -> bytes:
+        return SIGNATURE_HEADER.pack(SIGNATURE_MAGIC, SIGNATURE_VERSION, self.block_size, self.file_size, self.file_mtime, self.file_hash) + \
+            b"".join(BLOCK_SIGNATURE.pack(weak, strong) for weak, strong in zip(self.weak_checksums, self.strong_checksums))
+
+    @staticmethod
+    def from_bytes(data: bytes):
+        """
+        Parses a signature file
+        :param data: The content of the signature file
+        :return: The signature, or None if the data isn't a valid signature file
+        """
+        if len(data) < SIGNATURE_HEADER.size:
+            return None
+
+        magic, version, block_size, file_size, file_mtime, file_hash = SIGNATURE_HEADER.unpack_from(data)
+
+        if magic != SIGNATURE_MAGIC or version != SIGNATURE_VERSION or block_size == 0:
+            return None
+
+        block_count = -(-file_size // block_size)
+
+        if len(data) != SIGNATURE_HEADER.size + block_count * BLOCK_SIGNATURE.size:
+            return None
+
+        blocks = list(BLOCK_SIGNATURE.iter_unpack(data[SIGNATURE_HEADER.size:]))
+
+        return Signature(block_size, file_size, file_mtime, file_hash, [weak for weak, _ in blocks], [strong for _, strong in blocks])
+
+    def matches_remote_file(self, attributes) -> bool:
+        """
+        Checks if this signature still belongs to the remote file
+        :param attributes: The SFTPAttributes of the remote file
+        :return: If size and modification time are the same
+        """
+        return attributes.st_size == self.file_size and int(attributes.st_mtime) == self.file_mtime
+
+
+def get_weak_checksum_parts(block: bytes) -> (int, int):
+    """
+    Gets the two halves of the rolling checksum of rsync
+    :param block: The block
+    :return: The sum of the bytes and the sum of the prefix sums, both modulo 2 ** 16
+    """
+    return sum(block) & 0xFFFF, sum(itertools.accumulate(block)) & 0xFFFF
+
+
+def get_weak_checksum(block: bytes) -> int:
+    a, b = get_weak_checksum_parts(block)
+    return a | b << 16
+
+
+def get_strong_checksum(block: bytes) -> bytes:
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+def compute_signature(data: bytes, file_mtime: int = 0, block_size: int = BLOCK_SIZE) -> Signature:
+    """
+    Computes the signature of a file
+    :param data: The content of the file
+    :param file_mtime: The modification time of the remote file
+    :param block_size: The block size
+    :return: The signature
+    """
+    weak_checksums = []
+    strong_checksums = []
+
+    view = memoryview(data)
+
+    for offset in range(0, len(data), block_size):
+        block = view[offset:offset + block_size]
+
+        weak_checksums.append(get_weak_checksum(block))
+        strong_checksums.append(get_strong_checksum(block))
+
+    return Signature(block_size, len(data), file_mtime, hashlib.sha256(data).digest(), weak_checksums, strong_checksums)
+
+
+def find_blocks(data: bytes, signature: Signature) -> dict[int, int]:
+    """
+    Searches data for the blocks of a signature at any offset, with the rolling checksum of rsync
+    :param data: The data to search in
+    :param signature: The signature of the blocks to search for
+    :return: The index of every block that was found to the offset it was found at
+    """
+    block_size = signature.block_size
+    full_blocks = signature.file_size // block_size
+
+    # weak checksum -> indexes of the blocks with it. A trailing short block only matches the end of a file
+    # with the same size, so it isn't searched for
+    blocks_by_weak_checksum: dict[int, list[int]] = dict()
+
+    for index in range(full_blocks):
+        blocks_by_weak_checksum.setdefault(signature.weak_checksums[index], []).append(index)
+
+    found = dict()
+
+    view = memoryview(data)
+    offset = 0
+    blind_search = 0
+
+    a = b = None
+
+    while offset + block_size <= len(data) and len(found) < full_blocks:
+        if a is None:
+            a, b = get_weak_checksum_parts(view[offset:offset + block_size])
+
+        candidates = blocks_by_weak_checksum.get(a | b << 16)
+
+        if candidates:
+            strong_checksum = get_strong_checksum(view[offset:offset + block_size])
+            matching = [index for index in candidates if signature.strong_checksums[index] == strong_checksum]
+
+            if matching:
+                for index in matching:
+                    found.setdefault(index, offset)
+
+                offset += block_size
+                blind_search = 0
+                a = b = None
+                continue
+
+        blind_search += 1
+
+        if blind_search > MAX_BLIND_SEARCH:
+            break
+
+        if offset + block_size < len(data):
+            old_byte = data[offset]
+            new_byte = data[offset + block_size]
+
+            a = (a - old_byte + new_byte) & 0xFFFF
+            b = (b - block_size * old_byte + a) & 0xFFFF
+
+        offset += 1
+
+    if signature.file_size % block_size and len(data) == signature.file_size:
+        index = full_blocks
+
+        if get_strong_checksum(view[index * block_size:]) == signature.strong_checksums[index]:
+            found[index] = index * block_size
+
+    return found
+
+
+def read_remote_signature(sftp, remote_path: str) -> Signature | None:
+    """
+    Reads the signature file of a remote file if it still belongs to it
+    :param sftp: The sftp client
+    :param remote_path: The path of the remote database file
+    :return: The signature or None if there is none or it doesn't belong to the file anymore
+    """
+    try:
+        attributes = sftp.stat(remote_path)
+
+        with sftp.open(remote_path + SIGNATURE_SUFFIX, "rb") as f:
+            signature = Signature.from_bytes(f.read())
+
+    except FileNotFoundError:
+        return None
+
+    if signature is None or not signature.matches_remote_file(attributes):
+        return None
+
+    return signature
+
+
+def write_remote_signature(sftp, remote_path: str, data: bytes, block_size: int = BLOCK_SIZE) -> None:
+    """
+    Writes the signature file of a remote file that was just uploaded
+    :param sftp: The sftp client
+    :param remote_path: The path of the remote database file
+    :param data: The content of the remote file
+    :param block_size: The block size
+    """
+    signature = compute_signature(data, int(sftp.stat(remote_path).st_mtime), block_size)
+
+    tmp_path = remote_path + SIGNATURE_SUFFIX + ".tmp"
+
+    with sftp.open(tmp_path, "wb") as f:
+        f.write(signature.to_bytes())
+
+    sftp.posix_rename(tmp_path, remote_path + SIGNATURE_SUFFIX)
+
+
+def upload(sftp, local_path: str, remote_path: str) -> int:
+    """
+    Uploads a file into a part file, which replaces the remote file once it is complete. The blocks the remote file
+    has already get copied on the server if it can do that, the remote file itself is never changed in place
+    :param sftp: The sftp client
+    :param local_path: The local file
+    :param remote_path: The remote file
+    :return: The amount of bytes of the file that were sent
+    """
+    with open(local_path, "rb") as f:
+        data = f.read()
+
+    remote_signature = read_remote_signature(sftp, remote_path)
+
+    sent = __upload_part__(sftp, data, remote_path, remote_signature)
+
+    write_remote_signature(sftp, remote_path, data, remote_signature.block_size if remote_signature is not None else BLOCK_SIZE)
+
+    return sent
+
+
+def download(sftp, remote_path: str, local_path: str, expected_hash: bytes = None, validate=None) -> int:
+    """
+    Downloads a file, only reading the remote blocks that aren't in the local file if possible. The local file
+    is kept as local_path + ".old" and gets replaced atomically
+    :param sftp: The sftp client
+    :param remote_path: The remote file
+    :param local_path: The local file
+    :param expected_hash: The sha256 the remote file should have, checked if there is no signature file
+    :param validate: Function that gets the path of the downloaded file and raises if it isn't usable, called
+                     if neither a signature file nor the expected hash can verify it
+    :return: The amount of bytes of the file that were received
+    """
+    signature = read_remote_signature(sftp, remote_path)
+
+    if signature is None or not os.path.exists(local_path):
+        return __download_whole_file__(sftp, remote_path, local_path, signature, expected_hash, validate)
+
+    with open(local_path, "rb") as f:
+        data = f.read()
+
+    found = find_blocks(data, signature)
+
+    block_size = signature.block_size
+
+    # neighbouring missing blocks are read as a single range, and all ranges are requested at once
+    ranges = []
+
+    for index in range(len(signature.strong_checksums)):
+        if index in found:
+            continue
+
+        start = index * block_size
+        length = min(block_size, signature.file_size - start)
+
+        if ranges and sum(ranges[-1]) == start:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + length)
+        else:
+            ranges.append((start, length))
+
+    new_data = bytearray(signature.file_size)
+
+    for index, offset in found.items():
+        start = index * block_size
+        length = min(block_size, signature.file_size - start)
+
+        new_data[start:start + length] = data[offset:offset + length]
+
+    if ranges:
+        with sftp.open(remote_path, "rb") as f:
+            for (start, length), chunk in zip(ranges, f.readv(ranges)):
+                new_data[start:start + length] = chunk
+
+    if hashlib.sha256(new_data).digest() != signature.file_hash:
+        # the remote file changed while it was read
+        return __download_whole_file__(sftp, remote_path, local_path, signature, expected_hash, validate)
+
+    __replace_local_file__(local_path, lambda f: f.write(new_data))
+
+    return sum(length for _, length in ranges)
+
+
+def __upload_part__(sftp, data: bytes, remote_path: str, remote_signature: Signature | None) -> int:
+    """
+    Uploads a file into a part file and renames it over the remote file once it is complete. Continues the part
+    file of an interrupted upload of the same content, otherwise the part is built from the remote file and the
+    changed blocks if possible
+    :param sftp: The sftp client
+    :param data: The content of the file
+    :param remote_path: The remote file
+    :param remote_signature: The signature of the remote file or None if there is none
+    :return: The amount of bytes that were sent
+    """
+    part_path = f"{remote_path}.{hashlib.sha256(data).hexdigest()[:16]}{PART_SUFFIX}"
+
+    try:
+        part_size = sftp.stat(part_path).st_size
+    except FileNotFoundError:
+        part_size = None
+
+    if part_size is not None:
+        offset = __get_resume_offset__(sftp, data, part_path, part_size)
+        sent = __write_part__(sftp, data, part_path, offset, "r+b")
+
+    else:
+        __remove_remote_parts__(sftp, remote_path)
+
+        sent = __upload_delta__(sftp, data, remote_path, part_path, remote_signature) if remote_signature is not None else None
+
+        if sent is None:
+            sent = __write_part__(sftp, data, part_path, 0, "wb")
+
+    # every write was confirmed by the server when the part got closed, so only the size is left to check
+    if sftp.stat(part_path).st_size != len(data):
+        sftp.remove(part_path)
+        raise IOError(f"The uploaded {part_path} doesn't have the size of the local file")
+
+    # the signature file describes the old content, so it must not stay around once the file got replaced
+    try:
+        sftp.remove(remote_path + SIGNATURE_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+    sftp.posix_rename(part_path, remote_path)
+
+    return sent
+
+
+def __write_part__(sftp, data: bytes, part_path: str, offset: int, mode: str) -> int:
+    """
+    Writes a file into a part file from an offset on
+    :param sftp: The sftp client
+    :param data: The content of the file
+    :param part_path: The part file
+    :param offset: Where to start writing, everything before it is in the part already
+    :param mode: "wb" for a new part, "r+b" to continue one
+    :return: The amount of bytes that were sent
+    """
+    with sftp.open(part_path, mode) as f:
+        f.set_pipelined(True)
+        f.seek(offset)
+
+        for start in range(offset, len(data), TRANSFER_CHUNK_SIZE):
+            f.write(data[start:start + TRANSFER_CHUNK_SIZE])
+
+        f.truncate(len(data))
+
+    return len(data) - offset
+
+
+def __get_resume_offset__(sftp, data: bytes, part_path: str, part_size: int) -> int:
+    """
+    Finds where an interrupted upload continues, which is the first byte of the part file that isn't the one of the
+    local file. The end of a part may have gaps from pipelined writes that were never confirmed, so nothing in it is
+    trusted without being compared. Servers with the check-file extension hash the part themselves, from the
+    others it gets read back up to the first difference
+    :param sftp: The sftp client
+    :param data: The content of the file
+    :param part_path: The part file
+    :param part_size: The size of the part file
+    :return: The offset to continue at
+    """
+    length = min(part_size, len(data))
+
+    if length == 0:
+        return 0
+
+    with sftp.open(part_path, "rb") as f:
+        try:
+            block_hashes = f.check("sha256", 0, length, RESUME_HASH_BLOCK_SIZE)
+        except IOError:
+            block_hashes = None
+
+        if block_hashes is not None:
+            for start in range(0, length, RESUME_HASH_BLOCK_SIZE):
+                position = start // RESUME_HASH_BLOCK_SIZE * HASH_SIZE
+
+                if block_hashes[position:position + HASH_SIZE] != hashlib.sha256(data[start:min(start + RESUME_HASH_BLOCK_SIZE, length)]).digest():
+                    return start
+
+            return length
+
+        f.prefetch(length)
+        offset = 0
+
+        while offset < length:
+            chunk = f.read(min(TRANSFER_CHUNK_SIZE, length - offset))
+
+            if not chunk:
+                break
+
+            same = get_common_prefix_length(chunk, data[offset:offset + len(chunk)])
+
+            if same < len(chunk):
+                return offset + same
+
+            offset += len(chunk)
+
+    return offset
+
+
+def get_common_prefix_length(data: bytes, other: bytes) -> int:
+    """
+    Gets how many bytes at the start of two byte strings are the same
+    :param data: The first byte string
+    :param other: The second byte string
+    :return: The length of the common prefix
+    """
+    length = min(len(data), len(other))
+
+    # finds the first block that differs, only that one gets compared byte by byte
+    block_start = 0
+
+    while block_start < length and data[block_start:block_start + BLOCK_SIZE] == other[block_start:block_start + BLOCK_SIZE]:
+        block_start += BLOCK_SIZE
+
+    for offset in range(block_start, min(block_start + BLOCK_SIZE, length)):
+        if data[offset] != other[offset]:
+            return offset
+
+    return length
+
+
+def __upload_delta__(sftp, data: bytes, remote_path: str, part_path: str, signature: Signature) -> int | None:
+    """
+    Builds a part file from the blocks of the remote file that are in the local file as well, which the server
+    copies itself with the copy-data extension, and the rest of the local file
+    :param sftp: The sftp client
+    :param data: The content of the file
+    :param remote_path: The remote file
+    :param part_path: The part file
+    :param signature: The signature of the remote file
+    :return: The amount of bytes that were sent, or None if the server can't copy or the remote file changed
+    """
+    block_size = signature.block_size
+
+    # (offset in the local file, offset in the remote file, length), neighbouring blocks are copied at once
+    copies = []
+
+    for index, offset in sorted(find_blocks(data, signature).items(), key=lambda item: item[1]):
+        remote_offset = index * block_size
+        length = min(block_size, signature.file_size - remote_offset)
+
+        if copies and offset < sum(copies[-1][::2]):
+            # a block that is in the remote file more than once was found at the same offset
+            continue
+
+        if copies and offset == sum(copies[-1][::2]) and remote_offset == sum(copies[-1][1:]):
+            copies[-1] = (copies[-1][0], copies[-1][1], copies[-1][2] + length)
+        else:
+            copies.append((offset, remote_offset, length))
+
+    if not copies:
+        return None
+
+    sent = 0
+
+    with sftp.open(remote_path, "rb") as remote_file, sftp.open(part_path, "wb") as f:
+        f.set_pipelined(True)
+
+        position = 0
+
+        for offset, remote_offset, length in copies + [(len(data), 0, 0)]:
+            # the copy doesn't move the position of the part
+            f.seek(position)
+
+            for start in range(position, offset, TRANSFER_CHUNK_SIZE):
+                f.write(data[start:min(start + TRANSFER_CHUNK_SIZE, offset)])
+
+            sent += offset - position
+
+            if length:
+                try:
+                    __copy_remote_range__(sftp, remote_file, remote_offset, length, f, offset)
+                except IOError:
+                    # the server doesn't support copy-data, the part gets written in full instead
+                    return None
+
+            position = offset + length
+
+        f.truncate(len(data))
+
+    # the copied blocks are only the ones of the signature if the remote file is still the same
+    if not signature.matches_remote_file(sftp.stat(remote_path)):
+        return None
+
+    return sent
+
+
+def __copy_remote_range__(sftp, source_file, source_offset: int, length: int, destination_file, destination_offset: int) -> None:
+    """
+    Lets the server copy a range of a file into another one with the copy-data extension of OpenSSH 9.0 and newer,
+    without the data going over the connection. paramiko has no method for it, so the request is sent like its
+    own methods send the extensions they support
+    :param sftp: The sftp client
+    :param source_file: The opened file to copy from
+    :param source_offset: Where the range starts in the source file
+    :param length: The length of the range
+    :param destination_file: The opened file to copy into
+    :param destination_offset: Where the range goes in the destination file
+    """
+    sftp._request(CMD_EXTENDED, "copy-data", source_file.handle, int64(source_offset), int64(length),
+                  destination_file.handle, int64(destination_offset))
+
+
+def __remove_remote_parts__(sftp, remote_path: str) -> None:
+    """
+    Removes the part files that interrupted uploads of other versions left behind
+    :param sftp: The sftp client
+    :param remote_path: The remote file
+    """
+    directory, _, name = remote_path.rpartition("/")
+
+    try:
+        file_names = sftp.listdir(directory or ".")
+    except FileNotFoundError:
+        return
+
+    for file_name in file_names:
+        if file_name.startswith(name + ".") and file_name.endswith(PART_SUFFIX):
+            sftp.remove(f"{directory}/{file_name}" if directory else file_name)
+
+
+def __download_whole_file__(sftp, remote_path: str, local_path: str, signature: Signature | None, expected_hash: bytes = None, validate=None) -> int:
+    """
+    Downloads a whole file into a part file and replaces the local file with it once it is complete and verified.
+    Continues the part file of an interrupted download of the same version
+    :param sftp: The sftp client
+    :param remote_path: The remote file
+    :param local_path: The local file
+    :param signature: The signature of the remote file or None if there is none
+    :param expected_hash: The sha256 the remote file should have if there is no signature
+    :param validate: Function that checks the part if there is neither a signature nor an expected hash
+    :return: The amount of bytes that were received
+    """
+    attributes = sftp.stat(remote_path)
+    file_size = attributes.st_size
+
+    version = signature.file_hash.hex()[:16] if signature is not None else f"{file_size}-{int(attributes.st_mtime)}"
+    part_path = f"{local_path}.{version}{PART_SUFFIX}"
+
+    for old_part_path in glob.glob(glob.escape(local_path) + ".*" + PART_SUFFIX):
+        if old_part_path != part_path:
+            os.remove(old_part_path)
+
+    file_hash = hashlib.sha256()
+    offset = 0
+
+    if os.path.exists(part_path):
+        offset = min(os.path.getsize(part_path), file_size)
+        os.truncate(part_path, offset)
+
+        with open(part_path, "rb") as f:
+            while chunk := f.read(TRANSFER_CHUNK_SIZE):
+                file_hash.update(chunk)
+
+    received = 0
+
+    with open(part_path, "ab") as f:
+        with sftp.open(remote_path, "rb") as remote_file:
+            remote_file.seek(offset)
+
+            # requests every chunk of the rest of the file at once instead of one after another
+            remote_file.prefetch(file_size)
+
+            while offset < file_size:
+                chunk = remote_file.read(min(TRANSFER_CHUNK_SIZE, file_size - offset))
+
+                if not chunk:
+                    break
+
+                f.write(chunk)
+                file_hash.update(chunk)
+
+                offset += len(chunk)
+                received += len(chunk)
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    expected_hash = signature.file_hash if signature is not None else expected_hash
+
+    if offset != file_size or (expected_hash is not None and file_hash.digest() != expected_hash):
+        # the remote file changed while it was read, the part is useless
+        os.remove(part_path)
+        raise IOError(f"The downloaded {remote_path} doesn't match its signature file or manifest")
+
+    if expected_hash is None:
+        # nothing describes the remote file, it might be what an interrupted upload left behind
+        try:
+            if validate is None:
+                raise IOError(f"There is no signature file or manifest to verify {remote_path} with")
+
+            validate(part_path)
+
+        except Exception as e:
+            os.remove(part_path)
+            raise IOError(f"The downloaded {remote_path} can't be verified, the local file was kept") from e
+
+    if os.path.exists(local_path):
+        shutil.copy2(local_path, local_path + ".old")
+        os.chmod(part_path, stat.S_IMODE(os.stat(local_path).st_mode))
+
+    os.replace(part_path, local_path)
+
+    return received
+
+
+def __replace_local_file__(local_path: str, write_content) -> None:
+    """
+    Replaces the local file and keeps the previous one as local_path + ".old"
+    :param local_path: The local file
+    :param write_content: Function that writes the new content into the opened temporary file
+    """
+    if os.path.exists(local_path):
+        shutil.copy2(local_path, local_path + ".old")
+
+    utils.write_file_atomically(local_path, write_content, mode="w+b")
@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import uuid
+
+from pw_manager.utils import utils
+
+
+"""
+The manifest is a small json file next to the remote database file that describes its content, so a sync can
+tell with a single read whether there is anything to transfer at all:
+
+{
+    "hash": "...",          <- sha256 of the remote database file as hex
+    "size": 1234,           <- size of the remote database file in bytes
+    "mtime": 1700000000,    <- modification time of the remote database file in whole seconds, may be missing
+    "generation": 3,        <- counts the uploads, the first one is 1
+    "writer": "..."         <- writer id of the installation that uploaded it
+}
+
+Every upload removes the manifest before it changes the remote file and writes a new one once the file is
+complete, so an interrupted upload leaves no manifest behind and the next sync transfers the file again.
+A manifest is only trusted while the size and modification time of the remote file still are the ones it
+recorded, so a file that was replaced by an older client or by hand isn't mistaken for the uploaded one.
+
+The hash of the local file is cached in a file with the same name as the remote manifest next to the local
+database file, together with the inode, size and modification times of the file it was computed from. It is
+only computed again if one of them changed, so a sync of an unchanged vault doesn't read the whole file.
+"""
+
+
+MANIFEST_SUFFIX = ".manifest"
+
+HASH_BUFFER_SIZE = 1024 * 1024
+
+
+class Manifest:
+    __slots__ = ("hash", "size", "mtime", "generation", "writer")
+
+    def __init__(self, hash: str, size: int, generation: int = 0, writer: str = None, mtime: int = None):
+        """
+        :param hash: The sha256 of the file as hex
+        :param size: The size of the file
+        :param generation: How often the file was uploaded
+        :param writer: The writer id of the installation that uploaded it
+        :param mtime: The modification time of the remote file in whole seconds, None if it isn't known
+        """
+        self.hash = hash
+        self.size = size
+        self.mtime = mtime
+        self.generation = generation
+        self.writer = writer
+
+    def matches(self, other) -> bool:
+        """
+        Checks if two manifests describe the same content
+        :param other: The other manifest
+        :return: If the hash and size are the same
+        """
+        return other is not None and self.hash == other.hash and self.size == other.size
+
+    def describes(self, stat_result) -> bool:
+        """
+        Checks if the manifest can still belong to a remote file
+        :param stat_result: The stat of the remote file
+        :return: If the size and, if it was recorded, the modification time are the same
+        """
+        if stat_result.st_size != self.size:
+            return False
+
+        return self.mtime is None or stat_result.st_mtime is None or int(stat_result.st_mtime) == self.mtime
+
+    def to_dict(self) -> dict:
+        return {"hash": self.hash, "size": self.size, "mtime": self.mtime, "generation": self.generation, "writer": self.writer}
+
+    @staticmethod
+    def from_dict(raw_manifest: dict):
+        """
+        Creates a manifest from its dict
+        :param raw_manifest: The parsed manifest file
+        :return: The manifest, or None if the dict isn't a valid manifest
+        """
+        if not isinstance(raw_manifest, dict):
+            return None
+
+        hash = raw_manifest.get("hash")
+        size = raw_manifest.get("size")
+        generation = raw_manifest.get("generation", 0)
+        mtime = raw_manifest.get("mtime")
+
+        if not isinstance(hash, str) or not isinstance(size, int) or not isinstance(generation, int):
+            return None
+
+        if mtime is not None and not isinstance(mtime, int):
+            return None
+
+        return Manifest(hash, size, generation, raw_manifest.get("writer"), mtime)
+
+
+def is_same_upload(manifest: Manifest | None, other: Manifest | None) -> bool:
+    """
+    Checks if two manifests of a remote file belong to the same upload
+    :param manifest: The manifest or None if there was none
+    :param other: The other manifest or None if there was none
+    :return: If both are the same
+    """
+    if manifest is None or other is None:
+        return manifest is None and other is None
+
+    return manifest.matches(other) and manifest.generation == other.generation and manifest.writer == other.writer
+
+
+def get_writer_id() -> str:
+    """
+    Gets the id of this installation, it gets generated the first time
+    :return: The writer id
+    """
+    path = utils.get_writer_id_file()
+
+    try:
+        with open(path) as f:
+            writer_id = f.read().strip()
+
+        if writer_id:
+            return writer_id
+
+    except FileNotFoundError:
+        pass
+
+    writer_id = uuid.uuid4().hex
+
+    utils.write_file_atomically(path, lambda f: f.write(writer_id))
+
+    return writer_id
+
+
+def get_file_stamp(stat_result: os.stat_result) -> list[int]:
+    return [stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ctime_ns]
+
+
+def read_cached_hash(path: str, stamp: list[int]) -> str | None:
+    """
+    Reads the cached hash of a local file
+    :param path: The local file
+    :param stamp: The stamp of the file as it is now
+    :return: The hash as hex, or None if there is no cache or the file changed since
+    """
+    try:
+        with open(path + MANIFEST_SUFFIX) as f:
+            raw_cache = json.load(f)
+
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(raw_cache, dict) or raw_cache.get("stamp") != stamp or not isinstance(raw_cache.get("hash"), str):
+        return None
+
+    return raw_cache["hash"]
+
+
+def write_cached_hash(path: str, stamp: list[int], hexhash: str) -> None:
+    try:
+        utils.write_file_atomically(path + MANIFEST_SUFFIX, lambda f: json.dump({"hash": hexhash, "stamp": stamp}, f))
+    except OSError:
+        # only a cache, the hash just gets computed again next time
+        pass
+
+
+def get_local_manifest(path: str) -> Manifest | None:
+    """
+    Creates the manifest of a local file, the hash is only computed if the file changed since the last time
+    :param path: The local file
+    :return: The manifest without generation and writer, or None if the file doesn't exist
+    """
+    file_hash = hashlib.sha256()
+
+    try:
+        with open(path, "rb") as f:
+            stamp = get_file_stamp(os.fstat(f.fileno()))
+            cached_hash = read_cached_hash(path, stamp)
+
+            if cached_hash is not None:
+                return Manifest(cached_hash, stamp[2])
+
+            while chunk := f.read(HASH_BUFFER_SIZE):
+                file_hash.update(chunk)
+
+            # the file was changed while it was read, the hash may not belong to any version of it
+            is_unchanged = get_file_stamp(os.fstat(f.fileno())) == stamp and get_file_stamp(os.stat(path)) == stamp
+
+    except FileNotFoundError:
+        return None
+
+    if is_unchanged:
+        write_cached_hash(path, stamp, file_hash.hexdigest())
+
+    return Manifest(file_hash.hexdigest(), stamp[2])
+
+
+def read_remote_manifest(sftp, remote_path: str) -> Manifest | None:
+    """
+    Reads the manifest of a remote file
+    :param sftp: The sftp client
+    :param remote_path: The path of the remote database file
+    :return: The manifest, or None if there is none, it is damaged or it doesn't describe the remote file
+    """
+    try:
+        with sftp.open(remote_path + MANIFEST_SUFFIX, "rb") as f:
+            raw_manifest = json.loads(f.read())
+
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        return None
+
+    remote_manifest = Manifest.from_dict(raw_manifest)
+
+    if remote_manifest is None:
+        return None
+
+    # the file was replaced without a new manifest, by hand or by a client that doesn't write them
+    try:
+        if not remote_manifest.describes(sftp.stat(remote_path)):
+            return None
+
+    except FileNotFoundError:
+        return None
+
+    return remote_manifest
+
+
+def write_remote_manifest(sftp, remote_path: str, manifest: Manifest) -> None:
+    """
+    Writes the manifest of a remote file that was just uploaded
+    :param sftp: The sftp client
+    :param remote_path: The path of the remote database file
+    :param manifest: The manifest
+    """
+    tmp_path = remote_path + MANIFEST_SUFFIX + ".tmp"
+
+    with sftp.open(tmp_path, "wb") as f:
+        f.write(json.dumps(manifest.to_dict()).encode())
+
+    sftp.posix_rename(tmp_path, remote_path + MANIFEST_SUFFIX)
+
+
+def remove_remote_manifest(sftp, remote_path: str) -> None:
+    try:
+        sftp.remove(remote_path + MANIFEST_SUFFIX)
+    except FileNotFoundError:
+        pass
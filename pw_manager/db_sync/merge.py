@@ -0,0 +1,162 @@
+from pw_manager.db_entry import DatabaseEntry
+
+
+"""
+Three way merge of database entries.
+
+Entries of the local and the remote database are matched by their id and compared with the entry in the base,
+the state both sides had after the last merge sync:
+
+    unchanged on both sides         kept
+    changed on one side only        the change is taken over, also if it is a deletion
+    changed the same way on both    kept
+    changed differently on both     conflict: the entry with the newer modification clock wins, the remote one
+                                    if both clocks are the same. If one side deleted the entry and the other one
+                                    changed it, the changed entry wins so nothing gets lost
+
+Without a base (the first merge sync) every entry counts as added, so deletions made on one side come back from
+the other one once, and entries that differ are conflicts.
+"""
+
+
+RESOLUTION_LOCAL = "local"
+RESOLUTION_REMOTE = "remote"
+
+
+class Conflict:
+    __slots__ = ("entry_id", "website_or_usage", "resolution", "reason")
+
+    def __init__(self, entry_id: str, website_or_usage: str, resolution: str, reason: str):
+        """
+        :param entry_id: The id of the entry
+        :param website_or_usage: The website or usage of the entry that won
+        :param resolution: RESOLUTION_LOCAL or RESOLUTION_REMOTE, the side that won
+        :param reason: Why that side won
+        """
+        self.entry_id = entry_id
+        self.website_or_usage = website_or_usage
+        self.resolution = resolution
+        self.reason = reason
+
+    def __repr__(self):
+        return f"Conflict({self.website_or_usage!r}, {self.resolution}, {self.reason})"
+
+
+class MergeResult:
+    def __init__(self):
+        # changes the local database needs to end up with the merged entries
+        self.local_changes: list[DatabaseEntry] = list()
+        self.local_deletions: list[str] = list()
+
+        # how many entries of the remote database the merged entries add, change or delete
+        self.remote_additions: int = 0
+        self.remote_updates: int = 0
+        self.remote_deletions: int = 0
+
+        self.conflicts: list[Conflict] = list()
+
+    def changes_local(self) -> bool:
+        return bool(self.local_changes or self.local_deletions)
+
+    def changes_remote(self) -> bool:
+        return bool(self.remote_additions or self.remote_updates or self.remote_deletions)
+
+
+def index_entries(entries: list[DatabaseEntry]) -> dict[str, DatabaseEntry]:
+    return {entry.entry_id: entry for entry in entries}
+
+
+def is_same(entry: DatabaseEntry | None, other: DatabaseEntry | None) -> bool:
+    """
+    Checks if two versions of an entry have the same content. A missing entry is only the same as a missing entry
+    :param entry: The entry or None if it doesn't exist
+    :param other: The other entry or None if it doesn't exist
+    :return: If both are the same
+    """
+    if entry is None or other is None:
+        return entry is None and other is None
+
+    return entry == other
+
+
+def copy_entry(entry: DatabaseEntry) -> DatabaseEntry:
+    """
+    Copies an entry of another database, its sealed fields can only be decrypted by the database it came from
+    :param entry: The entry
+    :return: The unsealed copy with the same id and modification clock
+    """
+    return DatabaseEntry(website_or_usage=entry.website_or_usage,
+                         username=entry.username,
+                         description=entry.description,
+                         password=entry.password,
+                         entry_id=entry.entry_id,
+                         modified=entry.modified)
+
+
+def resolve_conflict(local_entry: DatabaseEntry | None, remote_entry: DatabaseEntry | None) -> (DatabaseEntry, Conflict):
+    """
+    Picks the winner of an entry that was changed differently on both sides
+    :param local_entry: The local entry or None if it was deleted locally
+    :param remote_entry: The remote entry or None if it was deleted remotely
+    :return: The entry that won and the conflict
+    """
+    if local_entry is None:
+        return remote_entry, Conflict(remote_entry.entry_id, remote_entry.website_or_usage, RESOLUTION_REMOTE, "deleted locally, changed remotely")
+
+    if remote_entry is None:
+        return local_entry, Conflict(local_entry.entry_id, local_entry.website_or_usage, RESOLUTION_LOCAL, "changed locally, deleted remotely")
+
+    if local_entry.modified > remote_entry.modified:
+        return local_entry, Conflict(local_entry.entry_id, local_entry.website_or_usage, RESOLUTION_LOCAL, "changed on both sides, the local change is newer")
+
+    return remote_entry, Conflict(remote_entry.entry_id, remote_entry.website_or_usage, RESOLUTION_REMOTE, "changed on both sides, the remote change is newer")
+
+
+def three_way_merge(base_entries: list[DatabaseEntry], local_entries: list[DatabaseEntry], remote_entries: list[DatabaseEntry]) -> MergeResult:
+    """
+    Merges the entries of two databases
+    :param base_entries: The entries both sides had after the last merge sync, empty if there is none
+    :param local_entries: The local entries
+    :param remote_entries: The remote entries
+    :return: The changes both sides need to end up with the merged entries
+    """
+    base = index_entries(base_entries)
+    local = index_entries(local_entries)
+    remote = index_entries(remote_entries)
+
+    result = MergeResult()
+
+    # local ids first so the order of the local database is kept
+    entry_ids = list(local.keys()) + [entry_id for entry_id in remote.keys() if entry_id not in local]
+
+    for entry_id in entry_ids:
+        base_entry = base.get(entry_id)
+        local_entry = local.get(entry_id)
+        remote_entry = remote.get(entry_id)
+
+        if is_same(local_entry, remote_entry):
+            continue
+
+        if is_same(local_entry, base_entry):
+            merged_entry = remote_entry
+        elif is_same(remote_entry, base_entry):
+            merged_entry = local_entry
+        else:
+            merged_entry, conflict = resolve_conflict(local_entry, remote_entry)
+            result.conflicts.append(conflict)
+
+        if merged_entry is not local_entry:
+            if merged_entry is None:
+                result.local_deletions.append(entry_id)
+            else:
+                result.local_changes.append(copy_entry(merged_entry))
+
+        if merged_entry is not remote_entry:
+            if merged_entry is None:
+                result.remote_deletions += 1
+            elif remote_entry is None:
+                result.remote_additions += 1
+            else:
+                result.remote_updates += 1
+
+    return result
@@ -0,0 +1,267 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import paramiko
+
+from pw_manager import instrumentation
+from pw_manager.db import Database
+from pw_manager.db_sync import db_sync, manifest
+from pw_manager.utils import errors, utils
+
+
+"""
+Uploads of the database file to several servers at once.
+
+sync.json holds a list of targets and how many of them need the new version for an upload to count as done:
+
+{
+    "targets": [
+        {"server": "...", "username": "...", "password": "...", "path": "..."},
+        ...
+    ],
+    "quorum": 2     <- all targets if not given, otherwise 1 up to the number of targets
+}
+
+Files written before there were several targets hold the fields of a single target at the top level and are
+read as a list with that one target.
+
+Every target gets its own thread, so an upload takes about as long as the slowest target, but never longer than
+DEFAULT_DEADLINE. A failed upload is retried RETRIES times with a growing delay, except if the credentials are
+wrong or the deadline has passed. Targets that didn't finish by the deadline count as failed, their uploads go
+on in the background but don't hold up the report. Downloads and merges only use the first target.
+"""
+
+
+DEFAULT_TIMEOUT = 60
+DEFAULT_DEADLINE = 180
+RETRIES = 2
+RETRY_DELAY = 1
+
+
+class Target:
+    __slots__ = ("server", "username", "password", "path")
+
+    def __init__(self, server: str, username: str, password: str, path: str):
+        self.server = server
+        self.username = username
+        self.password = password
+        self.path = path
+
+    def to_dict(self) -> dict:
+        return {"server": self.server, "username": self.username, "password": self.password, "path": self.path}
+
+    @staticmethod
+    def from_dict(raw_target: dict):
+        if not isinstance(raw_target, dict):
+            raise errors.SyncConfigException("A sync target has to be an object")
+
+        return Target(raw_target.get("server"), raw_target.get("username"), raw_target.get("password"), raw_target.get("path"))
+
+    def __repr__(self):
+        return f"{self.username}@{self.server}:{self.path}"
+
+
+class SyncConfig:
+    def __init__(self, targets: list[Target], quorum: int = None):
+        """
+        :param targets: The targets, the first one is used for downloads and merges
+        :param quorum: How many targets need the new version, all if not given
+        """
+        if not targets:
+            raise errors.SyncConfigException("There has to be at least one sync target")
+
+        if quorum is not None and (type(quorum) is not int or not 1 <= quorum <= len(targets)):
+            raise errors.SyncConfigException(f"The quorum has to be between 1 and {len(targets)}, not {quorum}")
+
+        for target in targets:
+            if not all(isinstance(value, str) for value in (target.server, target.username, target.password, target.path)):
+                raise errors.SyncConfigException("Every sync target needs a server, username, password and path")
+
+        self.targets = targets
+        self.quorum = quorum
+
+    def get_quorum(self) -> int:
+        return self.quorum or len(self.targets)
+
+    def get_primary(self) -> Target:
+        return self.targets[0]
+
+    def to_dict(self) -> dict:
+        data = {"targets": [target.to_dict() for target in self.targets]}
+
+        if self.quorum:
+            data["quorum"] = self.quorum
+
+        return data
+
+    @staticmethod
+    def from_dict(raw_config: dict):
+        """
+        Creates a sync config from its dict
+        :param raw_config: The parsed sync file
+        :return: The sync config
+        :raises errors.SyncConfigException: If the dict isn't a valid sync config
+        """
+        if not isinstance(raw_config, dict):
+            raise errors.SyncConfigException("The sync settings have to be an object")
+
+        if "targets" not in raw_config:
+            return SyncConfig([Target.from_dict(raw_config)])
+
+        raw_targets = raw_config.get("targets")
+
+        if not isinstance(raw_targets, list):
+            raise errors.SyncConfigException("The sync targets have to be a list")
+
+        return SyncConfig([Target.from_dict(raw_target) for raw_target in raw_targets], raw_config.get("quorum"))
+
+
+class TargetResult:
+    __slots__ = ("target", "transferred", "attempts", "seconds", "error")
+
+    def __init__(self, target: Target):
+        self.target = target
+
+        # if the file was uploaded, False if the target had the same file already
+        self.transferred: bool = False
+        self.attempts: int = 0
+        self.seconds: float = 0.0
+
+        # the exception of the last attempt if all of them failed
+        self.error: BaseException | None = None
+
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+class ReplicationReport:
+    def __init__(self, results: list[TargetResult], quorum: int):
+        """
+        :param results: The result of every target, in the order of the targets
+        :param quorum: How many targets need the new version
+        """
+        self.results = results
+        self.quorum = quorum
+
+    def get_succeeded(self) -> list[TargetResult]:
+        return [result for result in self.results if result.succeeded()]
+
+    def get_failed(self) -> list[TargetResult]:
+        return [result for result in self.results if not result.succeeded()]
+
+    def reached_quorum(self) -> bool:
+        return len(self.get_succeeded()) >= self.quorum
+
+
+def read_sync_config() -> SyncConfig:
+    """
+    Reads the sync settings
+    :return: The sync config
+    :raises errors.SyncConfigException: If the sync file isn't valid
+    """
+    try:
+        with open(utils.get_sync_file()) as f:
+            raw_config = json.load(f)
+
+    except ValueError as e:
+        raise errors.SyncConfigException(f"The sync file is not valid json: {e}")
+
+    return SyncConfig.from_dict(raw_config)
+
+
+def write_sync_config(config: SyncConfig) -> None:
+    utils.write_file_atomically(utils.get_sync_file(), lambda f: json.dump(config.to_dict(), f, indent=2))
+
+
+def upload_to_target(db: Database, target: Target, timeout: float, retries: int, deadline: float = None) -> TargetResult:
+    """
+    Uploads the database file to a single target, retrying if it fails
+    :param db: The database
+    :param target: The target
+    :param timeout: Seconds a single sftp request may take before the attempt fails
+    :param retries: How often a failed upload is tried again
+    :param deadline: time.monotonic() after which no new attempt gets started, no limit if not given
+    :return: The result
+    """
+    result = TargetResult(target)
+    start = time.perf_counter()
+
+    while True:
+        result.attempts += 1
+
+        try:
+            result.transferred = db_sync.sync(db=db,
+                                              action=db_sync.Options.UPLOAD,
+                                              server=target.server,
+                                              username=target.username,
+                                              password=target.password,
+                                              path=target.path,
+                                              timeout=timeout)
+            result.error = None
+            break
+
+        except paramiko.ssh_exception.AuthenticationException as e:
+            # trying again doesn't fix wrong credentials
+            result.error = e
+            break
+
+        except (OSError, EOFError, paramiko.SSHException) as e:
+            result.error = e
+
+            delay = RETRY_DELAY * 2 ** (result.attempts - 1)
+
+            if result.attempts > retries or (deadline is not None and time.monotonic() + delay >= deadline):
+                break
+
+            time.sleep(delay)
+
+    result.seconds = time.perf_counter() - start
+
+    return result
+
+
+def replicate(db: Database, config: SyncConfig, timeout: float = DEFAULT_TIMEOUT, retries: int = RETRIES,
+              deadline: float = DEFAULT_DEADLINE) -> ReplicationReport:
+    """
+    Uploads the database file to every target at the same time
+    :param db: The database
+    :param config: The sync config with the targets
+    :param timeout: Seconds a single sftp request may take before an attempt fails
+    :param retries: How often a failed upload to a target is tried again
+    :param deadline: Seconds the upload to a single target may take in total, with all of its attempts
+    :return: The result of every target and if the quorum was reached
+    """
+    # changes that are still being written in the background have to be in the uploaded file
+    db.flush()
+
+    # generated once here instead of by the first uploads at the same time
+    manifest.get_writer_id()
+
+    deadline_at = time.monotonic() + deadline
+
+    with instrumentation.span("sync.replicate", targets=len(config.targets)):
+        executor = ThreadPoolExecutor(max_workers=len(config.targets), thread_name_prefix="sync-target")
+
+        try:
+            futures = [executor.submit(upload_to_target, db, target, timeout, retries, deadline_at) for target in config.targets]
+
+            results = []
+
+            for target, future in zip(config.targets, futures):
+                try:
+                    results.append(future.result(timeout=max(0.0, deadline_at - time.monotonic())))
+                except FutureTimeoutError:
+                    result = TargetResult(target)
+                    result.attempts = 1
+                    result.seconds = deadline
+                    result.error = TimeoutError(f"The upload didn't finish within {deadline} seconds")
+
+                    results.append(result)
+
+        finally:
+            # a target that is still uploading must not hold up the report
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return ReplicationReport(results, config.get_quorum())
@@ -0,0 +1,282 @@
+import base64
+import csv
+import io
+import json
+import os
+import struct
+import time
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import InvalidToken
+
+from pw_manager import instrumentation
+from pw_manager import kdf as kdf_module
+from pw_manager import search_index
+from pw_manager import vault_format
+from pw_manager.db import Database
+from pw_manager.utils import errors, key_cache, utils
+
+
+"""
+Streaming export of the entries of a database as CSV or json lines, optionally encrypted with a password of
+its own.
+
+Entries are produced one after another by Database.iter_entry_fields() in the order of the db, serialized
+line by line and written right away, so neither the decrypted entries nor the exported file are ever held in
+memory as a whole, only the few decrypted chunks that are being exported.
+
+Filter terms match like the search of the entry menus (see utils.get_entry()): an entry is exported if every
+term is contained in one of the search fields of the db, ignoring the case.
+
+Every line has the fields FIELDS. CSV files start with them as a header row, which importer.py reads back.
+
+Encrypted exports are a stream of chunks like the data section of the binary format (see vault_format.py):
+
+    magic           4 bytes     b"PWEX"
+    version         u16
+    kdf             u8          like the header of the binary format
+    kdf parameter   u32
+    salt length     u8
+    salt            salt length bytes
+    chunks          blob * n, the exported lines in chunks of about vault_format.CHUNK_SIZE
+
+The key is derived from the export password with its own salt, and the associated data of every chunk is the
+header, its number and whether it is the last chunk, so a truncated or reordered export can't be decrypted.
+decrypt_export() turns it back into the plain file.
+"""
+
+
+FORMAT_CSV = "csv"
+FORMAT_JSON_LINES = "jsonl"
+
+FORMATS = (FORMAT_CSV, FORMAT_JSON_LINES)
+
+FIELDS = ("id", "website_or_usage", "username", "description", "password", "modified")
+
+MAGIC = b"PWEX"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHBIB")
+
+SALT_LENGTH = 16
+
+SECTION_EXPORT = b"E"
+
+TRUNCATED_MESSAGE = "The export is truncated"
+
+
+class ExportReport:
+    def __init__(self):
+        self.checked: int = 0
+        self.exported: int = 0
+        self.bytes: int = 0
+        self.encrypted: bool = False
+        self.seconds: float = 0.0
+
+    def get_entries_per_second(self) -> float:
+        return self.checked / self.seconds if self.seconds else 0.0
+
+
+def iter_records(db: Database, terms: list[str] = None, report: ExportReport = None):
+    """
+    Produces the records of all entries that match every filter term
+    :param db: The database
+    :param terms: The filter terms, all entries if there are none
+    :param report: Report to count the checked and exported entries in
+    :return: Generator of the records as dicts with FIELDS
+    """
+    terms = [term.lower() for term in terms or () if term]
+
+    for entry, fields in db.iter_entry_fields():
+        if report is not None:
+            report.checked += 1
+
+        if terms:
+            texts = tuple(fields.get(field).lower() for field in db.search_fields)
+
+            if not all(search_index.matches(texts, term) for term in terms):
+                continue
+
+        if report is not None:
+            report.exported += 1
+
+        yield {"id": entry.entry_id, **fields, "modified": entry.modified}
+
+
+def iter_csv_lines(records):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+
+    # the buffer only ever holds a single row
+    def take_line() -> bytes:
+        line = buffer.getvalue().encode()
+
+        buffer.seek(0)
+        buffer.truncate()
+
+        return line
+
+    writer.writeheader()
+    yield take_line()
+
+    for record in records:
+        writer.writerow(record)
+        yield take_line()
+
+
+def iter_json_lines(records):
+    for record in records:
+        yield json.dumps(record).encode() + b"\n"
+
+
+def get_export_aead(password: str, salt: bytes, kdf_parameters: kdf_module.KdfParameters):
+    with instrumentation.span("kdf.derive"):
+        key = base64.urlsafe_b64encode(kdf_parameters.derive(password.encode(), salt))
+
+    # same subkey derivation as the binary format, but the keys of an export are never cached
+    return key_cache.SessionKeys(key).aead
+
+
+def iter_encrypted_blobs(lines, password: str, kdf_parameters: kdf_module.KdfParameters):
+    """
+    Encrypts exported lines in chunks
+    :param lines: Iterable of the lines
+    :param password: The password of the export
+    :param kdf_parameters: The kdf the key gets derived with
+    :return: Generator of the header followed by the blobs of the chunks
+    """
+    salt = os.urandom(SALT_LENGTH)
+    kdf, kdf_parameter = vault_format.pack_kdf_parameters(kdf_parameters)
+
+    header = HEADER.pack(MAGIC, VERSION, kdf, kdf_parameter, len(salt)) + salt
+    aead = get_export_aead(password, salt, kdf_parameters)
+
+    def encrypt_chunk(item) -> bytes:
+        number, chunk, is_last = item
+        nonce = os.urandom(vault_format.NONCE_LENGTH)
+
+        with instrumentation.span("aead.encrypt", bytes=len(chunk)):
+            return nonce + aead.encrypt(nonce, chunk, vault_format.get_chunk_associated_data(header, SECTION_EXPORT, number, is_last))
+
+    yield header
+
+    for blob in vault_format.parallel_imap(encrypt_chunk, vault_format.iter_chunks(lines)):
+        yield vault_format.pack_blob(blob)
+
+
+def export_database(db: Database, path: str, export_format: str, terms: list[str] = None, password: str = None,
+                    kdf_parameters: kdf_module.KdfParameters = None) -> ExportReport:
+    """
+    Exports the entries of a database into a file
+    :param db: The database
+    :param path: The file to export to, it gets replaced once the export is complete
+    :param export_format: One of FORMATS
+    :param terms: Filter terms, every exported entry matches all of them. All entries if there are none
+    :param password: Encrypts the export with this password if given
+    :param kdf_parameters: The kdf of an encrypted export, calibrated for this machine if not given
+    :return: The report
+    """
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format {export_format}")
+
+    report = ExportReport()
+    report.encrypted = password is not None
+
+    start = time.perf_counter()
+
+    if password is not None and kdf_parameters is None:
+        kdf_parameters = kdf_module.calibrate()
+
+    # changes that are still being written in the background have to be in the export as well
+    db.flush()
+
+    with instrumentation.span("export") as export_span:
+        records = iter_records(db, terms, report)
+        lines = iter_csv_lines(records) if export_format == FORMAT_CSV else iter_json_lines(records)
+
+        if password is not None:
+            lines = iter_encrypted_blobs(lines, password, kdf_parameters)
+
+        def write_content(f) -> None:
+            for data in lines:
+                f.write(data)
+
+        utils.write_file_atomically(path, write_content, mode="wb")
+
+        export_span.add("entries", report.exported)
+
+    report.bytes = os.path.getsize(path)
+    report.seconds = time.perf_counter() - start
+
+    return report
+
+
+def is_encrypted_export(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def iter_decrypted_chunks(f, password: str):
+    """
+    Decrypts an encrypted export chunk by chunk
+    :param f: The export, opened in buffered binary mode at its start
+    :param password: The password of the export
+    :return: Generator of the decrypted chunks
+    """
+    data = f.read(HEADER.size)
+
+    if len(data) != HEADER.size:
+        raise errors.DatabaseFormatException(TRUNCATED_MESSAGE)
+
+    magic, version, kdf, kdf_parameter, salt_length = HEADER.unpack(data)
+
+    if magic != MAGIC:
+        raise errors.DatabaseFormatException("The file is not an encrypted export")
+
+    if version != VERSION:
+        raise errors.DatabaseFormatException(f"Unsupported version {version} of encrypted exports")
+
+    salt = f.read(salt_length)
+
+    if len(salt) != salt_length:
+        raise errors.DatabaseFormatException(TRUNCATED_MESSAGE)
+
+    header = data + salt
+
+    aead = get_export_aead(password, salt, vault_format.unpack_kdf_parameters(kdf, kdf_parameter))
+
+    number = 0
+    blob = vault_format.read_blob(f, TRUNCATED_MESSAGE)
+
+    while True:
+        # the chunk is only the last one if nothing follows it, so a truncated export fails to decrypt
+        is_last = not f.peek(1)
+        associated_data = vault_format.get_chunk_associated_data(header, SECTION_EXPORT, number, is_last)
+
+        try:
+            with instrumentation.span("aead.decrypt", bytes=len(blob)):
+                yield aead.decrypt(blob[:vault_format.NONCE_LENGTH], blob[vault_format.NONCE_LENGTH:], associated_data)
+        except InvalidTag:
+            # wrong password or a modified export, raised as InvalidToken like the database does it
+            raise InvalidToken
+
+        if is_last:
+            return
+
+        number += 1
+        blob = vault_format.read_blob(f, TRUNCATED_MESSAGE)
+
+
+def decrypt_export(path: str, password: str, output_path: str) -> None:
+    """
+    Decrypts an encrypted export into the plain CSV or json lines file
+    :param path: The encrypted export
+    :param password: The password of the export
+    :param output_path: The file to write the plain export to, it gets replaced once it is complete
+    """
+    with open(path, "rb") as f:
+        def write_content(output) -> None:
+            for chunk in iter_decrypted_chunks(f, password):
+                output.write(chunk)
+
+        utils.write_file_atomically(output_path, write_content, mode="wb")
@@ -0,0 +1,270 @@
+import csv
+import hashlib
+import json
+import os
+import pathlib
+import time
+
+from pw_manager import instrumentation
+from pw_manager.db import Database
+from pw_manager.utils.legacy_encryption import decryptor
+
+
+"""
+Bulk import of entries from v1 databases and from the CSV and json exports of other password managers.
+
+The records of a file are streamed where the format allows it (CSV and json lines, a v1 database and a json
+document have to be decrypted or parsed as a whole), normalized one after another and added to the database in
+a single transaction, so the whole import is a single write no matter how many records it has.
+
+Normalizing maps the column names of common exports to the fields of an entry, case insensitive:
+
+    website_or_usage    website_or_usage, name, title, website, usage, url, login_uri, uri
+    username            username, login_username, login, user, email
+    password            password, login_password, pass
+    description         description, notes, note, extra, comment
+
+Nested "login" objects (like the json export of Bitwarden) are flattened first. A record is rejected if it has
+no website or usage, and if it has no password unless empty passwords are allowed, which they are for v1
+databases because the v1 versions stored them. Records that are exactly the same as an existing entry or as a
+record imported before them are skipped as duplicates, they are found by a hash of their fields.
+"""
+
+
+FORMAT_V1 = "v1"
+FORMAT_CSV = "csv"
+FORMAT_JSON = "json"
+FORMAT_JSON_LINES = "jsonl"
+
+FORMATS = (FORMAT_V1, FORMAT_CSV, FORMAT_JSON, FORMAT_JSON_LINES)
+
+FIELD_ALIASES = {
+    "website_or_usage": ("website_or_usage", "name", "title", "website", "usage", "url", "login_uri", "uri"),
+    "username": ("username", "login_username", "login", "user", "email"),
+    "password": ("password", "login_password", "pass"),
+    "description": ("description", "notes", "note", "extra", "comment")
+}
+
+
+class ImportReport:
+    def __init__(self):
+        self.read: int = 0
+        self.imported: int = 0
+        self.duplicates: int = 0
+
+        # (number of the record, reason) of every record that couldn't be imported
+        self.rejected: list[tuple[int, str]] = list()
+
+        self.seconds: float = 0.0
+
+    def get_records_per_second(self) -> float:
+        return self.read / self.seconds if self.seconds else 0.0
+
+
+def guess_format(path: str) -> str | None:
+    """
+    Guesses the format of a file to import
+    :param path: The file, or the folder of a v1 database
+    :return: One of FORMATS or None if it isn't known
+    """
+    path = pathlib.Path(path)
+
+    if path.is_dir() and (path / "database.db").exists() or path.name == "database.db":
+        return FORMAT_V1
+
+    suffix = path.suffix.lower()
+
+    if suffix == ".csv":
+        return FORMAT_CSV
+
+    if suffix == ".json":
+        return FORMAT_JSON
+
+    if suffix in (".jsonl", ".ndjson"):
+        return FORMAT_JSON_LINES
+
+    return None
+
+
+def iter_v1_records(path: str, password: str):
+    """
+    Reads the records of a v1 database. The whole file is decrypted right away, so a wrong password raises
+    InvalidToken here and not while importing
+    :param path: The database.db file or the folder it is in
+    :param password: The password of the v1 database
+    :return: Generator of the raw records
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, "database.db")
+
+    return iter_json_document_records(json.loads(decryptor.get_decrypted_content(password, path)))
+
+
+def iter_csv_records(path: str):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        yield from csv.DictReader(f)
+
+
+def iter_json_records(path: str):
+    with open(path, encoding="utf-8") as f:
+        document = json.load(f)
+
+    yield from iter_json_document_records(document)
+
+
+def iter_json_lines_records(path: str):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_json_document_records(document):
+    """
+    Finds the records in a json document: a list of records, a dict with them under "entries" or "items", or
+    a dict of the website or usage to the other fields like v1 databases store them
+    :param document: The parsed json document
+    :return: Generator of the raw records
+    """
+    if isinstance(document, dict):
+        for key in ("entries", "items"):
+            if isinstance(document.get(key), list):
+                document = document.get(key)
+                break
+        else:
+            for website_or_usage, fields in document.items():
+                if isinstance(fields, dict):
+                    yield {"website_or_usage": website_or_usage, **fields}
+                else:
+                    yield fields
+            return
+
+    if not isinstance(document, list):
+        raise ValueError("The json document doesn't contain a list of entries")
+
+    yield from document
+
+
+def normalize_record(raw_record, allow_empty_password: bool = False) -> (dict | None, str | None):
+    """
+    Maps a raw record to the fields of an entry
+    :param raw_record: The record as it was read
+    :param allow_empty_password: If records without a password get imported with an empty one
+    :return: The fields and None, or None and why the record was rejected
+    """
+    if not isinstance(raw_record, dict):
+        return None, "not an object"
+
+    # nested login objects like the json export of Bitwarden has them
+    login = raw_record.get("login")
+
+    if isinstance(login, dict):
+        uris = login.get("uris")
+        uri = uris[0].get("uri") if isinstance(uris, list) and uris and isinstance(uris[0], dict) else None
+
+        raw_record = {**raw_record, "login_username": login.get("username"), "login_password": login.get("password"), "login_uri": uri}
+        del raw_record["login"]
+
+    lowered = {str(key).strip().lower(): value for key, value in raw_record.items() if value not in (None, "")}
+
+    fields = {}
+
+    for field, aliases in FIELD_ALIASES.items():
+        value = next((lowered.get(alias) for alias in aliases if alias in lowered), "")
+
+        if isinstance(value, (dict, list)):
+            return None, f"{field} is not a text"
+
+        fields[field] = str(value)
+
+    fields["website_or_usage"] = fields.get("website_or_usage").strip()
+    fields["username"] = fields.get("username").strip()
+
+    if not fields.get("website_or_usage"):
+        return None, "no website or usage"
+
+    if not fields.get("password") and not allow_empty_password:
+        return None, "no password"
+
+    return fields, None
+
+
+def get_fields_hash(website_or_usage: str, username: str, description: str, password: str) -> bytes:
+    return hashlib.blake2b(json.dumps([website_or_usage, username, description, password]).encode(), digest_size=16).digest()
+
+
+def import_records(db: Database, records, allow_empty_passwords: bool = False) -> ImportReport:
+    """
+    Imports records into a database in a single write
+    :param db: The database
+    :param records: Iterable of the raw records
+    :param allow_empty_passwords: If records without a password get imported with an empty one
+    :return: The report
+    """
+    report = ImportReport()
+    start = time.perf_counter()
+
+    with instrumentation.span("import") as import_span:
+        with instrumentation.span("import.index"):
+            known_hashes = {get_fields_hash(entry.website_or_usage, entry.username, entry.description, entry.password)
+                            for entry in db.get_all_entries()}
+
+        with db.transaction():
+            for number, raw_record in enumerate(records, start=1):
+                report.read += 1
+
+                fields, reason = normalize_record(raw_record, allow_empty_passwords)
+
+                if fields is None:
+                    report.rejected.append((number, reason))
+                    continue
+
+                fields_hash = get_fields_hash(**fields)
+
+                if fields_hash in known_hashes:
+                    report.duplicates += 1
+                    continue
+
+                known_hashes.add(fields_hash)
+
+                db.add_database_entry(**fields, should_write=False)
+                report.imported += 1
+
+        # the transaction only schedules the write in write behind mode
+        db.flush()
+
+        import_span.add("entries", report.imported)
+
+    report.seconds = time.perf_counter() - start
+
+    return report
+
+
+def import_file(db: Database, path: str, source_format: str = None, password: str = None, allow_empty_passwords: bool = None) -> ImportReport:
+    """
+    Imports the entries of a file into a database in a single write
+    :param db: The database
+    :param path: The file, or the folder of a v1 database
+    :param source_format: One of FORMATS, guessed from the path if not given
+    :param password: The password of a v1 database
+    :param allow_empty_passwords: If records without a password get imported with an empty one, only for v1
+                                  databases if not given
+    :return: The report
+    """
+    source_format = source_format or guess_format(path)
+
+    if allow_empty_passwords is None:
+        allow_empty_passwords = source_format == FORMAT_V1
+
+    if source_format == FORMAT_V1:
+        records = iter_v1_records(path, password)
+    elif source_format == FORMAT_CSV:
+        records = iter_csv_records(path)
+    elif source_format == FORMAT_JSON:
+        records = iter_json_records(path)
+    elif source_format == FORMAT_JSON_LINES:
+        records = iter_json_lines_records(path)
+    else:
+        raise ValueError(f"Unknown import format of {path}")
+
+    return import_records(db, records, allow_empty_passwords)
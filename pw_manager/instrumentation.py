@@ -0,0 +1,314 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+
+"""
+Optional timings of the hot paths, so a slow unlock or save can be split into kdf, crypto, parsing, object
+construction and disk time.
+
+Code marks a phase with a span and can attach byte and entry counts to it:
+
+    with instrumentation.span("db.read") as span:
+        ...
+        span.add("bytes", len(data))
+
+Instrumentation is disabled by default. Then span() returns a shared object that does nothing, so a span
+costs a single function call. It gets enabled by setting the environment variable PW_MANAGER_TRACE to the
+file the results should be written to (or with enable()). The results are written when the program exits, as
+a json trace (chrome://tracing, Perfetto) or, if the file ends with .prom or PW_MANAGER_TRACE_FORMAT is
+"prometheus", as a Prometheus textfile with the totals of every span.
+
+Hooks added with add_hook() get every finished span as a dict:
+
+{
+    "name": "db.read",
+    "start": 12.5,          <- seconds, time.perf_counter()
+    "duration": 0.25,       <- seconds
+    "thread": "MainThread",
+    "attributes": {"bytes": 1234, "entries": 10}
+}
+"""
+
+
+ENV_TRACE = "PW_MANAGER_TRACE"
+ENV_TRACE_FORMAT = "PW_MANAGER_TRACE_FORMAT"
+
+FORMAT_JSON = "json"
+FORMAT_PROMETHEUS = "prometheus"
+
+# only this many spans are kept for the json trace, the totals keep counting after that
+MAX_EVENTS = 200000
+
+PROMETHEUS_PREFIX = "pw_manager"
+
+
+class Span:
+    __slots__ = ("name", "attributes", "start")
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.start = 0.0
+
+    def add(self, key: str, value: int) -> None:
+        """
+        Adds a count to the span, like the bytes or entries it processed
+        :param key: The name of the count
+        :param value: The amount to add
+        """
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _record(self.name, self.start, time.perf_counter() - self.start, self.attributes)
+
+
+class NullSpan:
+    """
+    What span() returns while instrumentation is disabled
+    """
+    __slots__ = ()
+
+    def add(self, key: str, value: int) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+_enabled: bool = False
+_lock = threading.Lock()
+
+_hooks: list = list()
+
+_events: list[dict] = list()
+# name of a span -> {"count": ..., "seconds": ..., and the sum of every attribute}
+_totals: dict[str, dict] = dict()
+
+_output_path: str | None = None
+_output_format: str | None = None
+_export_registered: bool = False
+
+
+def span(name: str, **attributes):
+    """
+    Times a phase in a with block
+    :param name: The name of the phase, dotted like "db.read.journal"
+    :param attributes: Counts to start with
+    :return: The span, or NULL_SPAN if instrumentation is disabled
+    """
+    if not _enabled:
+        return NULL_SPAN
+
+    return Span(name, attributes)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable(output_path: str = None, output_format: str = None) -> None:
+    """
+    Starts recording spans
+    :param output_path: Where to write the results when the program exits. Only hooks get the spans if not given
+    :param output_format: FORMAT_JSON or FORMAT_PROMETHEUS, guessed from the file extension if not given
+    """
+    global _enabled, _output_path, _output_format, _export_registered
+
+    if output_format is None and output_path is not None:
+        output_format = FORMAT_PROMETHEUS if output_path.endswith(".prom") else FORMAT_JSON
+
+    _output_path = output_path
+    _output_format = output_format
+    _enabled = True
+
+    if output_path is not None and not _export_registered:
+        atexit.register(export)
+        _export_registered = True
+
+
+def disable() -> None:
+    """
+    Stops recording spans. What was recorded so far is kept
+    """
+    global _enabled
+    _enabled = False
+
+
+def add_hook(hook) -> None:
+    """
+    Adds a function that gets called with every finished span while instrumentation is enabled
+    :param hook: The function, it gets the span as a dict
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook) -> None:
+    _hooks.remove(hook)
+
+
+def reset() -> None:
+    """
+    Forgets every recorded span
+    """
+    with _lock:
+        _events.clear()
+        _totals.clear()
+
+
+def get_totals() -> dict[str, dict]:
+    """
+    Gets the totals of every span name
+    :return: A copy of the totals
+    """
+    with _lock:
+        return {name: dict(totals) for name, totals in _totals.items()}
+
+
+def _record(name: str, start: float, duration: float, attributes: dict) -> None:
+    event = {
+        "name": name,
+        "start": start,
+        "duration": duration,
+        "thread": threading.current_thread().name,
+        "attributes": attributes
+    }
+
+    with _lock:
+        if len(_events) < MAX_EVENTS:
+            _events.append(event)
+
+        totals = _totals.get(name)
+
+        if totals is None:
+            totals = _totals[name] = {"count": 0, "seconds": 0.0}
+
+        totals["count"] += 1
+        totals["seconds"] += duration
+
+        for key, value in attributes.items():
+            totals[key] = totals.get(key, 0) + value
+
+    for hook in list(_hooks):
+        hook(event)
+
+
+def to_json_trace() -> dict:
+    """
+    Converts the recorded spans to the chrome trace event format
+    :return: The trace as a dict
+    """
+    pid = os.getpid()
+
+    with _lock:
+        events = list(_events)
+
+    # the trace format wants numbers as thread ids, the names are added as metadata events
+    thread_ids = dict()
+
+    for event in events:
+        thread_ids.setdefault(event.get("thread"), len(thread_ids))
+
+    trace_events = [{
+        "name": "thread_name",
+        "ph": "M",
+        "pid": pid,
+        "tid": thread_id,
+        "args": {"name": thread_name}
+    } for thread_name, thread_id in thread_ids.items()]
+
+    trace_events += [{
+        "name": event.get("name"),
+        "ph": "X",
+        "ts": event.get("start") * 1000000,
+        "dur": event.get("duration") * 1000000,
+        "pid": pid,
+        "tid": thread_ids.get(event.get("thread")),
+        "args": event.get("attributes")
+    } for event in events]
+
+    return {
+        "traceEvents": trace_events,
+        "displayTimeUnit": "ms"
+    }
+
+
+def to_prometheus_text() -> str:
+    """
+    Converts the totals of the recorded spans to the Prometheus text format
+    :return: The metrics
+    """
+    totals = get_totals()
+
+    lines = [
+        f"# HELP {PROMETHEUS_PREFIX}_span_seconds_total Seconds spent in a span",
+        f"# TYPE {PROMETHEUS_PREFIX}_span_seconds_total counter"
+    ]
+    lines += [f'{PROMETHEUS_PREFIX}_span_seconds_total{{span="{name}"}} {values.get("seconds")}' for name, values in sorted(totals.items())]
+
+    lines += [
+        f"# HELP {PROMETHEUS_PREFIX}_span_count_total How often a span was entered",
+        f"# TYPE {PROMETHEUS_PREFIX}_span_count_total counter"
+    ]
+    lines += [f'{PROMETHEUS_PREFIX}_span_count_total{{span="{name}"}} {values.get("count")}' for name, values in sorted(totals.items())]
+
+    attribute_names = sorted({key for values in totals.values() for key in values.keys()} - {"count", "seconds"})
+
+    for attribute_name in attribute_names:
+        lines += [
+            f"# HELP {PROMETHEUS_PREFIX}_span_{attribute_name}_total Sum of the {attribute_name} of a span",
+            f"# TYPE {PROMETHEUS_PREFIX}_span_{attribute_name}_total counter"
+        ]
+        lines += [f'{PROMETHEUS_PREFIX}_span_{attribute_name}_total{{span="{name}"}} {values.get(attribute_name)}'
+                  for name, values in sorted(totals.items()) if attribute_name in values]
+
+    return "\n".join(lines) + "\n"
+
+
+def export(output_path: str = None, output_format: str = None) -> None:
+    """
+    Writes the recorded spans to a file
+    :param output_path: The file, the one given to enable() if not given
+    :param output_format: FORMAT_JSON or FORMAT_PROMETHEUS, the one given to enable() if not given
+    """
+    output_path = output_path or _output_path
+    output_format = output_format or _output_format or FORMAT_JSON
+
+    if output_path is None:
+        return
+
+    # imported here because utils imports this module
+    from pw_manager.utils import utils
+
+    if output_format == FORMAT_PROMETHEUS:
+        def write_content(f) -> None:
+            f.write(to_prometheus_text())
+    else:
+        def write_content(f) -> None:
+            json.dump(to_json_trace(), f)
+
+    # the textfile collector of the node exporter must never see a half written file
+    utils.write_file_atomically(output_path, write_content)
+
+
+def _enable_from_environment() -> None:
+    output_path = os.environ.get(ENV_TRACE)
+
+    if not output_path:
+        return
+
+    enable(output_path, os.environ.get(ENV_TRACE_FORMAT) or None)
+
+
+_enable_from_environment()
@@ -0,0 +1,266 @@
+import os
+import time
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+from pw_manager.utils import errors
+
+
+"""
+Key derivation functions and their parameters.
+
+Every database stores the kdf it was created with, so the unlock cost can be tuned per machine: create()
+calibrates the parameters with calibrate() so that deriving the key takes about DEFAULT_TARGET_SECONDS on the
+machine the database gets created on. Fast servers end up with more iterations than slow jump hosts.
+Database.rekey() calibrates an existing database again.
+
+The environment variables PW_MANAGER_KDF and PW_MANAGER_KDF_SECONDS change the algorithm and the target
+seconds that get calibrated for (see get_configured_algorithm() and get_configured_target_seconds()).
+
+The parameters come from the database file, so they are limited to what calibrate() can produce on a fast
+machine. A modified file can't make unlocking use more than MAX_SCRYPT_MEMORY or take hours.
+
+Supported algorithms:
+    pbkdf2-sha512_256   PBKDF2-HMAC-SHA512/256 with the given iterations
+    pbkdf2-sha256       PBKDF2-HMAC-SHA256 with the given iterations, only used by v1 databases
+    scrypt              scrypt with the cost n = 2 ** log_n, the block size r and the parallelization p
+"""
+
+
+ALGORITHM_PBKDF2_SHA512_256 = "pbkdf2-sha512_256"
+ALGORITHM_PBKDF2_SHA256 = "pbkdf2-sha256"
+ALGORITHM_SCRYPT = "scrypt"
+
+KEY_LENGTH = 32
+
+DEFAULT_ALGORITHM = ALGORITHM_PBKDF2_SHA512_256
+DEFAULT_TARGET_SECONDS = 0.5
+MAX_TARGET_SECONDS = 10
+
+CALIBRATED_ALGORITHMS = (ALGORITHM_PBKDF2_SHA512_256, ALGORITHM_SCRYPT)
+
+ENV_ALGORITHM = "PW_MANAGER_KDF"
+ENV_TARGET_SECONDS = "PW_MANAGER_KDF_SECONDS"
+
+# what every database used before the kdf was stored in it
+DEFAULT_PBKDF2_ITERATIONS = 100000
+
+# calibration never goes below these, a fast machine should make unlocking more expensive, not cheaper
+MIN_PBKDF2_ITERATIONS = DEFAULT_PBKDF2_ITERATIONS
+
+# far more than MAX_TARGET_SECONDS take on any machine, but a modified file can't make unlocking take hours
+MAX_PBKDF2_ITERATIONS = 100000000
+
+MIN_SCRYPT_LOG_N = 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# scrypt uses 128 * r * 2 ** log_n bytes of memory and its time grows with 2 ** log_n * r * p
+MAX_SCRYPT_MEMORY = 1024 * 1024 * 1024
+MAX_SCRYPT_LOG_N = 24
+MAX_SCRYPT_R_TIMES_P = 64
+
+# iterations of the first calibration run of pbkdf2, it gets repeated with more until it takes long enough to measure
+CALIBRATION_ITERATIONS = 10000
+CALIBRATION_MIN_SECONDS = 0.05
+
+
+class KdfParameters:
+    __slots__ = ("algorithm", "iterations", "log_n", "r", "p")
+
+    def __init__(self, algorithm: str = DEFAULT_ALGORITHM, iterations: int = DEFAULT_PBKDF2_ITERATIONS, log_n: int = MIN_SCRYPT_LOG_N,
+                 r: int = SCRYPT_R, p: int = SCRYPT_P):
+        """
+        :param algorithm: One of the ALGORITHM_ constants
+        :param iterations: The iterations of pbkdf2
+        :param log_n: The base 2 logarithm of the cost of scrypt
+        :param r: The block size of scrypt
+        :param p: The parallelization of scrypt
+        """
+        if algorithm not in (ALGORITHM_PBKDF2_SHA512_256, ALGORITHM_PBKDF2_SHA256, ALGORITHM_SCRYPT):
+            raise errors.DatabaseFormatException(f"Unsupported kdf {algorithm}")
+
+        self.algorithm = algorithm
+        self.iterations = iterations
+        self.log_n = log_n
+        self.r = r
+        self.p = p
+
+        self.check()
+
+    def check(self) -> None:
+        """
+        Makes sure the parameters can be stored in a database file and don't need more memory or time than
+        calibrate() could have picked
+        """
+        for name, value, maximum in (("iterations", self.iterations, MAX_PBKDF2_ITERATIONS), ("log_n", self.log_n, MAX_SCRYPT_LOG_N),
+                                     ("r", self.r, MAX_SCRYPT_R_TIMES_P), ("p", self.p, MAX_SCRYPT_R_TIMES_P)):
+            if not isinstance(value, int) or isinstance(value, bool) or not 1 <= value <= maximum:
+                raise errors.DatabaseFormatException(f"The kdf parameter {name} has to be between 1 and {maximum}, not {value!r}")
+
+        if self.r * self.p > MAX_SCRYPT_R_TIMES_P:
+            raise errors.DatabaseFormatException(f"The kdf parameters r and p can't be more than {MAX_SCRYPT_R_TIMES_P} together, not {self.r * self.p}")
+
+        if self.is_scrypt() and get_scrypt_memory(self.log_n, self.r) > MAX_SCRYPT_MEMORY:
+            raise errors.DatabaseFormatException(f"The kdf would need {get_scrypt_memory(self.log_n, self.r)} bytes of memory, "
+                                                 f"but only {MAX_SCRYPT_MEMORY} are allowed")
+
+    def is_scrypt(self) -> bool:
+        return self.algorithm == ALGORITHM_SCRYPT
+
+    def derive(self, password: bytes, salt: bytes) -> bytes:
+        """
+        Derives a key
+        :param password: The password
+        :param salt: The salt
+        :return: The raw key
+        """
+        if self.is_scrypt():
+            kdf = Scrypt(salt=salt, length=KEY_LENGTH, n=2 ** self.log_n, r=self.r, p=self.p, backend=default_backend())
+        else:
+            kdf = PBKDF2HMAC(
+                algorithm=hashes.SHA512_256() if self.algorithm == ALGORITHM_PBKDF2_SHA512_256 else hashes.SHA256(),
+                length=KEY_LENGTH,
+                salt=salt,
+                iterations=self.iterations,
+                backend=default_backend()
+            )
+
+        return kdf.derive(password)
+
+    def as_tuple(self) -> tuple:
+        """
+        Gets the parameters that matter for the algorithm, for example to use them as a cache key
+        :return: The parameters as a tuple
+        """
+        if self.is_scrypt():
+            return self.algorithm, self.log_n, self.r, self.p
+
+        return self.algorithm, self.iterations
+
+    def to_dict(self) -> dict:
+        """
+        Converts the parameters to the dict that is stored in json database files
+        :return: The parameters as a dict
+        """
+        if self.is_scrypt():
+            return {"algorithm": self.algorithm, "log_n": self.log_n, "r": self.r, "p": self.p}
+
+        return {"algorithm": self.algorithm, "iterations": self.iterations}
+
+    @staticmethod
+    def from_dict(raw_parameters: dict):
+        """
+        Creates the parameters from the dict that is stored in json database files. Files that didn't store
+        a kdf yet get the one every database used back then
+        :param raw_parameters: The dict of the parameters or None
+        :return: The parameters
+        """
+        if raw_parameters is None:
+            return KdfParameters()
+
+        return KdfParameters(algorithm=raw_parameters.get("algorithm"),
+                             iterations=raw_parameters.get("iterations", DEFAULT_PBKDF2_ITERATIONS),
+                             log_n=raw_parameters.get("log_n", MIN_SCRYPT_LOG_N),
+                             r=raw_parameters.get("r", SCRYPT_R),
+                             p=raw_parameters.get("p", SCRYPT_P))
+
+    def __eq__(self, other):
+        if not isinstance(other, KdfParameters):
+            return False
+
+        return self.as_tuple() == other.as_tuple()
+
+    def __repr__(self):
+        return f"KdfParameters({', '.join(f'{key}={value!r}' for key, value in self.to_dict().items())})"
+
+
+def get_scrypt_memory(log_n: int, r: int) -> int:
+    return 128 * r * 2 ** log_n
+
+
+def get_configured_algorithm() -> str:
+    """
+    Gets the algorithm new databases are calibrated for, set by the environment variable PW_MANAGER_KDF
+    :return: One of CALIBRATED_ALGORITHMS
+    """
+    algorithm = os.environ.get(ENV_ALGORITHM, "").strip().lower() or DEFAULT_ALGORITHM
+
+    if algorithm not in CALIBRATED_ALGORITHMS:
+        raise ValueError(f"{ENV_ALGORITHM} has to be one of {', '.join(CALIBRATED_ALGORITHMS)}, not {algorithm}")
+
+    return algorithm
+
+
+def get_configured_target_seconds() -> float:
+    """
+    Gets how long unlocking new databases should take, set by the environment variable PW_MANAGER_KDF_SECONDS
+    :return: The target seconds
+    """
+    raw_seconds = os.environ.get(ENV_TARGET_SECONDS, "").strip()
+
+    if not raw_seconds:
+        return DEFAULT_TARGET_SECONDS
+
+    try:
+        return check_target_seconds(float(raw_seconds))
+    except ValueError:
+        raise ValueError(f"{ENV_TARGET_SECONDS} has to be a number of seconds between 0 and {MAX_TARGET_SECONDS}, not {raw_seconds}")
+
+
+def check_target_seconds(target_seconds: float) -> float:
+    if not 0 < target_seconds <= MAX_TARGET_SECONDS:
+        raise ValueError(f"Unlocking has to take between 0 and {MAX_TARGET_SECONDS} seconds, not {target_seconds}")
+
+    return target_seconds
+
+
+def _measure(parameters: KdfParameters) -> float:
+    start = time.perf_counter()
+    parameters.derive(b"calibration password", b"calibration salt")
+    return time.perf_counter() - start
+
+
+def calibrate(target_seconds: float = None, algorithm: str = None) -> KdfParameters:
+    """
+    Benchmarks this machine and picks the parameters that make deriving a key take about target_seconds,
+    but never less than the MIN_ values
+    :param target_seconds: How long unlocking a database should take, up to MAX_TARGET_SECONDS. The configured
+                           seconds if not given
+    :param algorithm: ALGORITHM_PBKDF2_SHA512_256 or ALGORITHM_SCRYPT, the configured one if not given
+    :return: The calibrated parameters
+    """
+    target_seconds = check_target_seconds(target_seconds) if target_seconds is not None else get_configured_target_seconds()
+    algorithm = algorithm if algorithm is not None else get_configured_algorithm()
+
+    if algorithm == ALGORITHM_SCRYPT:
+        parameters = KdfParameters(algorithm, log_n=MIN_SCRYPT_LOG_N)
+
+        # the cost doubles with every step, so it stops once the next step would overshoot the target
+        while get_scrypt_memory(parameters.log_n + 1, parameters.r) <= MAX_SCRYPT_MEMORY and _measure(parameters) * 2 <= target_seconds:
+            parameters.log_n += 1
+
+        parameters.check()
+
+        return parameters
+
+    if algorithm != ALGORITHM_PBKDF2_SHA512_256:
+        raise errors.DatabaseFormatException(f"Calibrating {algorithm} is not supported")
+
+    parameters = KdfParameters(algorithm, iterations=CALIBRATION_ITERATIONS)
+
+    elapsed = _measure(parameters)
+
+    while elapsed < CALIBRATION_MIN_SECONDS:
+        parameters.iterations *= 2
+        elapsed = _measure(parameters)
+
+    parameters.iterations = int(parameters.iterations * target_seconds / elapsed)
+    parameters.iterations = min(max(parameters.iterations, MIN_PBKDF2_ITERATIONS), MAX_PBKDF2_ITERATIONS)
+
+    parameters.check()
+
+    return parameters
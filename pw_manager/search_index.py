@@ -0,0 +1,122 @@
+"""
+In-memory trigram index over the entries of a database.
+
+Every indexed field of an entry is lowercased and split into trigrams, and every trigram points to the
+set of ids of the entries containing it. Only these postings are kept, never the texts themselves, so the
+index holds no copy of a field. A search term of at least three characters is resolved by intersecting the
+posting sets of its trigrams, starting with the smallest one. The remaining candidates still have to be
+checked against their entries with a real substring match, which is done by the database (see
+Database.search_entries()). Shorter terms don't have a trigram, so every entry is a candidate for them.
+
+The password isn't indexed by default, so searching doesn't touch secrets unless it is asked to.
+"""
+
+
+ALL_FIELDS = ("website_or_usage", "username", "description", "password")
+FIELDS_WITHOUT_PASSWORD = ("website_or_usage", "username", "description")
+
+NGRAM_LENGTH = 3
+
+
+def get_ngrams(text: str) -> set[str]:
+    """
+    Splits a lowercase text into its trigrams
+    :param text: The text to split
+    :return: A set of all trigrams in the text
+    """
+    return {text[i:i + NGRAM_LENGTH] for i in range(len(text) - NGRAM_LENGTH + 1)}
+
+
+def matches(texts: tuple, term: str) -> bool:
+    """
+    Checks if one of the texts of an entry contains a term. This is the real check of every search, the
+    trigrams only narrow down which entries it runs for
+    :param texts: The lowercase texts of the fields
+    :param term: The lowercase term
+    :return: If one of the texts contains the term
+    """
+    return any(term in text for text in texts)
+
+
+class SearchIndex:
+    def __init__(self, fields: tuple = FIELDS_WITHOUT_PASSWORD):
+        self.fields = fields
+
+        # trigram -> ids of the entries with a field containing it
+        self.postings: dict[str, set[str]] = dict()
+
+    def __get_entry_ngrams__(self, fields: dict) -> set[str]:
+        ngrams = set()
+
+        for field in self.fields:
+            text = fields.get(field)
+
+            if text:
+                ngrams.update(get_ngrams(text.lower()))
+
+        return ngrams
+
+    def add(self, entry_id: str, fields: dict) -> None:
+        """
+        Adds the fields of an entry to the index. Fields that aren't indexed are ignored, so this can also
+        add the fields of an entry that were missing when it was added the first time
+        :param entry_id: The id of the entry
+        :param fields: Dict of the fields of the entry, like Database.iter_entry_fields() produces them
+        """
+        postings = self.postings
+
+        for ngram in self.__get_entry_ngrams__(fields):
+            posting = postings.get(ngram)
+
+            if posting is None:
+                postings[ngram] = {entry_id}
+            else:
+                posting.add(entry_id)
+
+    def remove(self, entry_id: str, fields: dict) -> None:
+        """
+        Removes an entry from the index
+        :param entry_id: The id of the entry
+        :param fields: Dict of the fields the entry was added with
+        """
+        for ngram in self.__get_entry_ngrams__(fields):
+            posting = self.postings.get(ngram)
+
+            if posting is None:
+                continue
+
+            posting.discard(entry_id)
+
+            if not posting:
+                del self.postings[ngram]
+
+    def get_candidates(self, term: str) -> set[str] | None:
+        """
+        Gets the ids of all entries that can contain a term, which are the ones that have all of its trigrams
+        :param term: The lowercase term
+        :return: A set of the ids, None if the term is too short to have a trigram and every entry is a candidate
+        """
+        if len(term) < NGRAM_LENGTH:
+            return None
+
+        postings = []
+
+        for ngram in get_ngrams(term):
+            posting = self.postings.get(ngram)
+
+            if not posting:
+                return set()
+
+            postings.append(posting)
+
+        postings.sort(key=len)
+
+        candidates = set(postings[0])
+
+        for posting in postings[1:]:
+            candidates &= posting
+
+            if not candidates:
+                break
+
+        return candidates
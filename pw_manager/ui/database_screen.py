@@ -4,14 +4,14 @@ import traceback
 import json
 
 from colorama import Style, Fore
-from cryptography.fernet import InvalidToken, Fernet
+from cryptography.fernet import InvalidToken
 
 from YeetsMenu.menu import Menu
 from YeetsMenu.option import Option
 
+from pw_manager import compression, exporter, importer, kdf
 from pw_manager.utils import utils, constants, decorators, errors
-from pw_manager.db import Database
-from pw_manager.utils.legacy_encryption import encryptor
+from pw_manager.db import Database, FORMAT_BINARY
 from pw_manager.ui import db_sync_screen
 
 
@@ -51,6 +51,11 @@ def create_database():
         print(f"{Fore.RED}Creation aborted!{Style.RESET_ALL}")
         return
 
+    kdf_parameters = ask_for_kdf_parameters()
+
+    if kdf_parameters is None:
+        return
+
     utils.reset_style()
 
     folder = pathlib.Path(path_str)
@@ -63,7 +68,7 @@ def create_database():
 
     full_db_path = pathlib.Path(str(folder.absolute()) + "/" + file_name)
 
-    db: Database = Database(str(full_db_path), password)
+    db: Database = Database(str(full_db_path), password, kdf_parameters=kdf_parameters)
 
     done_event = threading.Event()
     try:
@@ -85,8 +90,45 @@ def create_database():
     print(f"{Fore.GREEN}Successfully created a database at {Fore.CYAN}{str(full_db_path.absolute())}{Fore.GREEN}!\n\n{Fore.MAGENTA}Note: You still have to select the database in order to use it!{Style.RESET_ALL}")
 
 
+def ask_for_kdf_parameters() -> kdf.KdfParameters | None:
+    """
+    Asks which kdf should unlock a database and calibrates it for this machine. The defaults are the algorithm
+    and seconds configured with the environment variables PW_MANAGER_KDF and PW_MANAGER_KDF_SECONDS
+    :return: The calibrated parameters or None if the input or the configuration isn't valid
+    """
+    try:
+        default_algorithm = kdf.get_configured_algorithm()
+        default_seconds = kdf.get_configured_target_seconds()
+    except ValueError as e:
+        print(f"{Fore.RED}{e}{Style.RESET_ALL}")
+        return None
+
+    algorithm = input(f"{Fore.MAGENTA}Which key derivation should unlock the database? ({', '.join(kdf.CALIBRATED_ALGORITHMS)}) Leave it empty for {default_algorithm}\n > {Fore.CYAN}").strip().lower()
+
+    if algorithm and algorithm not in kdf.CALIBRATED_ALGORITHMS:
+        print(f"{Fore.RED}Unknown key derivation {algorithm}!{Style.RESET_ALL}")
+        return None
+
+    raw_seconds = input(f"{Fore.MAGENTA}How many seconds should unlocking take on this machine? Leave it empty for {default_seconds}\n > {Fore.CYAN}").strip()
+    utils.reset_style()
+
+    try:
+        seconds = kdf.check_target_seconds(float(raw_seconds)) if raw_seconds else default_seconds
+    except ValueError:
+        print(f"{Fore.RED}Unlocking has to take more than 0 and at most {kdf.MAX_TARGET_SECONDS} seconds!{Style.RESET_ALL}")
+        return None
+
+    event = threading.Event()
+    threading.Thread(target=utils.run_spinning_animation_till_event, args=["Measuring the key derivation on this machine...", event]).start()
+
+    try:
+        return kdf.calibrate(seconds, algorithm or default_algorithm)
+    finally:
+        event.set()
+
+
 @decorators.catch_ctrl_c
-def select_database():
+def select_database(read_only: bool = False):
     utils.clear_screen()
 
     cache_file_path = pathlib.Path(utils.get_cache_file())
@@ -120,11 +162,17 @@ def select_database():
             utils.reset_style()
 
             try:
-                db: Database = Database(path, password)
+                previous_db: Database = constants.db_file
+
+                # the new instance has to see everything the previous one still had to write
+                if previous_db is not None:
+                    previous_db.flush()
+
+                db: Database = Database(path, password, read_only=read_only)
 
                 db.read()
 
-                constants.db_file = db
+                utils.make_current_db(db, previous_db)
                 break
             except InvalidToken:
                 print(f"{Fore.RED}Invalid password!{Style.RESET_ALL}")
@@ -133,6 +181,10 @@ def select_database():
                     continue
                 else:
                     return
+            except (errors.DatabaseFormatException, MemoryError, ValueError) as e:
+                # also a modified header that asks for a kdf this machine can't run
+                print(f"{Fore.RED}The database file can't be read: {e}{Style.RESET_ALL}")
+                return
 
         print(f"{Fore.GREEN}Successfully selected {Fore.MAGENTA}{constants.db_file.path}{Fore.GREEN} as the database!{Style.RESET_ALL}")
 
@@ -166,64 +218,213 @@ def add_existing_database():
         print(f"{Fore.RED}Failed to add the path {Fore.CYAN}{str(db_path.absolute())}{Fore.RED} to the list of known databases because it already is an entry!{Style.RESET_ALL}")
 
 
+@decorators.require_valid_db()
+def lock_database():
+    path = constants.db_file.path
+
+    constants.db_file.lock()
+
+    print(f"{Fore.GREEN}Successfully locked {Fore.MAGENTA}{path}{Fore.GREEN}!{Style.RESET_ALL}")
+
+
+@decorators.require_valid_db(writable=True)
+def convert_database():
+    db: Database = constants.db_file
+
+    algorithm = utils.ask_till_input(f"{Fore.MAGENTA}How should the database be compressed? ({', '.join(compression.ALGORITHMS)}, zlib is a good default)\n > {Fore.CYAN}").lower()
+    utils.reset_style()
+
+    if algorithm not in compression.ALGORITHMS:
+        print(f"{Fore.RED}Unknown compression {algorithm}!{Style.RESET_ALL}")
+        return
+
+    if db.storage_format == FORMAT_BINARY and db.compression == algorithm:
+        print(f"{Fore.GREEN}The database already is in the binary format with that compression!{Style.RESET_ALL}")
+        return
+
+    event = threading.Event()
+    threading.Thread(target=utils.run_spinning_animation_till_event, args=["Converting database...", event]).start()
+
+    try:
+        db.convert(FORMAT_BINARY, algorithm)
+    finally:
+        event.set()
+
+    utils.clear_screen()
+    print(f"{Fore.GREEN}Successfully converted {Fore.MAGENTA}{db.path}{Fore.GREEN} to the binary format with {algorithm} compression!{Style.RESET_ALL}")
+
+
 @decorators.catch_ctrl_c
-@decorators.require_valid_db
-def import_v1_database():
+@decorators.require_valid_db(writable=True)
+def rekey_database():
     utils.clear_screen()
-    utils.print_noice("Import a v1 database")
+    utils.print_noice("Change the key derivation")
 
-    print(f"{Fore.MAGENTA}This will import all the entries from the specified database into the currently loaded one!")
+    db: Database = constants.db_file
 
-    path = utils.ask_till_input(f"{Fore.MAGENTA}Please enter the directory path of the v1 database!\n > {Fore.CYAN}")
+    print(f"{Fore.MAGENTA}The database currently uses {db.kdf_parameters}. It gets encrypted again with a new salt and the new key derivation.")
 
-    path = pathlib.Path(path)
+    kdf_parameters = ask_for_kdf_parameters()
 
-    if not path.exists():
-        print(f"{Fore.RED}That path doesn't exist!{Style.RESET_ALL}")
+    if kdf_parameters is None:
         return
 
-    if path.is_dir() and not pathlib.Path(str(path.absolute()) + "/database.db").exists():
-        print(f"{Fore.RED}That path doesn't have a database.db file!")
+    event = threading.Event()
+    threading.Thread(target=utils.run_spinning_animation_till_event, args=["Encrypting the database again...", event]).start()
+
+    try:
+        db.rekey(kdf_parameters)
+    finally:
+        event.set()
+
+    utils.clear_screen()
+    print(f"{Fore.GREEN}Successfully changed the key derivation of {Fore.MAGENTA}{db.path}{Fore.GREEN} to {kdf_parameters}!{Style.RESET_ALL}")
+
+
+@decorators.catch_ctrl_c
+@decorators.require_valid_db(writable=True)
+def import_entries():
+    utils.clear_screen()
+    utils.print_noice("Import entries")
+
+    print(f"{Fore.MAGENTA}This will import all the entries from a v1 database, a CSV or a json export into the currently loaded database!")
+
+    path = utils.ask_till_input(f"{Fore.MAGENTA}Please enter the path of the file or the directory of the v1 database!\n > {Fore.CYAN}")
+
+    if not pathlib.Path(path).exists():
+        print(f"{Fore.RED}That path doesn't exist!{Style.RESET_ALL}")
         return
 
-    if path.is_file() and path.name == "database.db":
-        path = path.parent
+    source_format = importer.guess_format(path)
 
-    db_password = utils.ask_till_input_secret(f"{Fore.MAGENTA}Enter the password of the v1 database file!\n > {Fore.CYAN}")
+    if source_format is None:
+        print(f"{Fore.RED}Only v1 databases, .csv, .json and .jsonl files can be imported!{Style.RESET_ALL}")
+        return
 
-    with open(str(path.absolute()) + "/database.db.salt", "rb") as f:
-        salt = f.read()
+    password = None
 
-    with open(str(path.absolute()) + "/database.db", "rb") as f:
-        data = f.read()
+    if source_format == importer.FORMAT_V1:
+        password = utils.ask_till_input_secret(f"{Fore.MAGENTA}Enter the password of the v1 database file!\n > {Fore.CYAN}")
 
-    key, salt = encryptor.generate_key_using_password(db_password, salt)
-    fernet = Fernet(key)
+    event = threading.Event()
+    threading.Thread(target=utils.run_spinning_animation_till_event, args=["Importing entries...", event]).start()
 
     try:
-        unencrypted_content = fernet.decrypt(data)
+        report = importer.import_file(constants.db_file, path, source_format, password)
     except InvalidToken:
+        event.set()
+        utils.clear_screen()
+
         print(f"{Fore.RED}Wrong password!{Style.RESET_ALL}")
         return
+    except (ValueError, UnicodeDecodeError):
+        event.set()
+        utils.clear_screen()
+
+        print(f"{Fore.RED}The file couldn't be read!{Style.RESET_ALL}")
+        return
+    finally:
+        event.set()
+
+    utils.clear_screen()
+
+    print(f"{Fore.GREEN}Imported {report.imported} of {report.read} entries in {report.seconds:.2f}s ({report.get_records_per_second():.0f} entries/s)!{Style.RESET_ALL}")
+
+    if report.duplicates:
+        print(f"{Fore.CYAN}Skipped {report.duplicates} entries that already existed{Style.RESET_ALL}")
+
+    for number, reason in report.rejected:
+        print(f"{Fore.YELLOW}Entry {number} was rejected: {reason}{Style.RESET_ALL}")
+
+
+def ask_for_export_password() -> str | None:
+    while True:
+        password = utils.ask_till_input_secret(f"{Fore.MAGENTA}Please enter a password for the export!\n > {Fore.CYAN}")
+        confirmation_password = utils.ask_till_input_secret(f"{Fore.MAGENTA}Please confirm the password for the export!\n > {Fore.CYAN}")
+
+        if password == confirmation_password:
+            return password
+
+        yes_no = utils.ask_till_input(f"{Fore.MAGENTA}Passwords don't match! Do you want to try again? y/N\n > {Fore.CYAN}")
+
+        if yes_no.lower() != "y":
+            return None
+
+
+@decorators.catch_ctrl_c
+@decorators.require_valid_db()
+def export_entries():
+    utils.clear_screen()
+    utils.print_noice("Export entries")
+
+    print(f"{Fore.RED}Unless the export gets encrypted, every password in it can be read by anyone who gets the file!{Style.RESET_ALL}")
+
+    export_format = utils.ask_till_input(f"{Fore.MAGENTA}Which format should the export have? ({', '.join(exporter.FORMATS)})\n > {Fore.CYAN}").lower()
+
+    if export_format not in exporter.FORMATS:
+        print(f"{Fore.RED}Unknown format {export_format}!{Style.RESET_ALL}")
+        return
+
+    path = utils.ask_till_input(f"{Fore.MAGENTA}Please enter the file to export to!\n > {Fore.CYAN}")
+
+    if not pathlib.Path(path).absolute().parent.exists():
+        print(f"{Fore.RED}The directory of that file doesn't exist!{Style.RESET_ALL}")
+        return
+
+    term = input(f"{Fore.MAGENTA}Enter a term to only export the entries that contain it. Leave it empty to export all of them\n > {Fore.CYAN}")
+
+    password = None
+
+    if utils.ask_till_input(f"{Fore.MAGENTA}Should the export be encrypted with a password of its own? y/n\n > {Fore.CYAN}").lower() == "y":
+        password = ask_for_export_password()
+
+        if password is None:
+            return
+
+    utils.reset_style()
 
     event = threading.Event()
-    threading.Thread(target=utils.run_spinning_animation_till_event, args=["Importing database...", event]).start()
+    threading.Thread(target=utils.run_spinning_animation_till_event, args=["Exporting entries...", event]).start()
 
-    json_content: dict = json.loads(unencrypted_content.decode())
+    try:
+        report = exporter.export_database(constants.db_file, path, export_format, [term], password)
+    finally:
+        event.set()
 
-    db: Database = constants.db_file
+    utils.clear_screen()
+
+    print(f"{Fore.GREEN}Exported {report.exported} of {report.checked} entries to {Fore.CYAN}{path}{Fore.GREEN} in {report.seconds:.2f}s ({report.get_entries_per_second():.0f} entries/s)!{Style.RESET_ALL}")
 
-    for key, value in json_content.items():
-        website_or_usage = key
-        description = value.get("description")
-        username = value.get("username")
-        password = value.get("password")
+    if report.encrypted:
+        print(f"{Fore.CYAN}The export is encrypted, it can be decrypted in this menu with its password{Style.RESET_ALL}")
 
-        db.add_database_entry(website_or_usage=website_or_usage, description=description, username=username, password=password, should_write=False)
 
-    db.write()
+@decorators.catch_ctrl_c
+def decrypt_export():
+    utils.clear_screen()
+    utils.print_noice("Decrypt an export")
+
+    path = utils.ask_till_input(f"{Fore.MAGENTA}Please enter the path of the encrypted export!\n > {Fore.CYAN}")
+
+    if not pathlib.Path(path).is_file() or not exporter.is_encrypted_export(path):
+        print(f"{Fore.RED}That file isn't an encrypted export!{Style.RESET_ALL}")
+        return
+
+    output_path = utils.ask_till_input(f"{Fore.MAGENTA}Please enter the file to write the decrypted export to!\n > {Fore.CYAN}")
+    password = utils.ask_till_input_secret(f"{Fore.MAGENTA}Enter the password of the export!\n > {Fore.CYAN}")
+
+    utils.reset_style()
+
+    try:
+        exporter.decrypt_export(path, password, output_path)
+    except InvalidToken:
+        print(f"{Fore.RED}Wrong password or the export was modified!{Style.RESET_ALL}")
+        return
+    except errors.DatabaseFormatException as e:
+        print(f"{Fore.RED}The export can't be read: {e}{Style.RESET_ALL}")
+        return
 
-    event.set()
+    print(f"{Fore.GREEN}Successfully decrypted the export to {Fore.CYAN}{output_path}{Fore.GREEN}!{Style.RESET_ALL}")
 
 
 def show():
@@ -233,8 +434,14 @@ def show():
 
     menu.add_selectable(Option("Create database", create_database))
     menu.add_selectable(Option("Select database", select_database, return_after_execution=True))
+    menu.add_selectable(Option("Select database read-only", select_database, True, return_after_execution=True))
     menu.add_selectable(Option("Add already existing database", add_existing_database))
-    menu.add_selectable(Option("Import v1 database", import_v1_database))
+    menu.add_selectable(Option("Lock database", lock_database))
+    menu.add_selectable(Option("Convert database to the binary format or change its compression", convert_database))
+    menu.add_selectable(Option("Change the key derivation of the database", rekey_database))
+    menu.add_selectable(Option("Import entries (v1 database, CSV or json)", import_entries))
+    menu.add_selectable(Option("Export entries (CSV or json lines)", export_entries))
+    menu.add_selectable(Option("Decrypt an export", decrypt_export))
     menu.add_selectable(Option("Sync settings", db_sync_screen.show, skip_enter_confirmation=True))
 
     menu.run()
@@ -1,14 +1,15 @@
 import pathlib
 import threading
-import subprocess
-import json
 
-from pw_manager.utils import utils, decorators, constants
-from pw_manager.db_sync import db_sync
+from pw_manager.utils import utils, decorators, constants, errors
+from pw_manager.db_sync import db_sync, replication
 from pw_manager.db import Database
+from pw_manager import write_behind
 
 from YeetsMenu.menu import Menu, Option
 from colorama import Style, Fore
+import paramiko
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import InvalidToken
 
 
@@ -17,22 +18,30 @@ from cryptography.fernet import InvalidToken
 def upload_current_db():
     event = threading.Event()
     try:
-        with open(utils.get_sync_file()) as f:
-            data: dict = json.load(f)
+        config = replication.read_sync_config()
 
         threading.Thread(target=utils.run_spinning_animation_till_event, args=["Uploading file...", event]).start()
 
-        db_sync.sync(db=constants.db_file,
-                     action=db_sync.Options.UPLOAD,
-                     server=data.get("server"),
-                     username=data.get("username"),
-                     password=data.get("password"),
-                     path=data.get("path"))
+        # uploads to every server at the same time
+        report = replication.replicate(constants.db_file, config)
 
     finally:
         event.set()
 
     utils.clear_screen()
+
+    for result in report.results:
+        if not result.succeeded():
+            print(f"{Fore.RED}{result.target}: failed after {result.attempts} attempt(s): {result.error}{Style.RESET_ALL}")
+        elif result.transferred:
+            print(f"{Fore.GREEN}{result.target}: uploaded in {result.seconds:.1f}s{Style.RESET_ALL}")
+        else:
+            print(f"{Fore.GREEN}{result.target}: already up to date{Style.RESET_ALL}")
+
+    if not report.reached_quorum():
+        print(f"{Fore.RED}Only {len(report.get_succeeded())} of the {report.quorum} required servers have the new version!{Style.RESET_ALL}")
+        return
+
     print(f"{Fore.GREEN}Successfully uploaded the database file!{Style.RESET_ALL}")
 
 
@@ -41,22 +50,32 @@ def upload_current_db():
 def download_and_replace_current_db():
     event = threading.Event()
     try:
-        with open(utils.get_sync_file()) as f:
-            data: dict = json.load(f)
+        target = replication.read_sync_config().get_primary()
 
         threading.Thread(target=utils.run_spinning_animation_till_event, args=["Downloading file...", event]).start()
 
-        db_sync.sync(db=constants.db_file,
-                     action=db_sync.Options.DOWNLOAD,
-                     server=data.get("server"),
-                     username=data.get("username"),
-                     password=data.get("password"),
-                     path=data.get("path"))
+        # the background writer must not write the old content over the downloaded file
+        constants.db_file.disable_write_behind()
+
+        downloaded = db_sync.sync(db=constants.db_file,
+                                  action=db_sync.Options.DOWNLOAD,
+                                  server=target.server,
+                                  username=target.username,
+                                  password=target.password,
+                                  path=target.path)
 
     finally:
         event.set()
 
     utils.clear_screen()
+
+    if not downloaded:
+        # the local file is the same as the remote one, so the opened database stays as it is
+        if not constants.db_file.read_only and write_behind.is_enabled_by_environment():
+            constants.db_file.enable_write_behind()
+
+        print(f"{Fore.GREEN}The local database file is already up to date!{Style.RESET_ALL}")
+        return
     print(f"{Fore.GREEN}Successfully downloaded the database file!{Style.RESET_ALL}")
 
     while True:
@@ -64,11 +83,13 @@ def download_and_replace_current_db():
         utils.reset_style()
 
         try:
-            db: Database = Database(constants.db_file.path, password)
+            previous_db: Database = constants.db_file
+
+            db: Database = Database(previous_db.path, password)
 
             db.read()
 
-            constants.db_file = db
+            utils.make_current_db(db, previous_db)
             break
         except InvalidToken:
             print(f"{Fore.RED}Invalid password!{Style.RESET_ALL}")
@@ -77,10 +98,74 @@ def download_and_replace_current_db():
                 continue
             else:
                 break
+        except (errors.DatabaseFormatException, MemoryError, ValueError) as e:
+            # also a modified header that asks for a kdf this machine can't run
+            print(f"{Fore.RED}The downloaded database file can't be read: {e}{Style.RESET_ALL}")
+            break
 
     print(f"{Fore.GREEN}Successfully selected the downloaded database!{Style.RESET_ALL}")
 
 
+@decorators.require_valid_db(writable=True)
+@decorators.require_valid_sync_config()
+def merge_with_server():
+    event = threading.Event()
+    try:
+        target = replication.read_sync_config().get_primary()
+
+        threading.Thread(target=utils.run_spinning_animation_till_event, args=["Merging with the server...", event]).start()
+
+        result = db_sync.merge_sync(db=constants.db_file,
+                                    server=target.server,
+                                    username=target.username,
+                                    password=target.password,
+                                    path=target.path)
+
+    except errors.RemoteDatabaseChangedException:
+        event.set()
+        utils.clear_screen()
+
+        print(f"{Fore.RED}The database file on the server was changed while merging, please try again!{Style.RESET_ALL}")
+        return
+
+    except (InvalidToken, InvalidTag):
+        event.set()
+        utils.clear_screen()
+
+        print(f"{Fore.RED}The database file on the server can't be decrypted with the password of this database!{Style.RESET_ALL}")
+        return
+
+    except IOError as e:
+        event.set()
+        utils.clear_screen()
+
+        print(f"{Fore.RED}The database file on the server couldn't be downloaded: {e}{Style.RESET_ALL}")
+        return
+
+    except (errors.DatabaseFormatException, MemoryError, ValueError) as e:
+        event.set()
+        utils.clear_screen()
+
+        print(f"{Fore.RED}The database file on the server can't be read: {e}{Style.RESET_ALL}")
+        return
+
+    finally:
+        event.set()
+
+    utils.clear_screen()
+
+    if not result.changes_local() and not result.changes_remote():
+        print(f"{Fore.GREEN}Both databases are already up to date!{Style.RESET_ALL}")
+        return
+
+    print(f"{Fore.GREEN}Successfully merged with the server!{Style.RESET_ALL}")
+    print(f"{Fore.CYAN}Local: {len(result.local_changes)} added or changed, {len(result.local_deletions)} deleted{Style.RESET_ALL}")
+    print(f"{Fore.CYAN}Server: {result.remote_additions} added, {result.remote_updates} changed, {result.remote_deletions} deleted{Style.RESET_ALL}")
+
+    for conflict in result.conflicts:
+        print(f"{Fore.YELLOW}Conflict in \"{conflict.website_or_usage}\": {conflict.reason}, kept the {conflict.resolution} version{Style.RESET_ALL}")
+
+
 @decorators.catch_ctrl_c
 def setup_sync():
     utils.clear_screen()
@@ -97,50 +182,70 @@ def setup_sync():
 
         print(f"{Fore.GREEN}Overwriting...")
 
-    server = utils.ask_till_input(f"{Fore.MAGENTA}Please enter a server to sync your database with!\n > {Fore.CYAN}").strip()
+    targets = []
 
-    event = threading.Event()
-    threading.Thread(target=utils.run_spinning_animation_till_event, args=["Running a quick ping to see if the server is reachable!", event]).start()
-    process = subprocess.Popen(f"ping -c 2 {server}".split(" "), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    exit_code = process.wait(timeout=30)
-    event.set()
-    utils.clear_screen()
+    while True:
+        target = ask_for_target()
+
+        if target is None:
+            return
+
+        targets.append(target)
+
+        add_another = utils.ask_till_input(f"{Fore.MAGENTA}Do you want to keep a copy on another server as well? y/N\n > {Fore.CYAN}")
+        utils.reset_style()
+
+        if not add_another.lower().strip() == "y":
+            break
+
+    quorum = None
+
+    if len(targets) > 1:
+        raw_quorum = utils.ask_till_input(f"{Fore.MAGENTA}On how many of the {len(targets)} servers does an upload have to succeed? (1-{len(targets)})\n > {Fore.CYAN}")
+        utils.reset_style()
+
+        if raw_quorum.isdigit() and 1 <= int(raw_quorum) < len(targets):
+            quorum = int(raw_quorum)
+
+    replication.write_sync_config(replication.SyncConfig(targets, quorum))
+
+    print(f"{Fore.GREEN}Configuration successfully saved!{Style.RESET_ALL}")
 
-    if exit_code != 0:
-        print(f"{Fore.RED}The server \"{server}\" could not be reached!{Style.RESET_ALL}")
-        return
 
-    print(f"{Fore.GREEN}Server could be reached!{Style.RESET_ALL}")
+def ask_for_target() -> replication.Target | None:
+    """
+    Asks for the server, credentials and path of a sync target and checks the credentials
+    :return: The target or None if it didn't work
+    """
+    server = utils.ask_till_input(f"{Fore.MAGENTA}Please enter a server to sync your database with!\n > {Fore.CYAN}").strip()
     username = utils.ask_till_input(f"{Fore.MAGENTA}Please enter a username to that server!\n > {Fore.CYAN}").strip()
     password = utils.ask_till_input_secret(f"{Fore.MAGENTA}Please enter the password to that username!\n > {Fore.CYAN}").strip()
 
     event = threading.Event()
     threading.Thread(target=utils.run_spinning_animation_till_event, args=["Checking if the credentials are working!", event]).start()
 
-    valid = db_sync.check_credentials(server, username, password)
+    # connecting to the server shows if it can be reached, the connection is then reused by the syncs
+    try:
+        valid = db_sync.check_credentials(server, username, password)
+    except (OSError, paramiko.SSHException):
+        event.set()
+        utils.clear_screen()
+
+        print(f"{Fore.RED}The server \"{server}\" could not be reached!{Style.RESET_ALL}")
+        return None
 
     event.set()
     utils.clear_screen()
 
     if not valid:
         print(f"{Fore.RED}Credentials are not working!{Style.RESET_ALL}")
-        return
+        return None
 
     print(f"{Fore.GREEN}Credentials are working!{Style.RESET_ALL}")
 
     path = utils.ask_till_input(f"{Fore.MAGENTA}Please enter the path of where the database should be stored on the server! (with the .db ending)\n > {Fore.CYAN}")
 
-    with open(utils.get_sync_file(), "w+") as f:
-        data = {
-            "server": server,
-            "username": username,
-            "password": password,
-            "path": path
-        }
-
-        json.dump(data, f, indent=2)
-
-    print(f"{Fore.GREEN}Configuration successfully saved!{Style.RESET_ALL}")
+    return replication.Target(server, username, password, path)
 
 
 def show():
@@ -150,5 +255,6 @@ def show():
     menu.add_selectable(Option("Setup sync", setup_sync))
     menu.add_selectable(Option("Upload current db", upload_current_db))
     menu.add_selectable(Option("Download and replace current db", download_and_replace_current_db))
+    menu.add_selectable(Option("Merge current db with the server", merge_with_server))
 
     menu.run()
@@ -8,6 +8,7 @@ from YeetsMenu.option import Option
 from colorama import Style, Fore
 
 import pw_manager.db
+from pw_manager import search_index
 from pw_manager.utils import utils, constants
 from pw_manager.utils import decorators
 from pw_manager.db_entry import DatabaseEntry
@@ -38,7 +39,7 @@ def search_entry():
     utils.get_entry("Search entry", show_entry)
 
 
-@decorators.require_valid_db(enter_confirmation=True)
+@decorators.require_valid_db(enter_confirmation=True, writable=True)
 def add_entry(provided_password: str = ""):
     utils.clear_screen()
     utils.print_noice("Add entry")
@@ -79,7 +80,7 @@ def add_entry(provided_password: str = ""):
     print(f"{Fore.GREEN}Entry successfully added!{Style.RESET_ALL}")
 
 
-@decorators.require_valid_db(enter_confirmation=True)
+@decorators.require_valid_db(enter_confirmation=True, writable=True)
 def modify_entry():
     utils.clear_screen()
     utils.print_noice("Modify entry")
@@ -180,6 +181,7 @@ def password_generator():
             add_entry(password)
 
 
+@decorators.require_valid_db(enter_confirmation=True, writable=True)
 def delete_entry():
     utils.clear_screen()
     utils.print_noice("Delete entry")
@@ -207,6 +209,24 @@ def delete_entry():
     utils.get_entry("Delete entry", real_delete_entry, skip_enter_confirmation=True)
 
 
+@decorators.require_valid_db(enter_confirmation=True)
+def toggle_password_search():
+    db: pw_manager.db.Database = constants.db_file
+
+    search_passwords = "password" not in db.search_fields
+
+    if search_passwords:
+        if utils.ask_till_input(f"{Fore.MAGENTA}Searching in passwords keeps parts of every password of this database in memory until it gets locked. Do you want to turn it on? y/N\n > {Fore.CYAN}").lower() != "y":
+            utils.reset_style()
+            return
+
+        utils.reset_style()
+
+    db.set_search_fields(search_index.ALL_FIELDS if search_passwords else search_index.FIELDS_WITHOUT_PASSWORD)
+
+    print(f"{Fore.GREEN}Searching in passwords is now {'on' if search_passwords else 'off'} until the database gets locked!{Style.RESET_ALL}")
+
+
 def show():
     utils.clear_screen()
 
@@ -217,5 +237,6 @@ def show():
     menu.add_selectable(Option("Modify an entry", modify_entry, skip_enter_confirmation=True))
     menu.add_selectable(Option("Delete an entry", delete_entry, skip_enter_confirmation=True))
     menu.add_selectable(Option("Password generator", password_generator))
+    menu.add_selectable(Option("Turn searching in passwords on or off", toggle_password_search))
 
     menu.run()
@@ -1,11 +1,11 @@
 import pathlib
 
-from pw_manager.utils import constants, utils
+from pw_manager.utils import constants, errors, utils
 
 from colorama import Fore, Style
 
 
-def require_valid_db(enter_confirmation=False):
+def require_valid_db(enter_confirmation=False, writable=False):
     def decorator(func):
         def inner(*args, **kwargs):
             if constants.db_file is None:
@@ -14,6 +14,12 @@ def require_valid_db(enter_confirmation=False):
                     utils.enter_confirmation()
                 return
 
+            elif writable and constants.db_file.read_only:
+                print(f"{Fore.RED}The database is opened read-only! Select it again to change it.{Style.RESET_ALL}")
+                if enter_confirmation:
+                    utils.enter_confirmation()
+                return
+
             else:
                 func(*args, **kwargs)
 
@@ -30,6 +36,17 @@ def require_valid_sync_config(enter_confirmation=False):
                     utils.enter_confirmation()
                 return
 
+            # imported here because replication imports the db, which imports this package
+            from pw_manager.db_sync import replication
+
+            try:
+                replication.read_sync_config()
+            except errors.SyncConfigException as e:
+                print(f"{Fore.RED}Your sync settings are not valid, please set them up again! {e}{Style.RESET_ALL}")
+                if enter_confirmation:
+                    utils.enter_confirmation()
+                return
+
             func(*args, **kwargs)
 
         return inner
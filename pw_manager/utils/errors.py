@@ -12,3 +12,23 @@ class DatabasePathDoesNotExistException(Exception):
 
 class SFTPSettingsFileNotPresent(Exception):
     pass
+
+
+class DatabaseJournalCorruptedException(Exception):
+    pass
+
+
+class DatabaseFormatException(Exception):
+    pass
+
+
+class DatabaseReadOnlyException(Exception):
+    pass
+
+
+class RemoteDatabaseChangedException(Exception):
+    pass
+
+
+class SyncConfigException(Exception):
+    pass
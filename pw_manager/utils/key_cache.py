@@ -0,0 +1,91 @@
+import base64
+import hashlib
+import hmac
+import threading
+
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+
+"""
+Session cache for derived vault keys.
+
+Entries are keyed by (absolute vault path, salt, kdf params) and remember a digest of the password
+they were derived from, so a different password for the same vault never gets the cached key.
+"""
+
+
+class SessionKeys:
+    def __init__(self, key: bytes):
+        """
+        :param key: The derived key of a vault, urlsafe base64 encoded like Fernet expects it
+        """
+        self.fernet = Fernet(key)
+
+        # the binary format uses AES-GCM, so it gets its own subkey instead of sharing the Fernet key
+        self.aead = AESGCM(HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"pw_manager vault aead").derive(base64.urlsafe_b64decode(key)))
+
+
+_cache: dict[tuple, tuple[bytes, SessionKeys]] = dict()
+_lock = threading.Lock()
+
+
+def _password_digest(password: str) -> bytes:
+    return hashlib.sha256(password.encode()).digest()
+
+
+def get(path: str, salt: bytes, kdf_params: tuple, password: str):
+    """
+    Gets the cached keys of a vault
+    :param path: Absolute path of the vault
+    :param salt: Salt of the vault
+    :param kdf_params: The parameters the key was derived with
+    :param password: The password of the vault
+    :return: The cached SessionKeys or None if there are no matching keys
+    """
+    with _lock:
+        cached = _cache.get((path, salt, kdf_params))
+
+    if cached is None:
+        return None
+
+    digest, keys = cached
+
+    if not hmac.compare_digest(digest, _password_digest(password)):
+        return None
+
+    return keys
+
+
+def put(path: str, salt: bytes, kdf_params: tuple, password: str, key: bytes) -> SessionKeys:
+    """
+    Caches a derived key for the rest of the session
+    :param path: Absolute path of the vault
+    :param salt: Salt of the vault
+    :param kdf_params: The parameters the key was derived with
+    :param password: The password of the vault
+    :param key: The derived key
+    :return: The SessionKeys for the key
+    """
+    keys = SessionKeys(key)
+
+    with _lock:
+        _cache[(path, salt, kdf_params)] = (_password_digest(password), keys)
+
+    return keys
+
+
+def wipe(path: str = None) -> None:
+    """
+    Removes cached keys
+    :param path: Only remove the keys of this vault. Removes every key if not given
+    """
+    with _lock:
+        if path is None:
+            _cache.clear()
+            return
+
+        for cache_key in [cache_key for cache_key in _cache.keys() if cache_key[0] == path]:
+            del _cache[cache_key]
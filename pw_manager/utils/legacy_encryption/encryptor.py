@@ -1,11 +1,13 @@
 import base64
 
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.fernet import Fernet
 import os
 
+from pw_manager import kdf
+
+# v1 databases always used this kdf
+V1_KDF_PARAMETERS = kdf.KdfParameters(kdf.ALGORITHM_PBKDF2_SHA256, iterations=100000)
+
 
 def generate_key_using_password(password, salt=os.urandom(16)) -> (bytes, bytes):
     """
@@ -14,15 +16,7 @@ def generate_key_using_password(password, salt=os.urandom(16)) -> (bytes, bytes)
     :param password:
     :return: A generated key using a password
     """
-    byte_password = password.encode()
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=100000,
-        backend=default_backend()
-    )
-    return base64.urlsafe_b64encode(kdf.derive(byte_password)), salt
+    return base64.urlsafe_b64encode(V1_KDF_PARAMETERS.derive(password.encode(), salt)), salt
 
 
 def encrypt_file(key, filepath) -> None:
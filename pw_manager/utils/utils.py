@@ -1,5 +1,8 @@
+import contextlib
 import os
+import stat
 import sys
+import tempfile
 import time
 import pathlib
 import json
@@ -11,7 +14,14 @@ from YeetsMenu.option import Option
 from colorama import Style, Fore
 from stdiomask import getpass
 
-from pw_manager.utils import constants
+from pw_manager import instrumentation, write_behind
+from pw_manager.utils import constants, key_cache
+
+try:
+    import fcntl
+except ImportError:
+    # not available on windows, files aren't locked between processes there
+    fcntl = None
 
 
 def clear_screen():
@@ -38,11 +48,38 @@ def run_spinning_animation_till_event(message: str, event: threading.Event, slee
 def exit_pw_manager():
     finished_cleanup_event = threading.Event()
     threading.Thread(target=run_spinning_animation_till_event, args=["Shutting down...", finished_cleanup_event]).start()
-    # do any cleanup work here
-    finished_cleanup_event.set()
+    try:
+        # do any cleanup work here
+        if constants.db_file is not None:
+            constants.db_file.flush()
+    finally:
+        # imported here because db_sync imports this module
+        from pw_manager.db_sync.connection_pool import pool
+        pool.close_all()
+
+        key_cache.wipe()
+        finished_cleanup_event.set()
     exit(0)
 
 
+def make_current_db(db, previous_db) -> None:
+    """
+    Makes a db that was just read the current one. The previous one gets flushed and locked, also if it is the
+    same file, so there is never a second instance left that writes to it. The cached key of the file stays in
+    that case, the new instance uses it
+    :param db: The db that was just read
+    :param previous_db: The db that was the current one before, or None
+    """
+    if previous_db is not None and previous_db is not db:
+        previous_db.flush()
+        previous_db.lock(keep_session_key=previous_db.get_absolute_path() == db.get_absolute_path())
+
+    if not db.read_only and write_behind.is_enabled_by_environment():
+        db.enable_write_behind()
+
+    constants.db_file = db
+
+
 def get_root_folder() -> str:
     return str(pathlib.Path(__file__).parent.parent.parent.absolute())
 
@@ -59,6 +96,10 @@ def get_sync_file():
     return get_data_folder() + "/sync.json"
 
 
+def get_writer_id_file():
+    return get_data_folder() + "/writer_id"
+
+
 def ask_till_input(string_to_ask) -> str:
     _input = ""
 
@@ -157,6 +198,66 @@ def add_db_path_to_cache(path: str) -> bool:
     return True
 
 
+@contextlib.contextmanager
+def lock_file(path: str):
+    """
+    Holds an exclusive lock on a lock file in a with block, so processes that change the same file take turns.
+    Does nothing where fcntl isn't available
+    :param path: The lock file, it gets created if it doesn't exist
+    """
+    if fcntl is None:
+        yield
+        return
+
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def write_file_atomically(path: str, write_content, fsync_directory: bool = False, mode: str = "w") -> None:
+    """
+    Writes a file by writing a temporary file in the same directory and replacing the file with it,
+    so the file is either completely old or completely new if something crashes in between
+    :param path: The path of the file to write
+    :param write_content: Function that gets the opened temporary file and writes the content into it
+    :param fsync_directory: If the directory should be synced as well, so the replacement itself survives a crash
+    :param mode: The mode to open the temporary file with
+    """
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+
+    fd, tmp_path = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+
+    try:
+        with os.fdopen(fd, mode) as f:
+            write_content(f)
+
+            with instrumentation.span("disk.sync"):
+                f.flush()
+                os.fsync(f.fileno())
+
+        if os.path.exists(path):
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+
+        os.replace(tmp_path, path)
+
+    except BaseException:
+        pathlib.Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+    if fsync_directory and hasattr(os, "O_DIRECTORY"):
+        directory_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+
 def reset_style():
     print(Style.RESET_ALL, end='')
 
@@ -180,9 +281,9 @@ def get_entry(title: str, func_to_run, skip_enter_confirmation: bool = True):
 
         db = constants.db_file
 
-        entries: list = db.get_all_entries()
-
-        entries.sort()
+        with instrumentation.span("get_entry.list") as list_span:
+            entries: list = db.get_sorted_entries()
+            list_span.add("entries", len(entries))
 
         i: int = 1
 
@@ -217,21 +318,9 @@ def get_entry(title: str, func_to_run, skip_enter_confirmation: bool = True):
             func_to_run(selected_entry)
 
         else:
-            result_list = []
-
-            for entry in entries:
-
-                if user_input.lower() in entry.website_or_usage.lower():
-                    result_list.append(entry)
-
-                elif user_input.lower() in entry.username.lower():
-                    result_list.append(entry)
-
-                elif user_input.lower() in entry.description.lower():
-                    result_list.append(entry)
-
-                elif user_input.lower() in entry.password.lower():
-                    result_list.append(entry)
+            with instrumentation.span("get_entry.search") as search_span:
+                result_list = db.search_entries(user_input)
+                search_span.add("entries", len(result_list))
 
             menu = Menu(get_noice_text(f"Search result for \"{user_input}\""), colors=constants.colors)
 
@@ -0,0 +1,374 @@
+import collections
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from pw_manager import compression as compression_module
+from pw_manager import kdf as kdf_module
+from pw_manager.utils import errors
+
+
+"""
+Binary container format of database files.
+
+All integers are little endian.
+
+Header:
+    magic           4 bytes     b"PWMV"
+    version         u16
+    flags           u16         the lowest 4 bits are the compression of the chunks: 0 = none, 1 = zlib, 2 = lzma.
+                                The other bits are reserved and have to be 0
+    kdf             u8          1 = PBKDF2-HMAC-SHA512/256, 2 = scrypt
+    kdf parameter   u32         the iterations for PBKDF2, log2(n) | r << 8 | p << 16 for scrypt
+    salt length     u8
+    salt            salt length bytes
+
+Body:
+    index chunks    u32
+    data chunks     u32
+    data            blob * data chunks, json lines of ["id", "username", "description", "password"]
+    index           blob * index chunks, json lines of ["id", "website_or_usage", number of the data chunk, modification clock]
+
+Every blob is a u32 length followed by a 12 byte nonce and the AES-GCM ciphertext of a chunk, compressed
+before it got encrypted if the flags say so (see compression.py). Chunks hold whole lines and are closed once
+they reach CHUNK_SIZE before compression, so every chunk can be encrypted and decrypted on its
+own and in parallel. The associated data of a chunk is the header, its section, its number and whether it is
+the last chunk of its section. Changing the header, reordering, dropping or truncating chunks therefore makes
+the decryption fail.
+
+The data section comes first and nothing depends on the chunk counts, so a file can be written in a single
+pass: chunks are encrypted and written as soon as they are full, and the counts are filled in at the end.
+
+Older versions are still read:
+    Version 1 stored the index in a single blob and every entry in its own blob.
+    Version 2 had the index section before the data section, and the chunk counts were part of the
+    associated data of every chunk.
+    Version 3 had no modification clock in the index lines, its entries get 0.
+
+After the body follows the journal, exactly like in the json format: one Fernet token per line.
+"""
+
+
+MAGIC = b"PWMV"
+VERSION = 4
+SUPPORTED_VERSIONS = (1, 2, 3, 4)
+
+KDF_PBKDF2_SHA512_256 = 1
+KDF_SCRYPT = 2
+
+NONCE_LENGTH = 12
+
+CHUNK_SIZE = 64 * 1024
+
+SECTION_INDEX = b"I"
+SECTION_DATA = b"D"
+
+FLAG_COMPRESSION_MASK = 0x000F
+
+COMPRESSION_FLAGS = {
+    compression_module.NONE: 0,
+    compression_module.ZLIB: 1,
+    compression_module.LZMA: 2
+}
+
+HEADER = struct.Struct("<4sHHBIB")
+UINT32 = struct.Struct("<I")
+CHUNK_COUNTS = struct.Struct("<II")
+CHUNK_POSITION = struct.Struct("<IB")
+
+
+class SealedChunk:
+    """
+    An encrypted data chunk that the entries in it point to until they get unsealed
+    """
+    __slots__ = ("source", "start", "end", "associated_data", "compression", "entries")
+
+    def __init__(self, source, associated_data: bytes, start: int = 0, end: int = None, compression: str = compression_module.NONE):
+        """
+        :param source: The blob of the chunk, or a memory mapped database file the blob is a part of
+        :param associated_data: The associated data of the chunk
+        :param start: Where the blob starts in source
+        :param end: Where the blob ends in source, the end of source if not given
+        :param compression: The compression of the file the chunk was read from
+        """
+        self.source = source
+        self.start = start
+        self.end = end if end is not None else len(source)
+        self.compression = compression
+        self.associated_data = associated_data
+
+        # the decrypted fields of the entries that weren't unsealed yet, once the chunk got decrypted
+        self.entries: dict[str, list] | None = None
+
+    @property
+    def blob(self) -> bytes:
+        # slicing a whole bytes object doesn't copy it, slicing a memory mapped file only touches the pages of the chunk
+        return self.source[self.start:self.end]
+
+
+def is_binary_vault(data: bytes) -> bool:
+    """
+    Checks if the content of a database file is in the binary format
+    :param data: The content of the database file, or at least the beginning of it
+    :return: If it is in the binary format
+    """
+    return data[:len(MAGIC)] == MAGIC
+
+
+def pack_header(salt: bytes, kdf_parameters: kdf_module.KdfParameters, compression: str = compression_module.NONE) -> bytes:
+    """
+    Packs the header of a database file
+    :param salt: The salt of the database
+    :param kdf_parameters: The kdf of the database
+    :param compression: The compression of the chunks
+    :return: The header as bytes
+    """
+    compression_module.check_algorithm(compression)
+
+    flags = COMPRESSION_FLAGS.get(compression)
+    kdf, kdf_parameter = pack_kdf_parameters(kdf_parameters)
+
+    return HEADER.pack(MAGIC, VERSION, flags, kdf, kdf_parameter, len(salt)) + salt
+
+
+def pack_kdf_parameters(kdf_parameters: kdf_module.KdfParameters) -> (int, int):
+    """
+    Packs a kdf the way headers store it
+    :param kdf_parameters: The parameters of the kdf
+    :return: The id of the kdf and its packed parameter
+    """
+    # the fields might have been changed since the parameters were created, and would overlap if they are too big
+    kdf_parameters.check()
+
+    if kdf_parameters.algorithm == kdf_module.ALGORITHM_SCRYPT:
+        return KDF_SCRYPT, kdf_parameters.log_n | kdf_parameters.r << 8 | kdf_parameters.p << 16
+
+    if kdf_parameters.algorithm == kdf_module.ALGORITHM_PBKDF2_SHA512_256:
+        return KDF_PBKDF2_SHA512_256, kdf_parameters.iterations
+
+    raise errors.DatabaseFormatException(f"The kdf {kdf_parameters.algorithm} can't be stored in the binary format")
+
+
+def unpack_kdf_parameters(kdf: int, kdf_parameter: int) -> kdf_module.KdfParameters:
+    """
+    Unpacks the kdf of a header
+    :param kdf: The id of the kdf
+    :param kdf_parameter: The packed parameter of the kdf
+    :return: The parameters of the kdf
+    """
+    if kdf == KDF_SCRYPT:
+        return kdf_module.KdfParameters(kdf_module.ALGORITHM_SCRYPT, log_n=kdf_parameter & 0xFF, r=kdf_parameter >> 8 & 0xFF, p=kdf_parameter >> 16 & 0xFF)
+
+    if kdf == KDF_PBKDF2_SHA512_256:
+        return kdf_module.KdfParameters(kdf_module.ALGORITHM_PBKDF2_SHA512_256, iterations=kdf_parameter)
+
+    raise errors.DatabaseFormatException("The database uses an unsupported kdf")
+
+
+def read_header(f) -> dict:
+    """
+    Reads the header of a database file
+    :param f: The database file, opened in binary mode at its start
+    :return: The header fields
+    """
+    data = f.read(HEADER.size)
+    data += f.read(data[-1] if len(data) == HEADER.size else 0)
+
+    header, _ = unpack_header(data)
+
+    if len(header.get("raw")) != len(data):
+        raise errors.DatabaseFormatException("The database file is truncated")
+
+    return header
+
+
+def unpack_header(data: bytes) -> (dict, int):
+    """
+    Unpacks the header of a database file
+    :param data: The content of the database file
+    :return: The header fields and the offset of the body
+    """
+    if len(data) < HEADER.size:
+        raise errors.DatabaseFormatException("The database file is too short")
+
+    magic, version, flags, kdf, kdf_parameter, salt_length = HEADER.unpack_from(data)
+
+    if magic != MAGIC:
+        raise errors.DatabaseFormatException("The database file is not in the binary format")
+
+    if version not in SUPPORTED_VERSIONS:
+        raise errors.DatabaseFormatException(f"Unsupported version {version} of the binary format")
+
+    compressions = [name for name, flag in COMPRESSION_FLAGS.items() if flag == flags & FLAG_COMPRESSION_MASK]
+
+    if flags & ~FLAG_COMPRESSION_MASK or not compressions:
+        raise errors.DatabaseFormatException("The database file uses features this version doesn't support")
+
+    offset = HEADER.size + salt_length
+
+    header = {
+        "version": version,
+        "flags": flags,
+        "compression": compressions[0],
+        "kdf_parameters": unpack_kdf_parameters(kdf, kdf_parameter),
+        "salt": bytes(data[HEADER.size:offset]),
+        "raw": bytes(data[:offset])
+    }
+
+    return header, offset
+
+
+def get_chunk_associated_data(context: bytes, section: bytes, number: int, is_last: bool) -> bytes:
+    """
+    Gets the associated data of a chunk
+    :param context: The header (followed by the chunk counts in version 2)
+    :param section: SECTION_INDEX or SECTION_DATA
+    :param number: The number of the chunk in its section
+    :param is_last: If it is the last chunk of its section
+    :return: The associated data
+    """
+    return context + section + CHUNK_POSITION.pack(number, is_last)
+
+
+def iter_chunks(lines, on_line=None):
+    """
+    Groups lines into chunks of about CHUNK_SIZE bytes without splitting a line. Always yields at least one
+    chunk, so every section has a last chunk
+    :param lines: Iterable of lines, each ending with a newline
+    :param on_line: Optional function that gets called with the number of the chunk every line ends up in
+    :return: Generator of (number, chunk, is_last)
+    """
+    current_chunk = []
+    current_size = 0
+
+    full_chunk = None
+    number = 0
+
+    for line in lines:
+        # a full chunk is only handed out once the next line exists, so it is known whether it is the last one
+        if full_chunk is not None:
+            yield number, full_chunk, False
+            full_chunk = None
+            number += 1
+
+        current_chunk.append(line)
+        current_size += len(line)
+
+        if on_line is not None:
+            on_line(number)
+
+        if current_size >= CHUNK_SIZE:
+            full_chunk = b"".join(current_chunk)
+            current_chunk = []
+            current_size = 0
+
+    if full_chunk is not None:
+        yield number, full_chunk, True
+    else:
+        yield number, b"".join(current_chunk), True
+
+
+def parallel_imap(function, items, window: int = None):
+    """
+    Runs a function for every item on a thread pool and yields the results in order. At most window items are
+    in flight at once, so a stream of chunks never sits in memory as a whole. The cryptography primitives
+    release the GIL, so encrypting and decrypting chunks this way uses all cores
+    :param function: The function to run
+    :param items: Iterable of the items to run it for
+    :param window: How many items may be processed or waiting to be consumed at once, twice the cores by default
+    :return: Generator of the results
+    """
+    workers = os.cpu_count() or 1
+    window = window or workers * 2
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = collections.deque()
+
+        for item in items:
+            futures.append(executor.submit(function, item))
+
+            if len(futures) >= window:
+                yield futures.popleft().result()
+
+        while futures:
+            yield futures.popleft().result()
+
+
+def pack_uint32(value: int) -> bytes:
+    return UINT32.pack(value)
+
+
+def unpack_uint32(data: bytes, offset: int) -> (int, int):
+    """
+    Unpacks a u32
+    :param data: The data to read from
+    :param offset: Where the u32 starts
+    :return: The value and the offset after it
+    """
+    if offset + UINT32.size > len(data):
+        raise errors.DatabaseFormatException("The database file is truncated")
+
+    return UINT32.unpack_from(data, offset)[0], offset + UINT32.size
+
+
+def pack_blob(blob: bytes) -> bytes:
+    return UINT32.pack(len(blob)) + blob
+
+
+def read_blob(f, truncated_message: str = "The database file is truncated") -> bytes:
+    """
+    Reads a length prefixed blob
+    :param f: The database file, opened in binary mode at the start of the blob
+    :param truncated_message: The message of the exception if the file ends before the blob does
+    :return: The blob
+    """
+    length_data = f.read(UINT32.size)
+
+    if len(length_data) != UINT32.size:
+        raise errors.DatabaseFormatException(truncated_message)
+
+    blob = f.read(UINT32.unpack(length_data)[0])
+
+    if len(blob) != UINT32.unpack(length_data)[0]:
+        raise errors.DatabaseFormatException(truncated_message)
+
+    return blob
+
+
+def skip_blob(f) -> (int, int):
+    """
+    Skips over a length prefixed blob without reading it
+    :param f: The database file or a memory map of it, at the start of the blob
+    :return: Where the blob starts and ends
+    """
+    length_data = f.read(UINT32.size)
+
+    if len(length_data) != UINT32.size:
+        raise errors.DatabaseFormatException("The database file is truncated")
+
+    start = f.tell()
+    end = start + UINT32.unpack(length_data)[0]
+
+    f.seek(0, os.SEEK_END)
+
+    if end > f.tell():
+        raise errors.DatabaseFormatException("The database file is truncated")
+
+    f.seek(end)
+
+    return start, end
+
+
+def unpack_blob(data: bytes, offset: int) -> (bytes, int):
+    """
+    Unpacks a length prefixed blob
+    :param data: The data to read from
+    :param offset: Where the blob starts
+    :return: The blob and the offset after it
+    """
+    length, offset = unpack_uint32(data, offset)
+
+    if offset + length > len(data):
+        raise errors.DatabaseFormatException("The database file is truncated")
+
+    return bytes(data[offset:offset + length]), offset + length
@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+
+
+"""
+Background writer that persists a database after it was changed, so the UI doesn't have to wait for the
+encryption and the disk.
+
+Changes are debounced: the worker waits until no new change came in for DEFAULT_DELAY seconds (but never
+longer than DEFAULT_MAX_DELAY after the first unsaved change) and then persists everything at once.
+flush() is the barrier that has to be called before anything else touches the database file.
+
+The UI only opens databases in write behind mode if the environment variable PW_MANAGER_WRITE_BEHIND is set
+to 1, otherwise every change is written before the UI continues.
+"""
+
+
+DEFAULT_DELAY = 0.5
+DEFAULT_MAX_DELAY = 5.0
+
+ENV_WRITE_BEHIND = "PW_MANAGER_WRITE_BEHIND"
+
+
+def is_enabled_by_environment() -> bool:
+    return os.environ.get(ENV_WRITE_BEHIND) == "1"
+
+
+class WriteBehindWorker:
+    def __init__(self, persist_function, delay: float = DEFAULT_DELAY, max_delay: float = DEFAULT_MAX_DELAY):
+        """
+        :param persist_function: Function that persists everything that changed since it was last called
+        :param delay: Seconds without a new change before the changes get persisted
+        :param max_delay: Maximum seconds a change stays unsaved while new changes keep coming in
+        """
+        self.persist_function = persist_function
+        self.delay = delay
+        self.max_delay = max_delay
+
+        self.condition = threading.Condition()
+
+        self.pending: bool = False
+        self.writing: bool = False
+        self.flushing: bool = False
+        self.stopping: bool = False
+
+        self.first_change: float = 0
+        self.last_change: float = 0
+
+        # the last exception of persist_function, raised again by the next flush()
+        self.error: BaseException | None = None
+
+        self.thread = threading.Thread(target=self.__run__, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def schedule(self) -> None:
+        """
+        Tells the worker that something changed and has to be persisted
+        """
+        with self.condition:
+            now = time.monotonic()
+
+            if not self.pending:
+                self.first_change = now
+
+            self.last_change = now
+            self.pending = True
+
+            self.condition.notify_all()
+
+    def flush(self) -> None:
+        """
+        Blocks until every scheduled change is persisted. Raises the exception of a failed write, if there was one
+        """
+        with self.condition:
+            self.flushing = True
+            self.condition.notify_all()
+
+            try:
+                while self.pending or self.writing:
+                    self.condition.wait()
+            finally:
+                self.flushing = False
+
+            error, self.error = self.error, None
+
+        if error is not None:
+            raise error
+
+    def stop(self) -> None:
+        """
+        Persists every scheduled change and stops the worker
+        """
+        try:
+            self.flush()
+        finally:
+            with self.condition:
+                self.stopping = True
+                self.condition.notify_all()
+
+            self.thread.join()
+
+    def __run__(self) -> None:
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopping:
+                    self.condition.wait()
+
+                if not self.pending:
+                    return
+
+                while not self.flushing and not self.stopping:
+                    deadline = min(self.last_change + self.delay, self.first_change + self.max_delay)
+                    remaining = deadline - time.monotonic()
+
+                    if remaining <= 0:
+                        break
+
+                    self.condition.wait(remaining)
+
+                self.pending = False
+                self.writing = True
+
+            try:
+                self.persist_function()
+            except BaseException as e:
+                self.error = e
+            finally:
+                with self.condition:
+                    self.writing = False
+                    self.condition.notify_all()
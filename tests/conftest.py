@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+from pw_manager import kdf
+from pw_manager.db import Database, FORMAT_BINARY
+from pw_manager.utils import utils, constants, key_cache
+
+
+"""
+Shared fixtures of the tests.
+
+Every test gets its own data folder, so the cache of database paths and the sync settings of the user are never
+touched, and starts without cached keys. Databases use the cheapest kdf that is allowed, unlocking one still
+derives its key once.
+"""
+
+
+PASSWORD = "correct horse battery staple"
+
+ENTRIES = [
+    ("github.com", "work account", "octocat", "hunter2"),
+    ("mail.example.org", "", "me@example.org", "s3cr3t"),
+    ("Bank", "savings, the one with the card", "1234567", "pa55word"),
+]
+
+
+@pytest.fixture(autouse=True)
+def data_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "get_root_folder", lambda: str(tmp_path))
+
+    yield tmp_path / "data"
+
+    # search indexes that are still being built would derive their key again once it is wiped
+    for thread in threading.enumerate():
+        if thread.name == "search-index":
+            thread.join()
+
+    key_cache.wipe()
+    constants.db_file = None
+
+
+@pytest.fixture
+def create_db(tmp_path):
+    def create(name: str = "vault.db", storage_format: str = FORMAT_BINARY, entries: list = ENTRIES, **kwargs) -> Database:
+        db = Database(str(tmp_path / name), PASSWORD, storage_format=storage_format, kdf_parameters=kdf.KdfParameters(), **kwargs)
+        db.create()
+
+        with db.transaction():
+            for website_or_usage, description, username, password in entries:
+                db.add_database_entry(website_or_usage=website_or_usage, description=description, username=username, password=password,
+                                      should_write=False)
+
+        return db
+
+    return create
+
+
+def open_db(path: str, password: str = PASSWORD, **kwargs) -> Database:
+    """
+    Reads a database like selecting it does
+    :param path: The path of the database
+    :param password: The password
+    :return: The read database
+    """
+    db = Database(path, password, **kwargs)
+    db.read()
+
+    return db
+
+
+def get_fields(db: Database) -> list[tuple]:
+    """
+    Gets the fields of all entries of a database, sorted so databases can be compared
+    :param db: The database
+    :return: A sorted list of (id, website or usage, description, username, password)
+    """
+    return sorted((entry.entry_id, entry.website_or_usage, entry.description, entry.username, entry.password) for entry in db.get_all_entries())
@@ -0,0 +1,126 @@
+import hashlib
+import os
+
+from paramiko.sftp import CMD_EXTENDED
+
+
+"""
+Stand-in for a paramiko.SFTPClient that works on local paths, for testing transfers without a server.
+
+It only has the methods the transfers use, counts the bytes that go over the "connection" and can pretend to
+support the copy-data and check-file extensions of OpenSSH.
+"""
+
+
+class FakeSFTPFile:
+    def __init__(self, sftp, path: str, mode: str):
+        self.sftp = sftp
+        self.path = path
+        self.handle = path.encode()
+
+        self.file = open(path, mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def set_pipelined(self, pipelined: bool = True) -> None:
+        pass
+
+    def prefetch(self, file_size: int = None) -> None:
+        pass
+
+    def seek(self, offset: int) -> None:
+        self.file.seek(offset)
+
+    def write(self, data: bytes) -> None:
+        self.sftp.sent += len(data)
+        self.file.write(data)
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        self.sftp.received += len(data)
+
+        return data
+
+    def readv(self, chunks):
+        for offset, length in chunks:
+            self.file.seek(offset)
+
+            yield self.read(length)
+
+    def truncate(self, size: int) -> None:
+        self.file.truncate(size)
+
+    def check(self, hash_algorithm: str, offset: int = 0, length: int = 0, block_size: int = 0) -> bytes:
+        if not self.sftp.check_file:
+            raise IOError("Operation unsupported")
+
+        self.sftp.checked += length
+
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+
+        return b"".join(hashlib.new(hash_algorithm, data[start:start + block_size]).digest() for start in range(0, len(data), block_size))
+
+
+class FakeSFTP:
+    def __init__(self, copy_data: bool = False, check_file: bool = False):
+        self.copy_data = copy_data
+        self.check_file = check_file
+
+        self.sent: int = 0
+        self.received: int = 0
+        self.copied: int = 0
+        self.checked: int = 0
+
+        self.open_files: dict[bytes, FakeSFTPFile] = dict()
+
+    def open(self, path: str, mode: str = "r") -> FakeSFTPFile:
+        if "r" in mode and not os.path.exists(path):
+            raise FileNotFoundError(path)
+
+        sftp_file = FakeSFTPFile(self, path, mode)
+        self.open_files[sftp_file.handle] = sftp_file
+
+        return sftp_file
+
+    def stat(self, path: str) -> os.stat_result:
+        return os.stat(path)
+
+    def listdir(self, path: str = ".") -> list[str]:
+        return os.listdir(path)
+
+    def remove(self, path: str) -> None:
+        os.remove(path)
+
+    def posix_rename(self, old_path: str, new_path: str) -> None:
+        os.replace(old_path, new_path)
+
+    def mkdir(self, path: str, mode: int = 0o777) -> None:
+        os.mkdir(path, mode)
+
+    def _request(self, request_type: int, *args):
+        if request_type != CMD_EXTENDED or args[0] != "copy-data" or not self.copy_data:
+            raise IOError("Operation unsupported")
+
+        _, source_handle, source_offset, length, destination_handle, destination_offset = args
+
+        with open(self.open_files[source_handle].path, "rb") as f:
+            f.seek(int(source_offset))
+            data = f.read(int(length))
+
+        destination = self.open_files[destination_handle].file
+        destination.flush()
+
+        with open(self.open_files[destination_handle].path, "r+b") as f:
+            f.seek(int(destination_offset))
+            f.write(data)
+
+        self.copied += len(data)
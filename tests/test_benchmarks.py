@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+
+import pytest
+
+from benchmarks import engine
+
+
+ENTRIES = 20
+
+
+@pytest.fixture
+def args():
+    return argparse.Namespace(kdf_iterations=engine.DEFAULT_KDF_ITERATIONS, seed=engine.DEFAULT_SEED)
+
+
+@pytest.fixture
+def vault(tmp_path, args):
+    path = str(tmp_path / "vault.db")
+    engine.generate_vault(path, ENTRIES, args)
+
+    return path
+
+
+def get_fields(path: str) -> list[tuple]:
+    db = engine.open_vault(path)
+
+    return sorted((entry.website_or_usage, entry.description, entry.username, entry.password) for entry in db.get_all_entries())
+
+
+def test_generated_vaults_are_deterministic(tmp_path, vault, args):
+    other_vault = str(tmp_path / "other.db")
+    engine.generate_vault(other_vault, ENTRIES, args)
+
+    fields = get_fields(vault)
+
+    assert len(fields) == ENTRIES
+    assert fields == get_fields(other_vault)
+
+
+@pytest.mark.parametrize("operation", engine.OPERATIONS)
+def test_every_operation_runs(vault, args, operation):
+    timings = engine.run_operation(operation, vault, ENTRIES, 3, args)
+
+    assert len(timings) == 3
+    assert all(timing >= 0 for timing in timings)
+
+    result = engine.summarize(operation, ENTRIES, timings, os.path.getsize(vault), engine.get_peak_rss())
+
+    assert result["operation"] == operation
+    assert result["samples"] == 3
+    assert result["min_ms"] <= result["p50_ms"] <= result["p90_ms"] <= result["p99_ms"] <= result["max_ms"]
+
+    expected_entries = {"add_database_entry": ENTRIES + 3, "delete_entry": ENTRIES - 3}.get(operation, ENTRIES)
+
+    assert len(engine.open_vault(vault).get_all_entries()) == expected_entries
+
+
+def test_write_keeps_the_vault_readable(vault, args):
+    fields = get_fields(vault)
+
+    engine.run_operation("write", vault, ENTRIES, 2, args)
+
+    assert get_fields(vault) == fields
+
+
+def test_percentile():
+    samples = [float(i) for i in range(1, 101)]
+
+    assert engine.percentile(samples, 50) == 50
+    assert engine.percentile(samples, 99) == 99
+    assert engine.percentile(samples, 100) == 100
+    assert engine.percentile([1.0], 90) == 1
+
+
+def test_summarize_without_time():
+    result = engine.summarize("read", ENTRIES, [0.0], 100, None)
+
+    assert result["ops_per_second"] is None
+    assert result["entries_per_second"] is None
+    assert result["peak_rss_bytes"] is None
+
+
+def test_main_reports_every_operation(tmp_path, monkeypatch):
+    output = tmp_path / "results.json"
+
+    # the workers are started as "python -m benchmarks.engine", which needs the repository as working directory
+    monkeypatch.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    monkeypatch.setattr("sys.argv", ["engine", "--sizes", "5", "--operations", "read,search", "--samples", "2", "--full-samples", "1",
+                                     "--output", str(output)])
+
+    # main replaces the data folder with its own work folder, which it removes afterwards
+    monkeypatch.setattr(engine.utils, "get_data_folder", engine.utils.get_data_folder)
+    engine.main()
+
+    with open(output) as f:
+        report = json.load(f)
+
+    assert report["environment"]["kdf"] == engine.get_kdf_parameters(argparse.Namespace(kdf_iterations=engine.DEFAULT_KDF_ITERATIONS)).to_dict()
+    assert [(result["entries"], result["operation"], result["samples"]) for result in report["results"]] == [(5, "read", 1), (5, "search", 2)]
@@ -0,0 +1,157 @@
+import pytest
+from cryptography.fernet import InvalidToken
+
+from pw_manager import compression, vault_format
+from pw_manager.db import FORMAT_BINARY, FORMAT_PER_ENTRY
+from pw_manager.utils import errors, key_cache
+
+from tests.conftest import ENTRIES, open_db, get_fields
+
+
+def flip_byte(path: str, offset: int) -> None:
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        byte = f.read(1)
+
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 0x01]))
+
+
+def get_first_chunk_offset(path: str) -> int:
+    """
+    Gets where the encrypted content of the first chunk starts, which is a data chunk since version 3
+    :param path: The database file
+    :return: The offset of the first byte after the nonce of the chunk
+    """
+    with open(path, "rb") as f:
+        _, offset = vault_format.unpack_header(f.read())
+
+    return offset + vault_format.CHUNK_COUNTS.size + 4 + vault_format.NONCE_LENGTH
+
+
+@pytest.mark.parametrize("algorithm", compression.ALGORITHMS)
+def test_round_trip(create_db, algorithm):
+    db = create_db(compression=algorithm)
+    db.write()
+
+    with open(db.path, "rb") as f:
+        assert vault_format.is_binary_vault(f.read(len(vault_format.MAGIC)))
+
+    read_db = open_db(db.path)
+
+    assert read_db.storage_format == FORMAT_BINARY
+    assert read_db.compression == algorithm
+    assert get_fields(read_db) == get_fields(db)
+    assert [entry.modified for entry in sorted(read_db.content)] == [entry.modified for entry in sorted(db.content)]
+
+
+def test_entries_stay_sealed_until_accessed(create_db):
+    db = create_db()
+    db.write()
+
+    read_db = open_db(db.path)
+
+    assert all(entry.is_sealed() for entry in read_db.content)
+    assert sorted(entry.website_or_usage for entry in read_db.content) == sorted(entry[0] for entry in ENTRIES)
+
+    entry = read_db.search_entries("github")[0]
+
+    assert entry.password == "hunter2"
+    assert not entry.is_sealed()
+
+
+def test_many_entries_span_several_chunks(create_db):
+    entries = [(f"site {i}", "x" * 200, f"user {i}", f"password {i}") for i in range(1000)]
+
+    db = create_db(entries=entries, compression=compression.ZLIB)
+    db.write()
+
+    read_db = open_db(db.path)
+
+    assert get_fields(read_db) == get_fields(db)
+
+
+def test_read_only_round_trip(create_db):
+    db = create_db()
+    db.write()
+
+    read_db = open_db(db.path, read_only=True)
+
+    assert read_db.mapping is not None
+    assert get_fields(read_db) == get_fields(db)
+
+    with pytest.raises(errors.DatabaseReadOnlyException):
+        read_db.add_database_entry("website", "description", "username", "password")
+
+    read_db.lock()
+
+
+@pytest.mark.parametrize("storage_format", [FORMAT_BINARY, FORMAT_PER_ENTRY])
+def test_convert(create_db, storage_format):
+    db = create_db(storage_format=FORMAT_PER_ENTRY if storage_format == FORMAT_BINARY else FORMAT_BINARY)
+
+    db.convert(storage_format, compression.LZMA)
+
+    read_db = open_db(db.path)
+
+    assert read_db.storage_format == storage_format
+    assert get_fields(read_db) == get_fields(db)
+
+
+def test_wrong_password(create_db):
+    db = create_db()
+    db.write()
+
+    with pytest.raises(InvalidToken):
+        open_db(db.path, password="wrong")
+
+
+def test_truncated_file(create_db):
+    db = create_db()
+    db.write()
+
+    with open(db.path, "r+b") as f:
+        f.truncate(get_first_chunk_offset(db.path) + 8)
+
+    with pytest.raises(errors.DatabaseFormatException):
+        open_db(db.path)
+
+
+def test_damaged_data_chunk(create_db):
+    db = create_db()
+    db.write()
+
+    flip_byte(db.path, get_first_chunk_offset(db.path) + 4)
+
+    # only the index gets decrypted when reading, the damage shows once an entry is decrypted
+    read_db = open_db(db.path)
+
+    with pytest.raises(InvalidToken):
+        _ = read_db.content[0].password
+
+    with pytest.raises(InvalidToken):
+        read_db.search_entries("github")
+
+
+def test_damaged_index_chunk(create_db):
+    db = create_db()
+    db.write()
+
+    flip_byte(db.path, db.file_identity[2] - 4)
+
+    with pytest.raises(InvalidToken):
+        open_db(db.path)
+
+
+def test_damaged_header(create_db):
+    db = create_db()
+    db.write()
+
+    # the header is authenticated as the associated data of every chunk
+    flip_byte(db.path, len(vault_format.MAGIC) + 2 + 2 + 1)
+
+    key_cache.wipe()
+
+    with pytest.raises((InvalidToken, errors.DatabaseFormatException)):
+        read_db = open_db(db.path)
+        _ = [entry.password for entry in read_db.content]
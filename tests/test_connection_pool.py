@@ -0,0 +1,206 @@
+import socket
+import time
+
+import paramiko
+import pytest
+
+from pw_manager.db_sync import connection_pool
+
+
+class FakeChannel:
+    def __init__(self):
+        self.timeout: float | None = None
+
+    def gettimeout(self) -> float | None:
+        return self.timeout
+
+    def settimeout(self, timeout: float | None) -> None:
+        self.timeout = timeout
+
+
+class FakeSFTPClient:
+    def __init__(self):
+        self.channel = FakeChannel()
+        self.closed = False
+
+    def get_channel(self) -> FakeChannel:
+        return self.channel
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FakeTransport:
+    def __init__(self):
+        self.active = True
+        self.keepalive: int | None = None
+
+    def is_active(self) -> bool:
+        return self.active
+
+    def set_keepalive(self, interval: int) -> None:
+        self.keepalive = interval
+
+
+class FakeSSHClient:
+    """
+    Stand-in for a paramiko.SSHClient that connects to nothing, every instance is kept in clients
+    """
+    clients: list = []
+
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.sftp = FakeSFTPClient()
+        self.connect_arguments: dict | None = None
+        self.closed = False
+
+        FakeSSHClient.clients.append(self)
+
+    def set_missing_host_key_policy(self, policy) -> None:
+        pass
+
+    def connect(self, **kwargs) -> None:
+        self.connect_arguments = kwargs
+
+    def get_transport(self) -> FakeTransport:
+        return self.transport
+
+    def open_sftp(self) -> FakeSFTPClient:
+        return self.sftp
+
+    def close(self) -> None:
+        self.closed = True
+        self.transport.active = False
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    FakeSSHClient.clients = []
+    monkeypatch.setattr(connection_pool.paramiko, "SSHClient", FakeSSHClient)
+
+    return FakeSSHClient.clients
+
+
+@pytest.fixture
+def pool():
+    pool = connection_pool.ConnectionPool(keepalive_interval=5)
+
+    yield pool
+
+    pool.close_all()
+
+
+def test_session_reuses_the_connection(clients, pool):
+    with pool.session("example.org", "user", "password") as sftp:
+        first_sftp = sftp
+
+    with pool.session("example.org", "user", "password") as sftp:
+        assert sftp is first_sftp
+
+    assert len(clients) == 1
+    assert clients[0].connect_arguments["hostname"] == "example.org"
+    assert clients[0].transport.keepalive == 5
+
+    # another user or password gets its own connection
+    with pool.session("example.org", "user", "other password"):
+        pass
+
+    with pool.session("example.org", "other user", "password"):
+        pass
+
+    assert len(clients) == 3
+
+
+def test_dead_connection_is_replaced(clients, pool):
+    with pool.session("example.org", "user", "password"):
+        pass
+
+    clients[0].transport.active = False
+
+    with pool.session("example.org", "user", "password") as sftp:
+        assert sftp is clients[1].sftp
+
+    assert clients[0].closed
+    assert len(clients) == 2
+
+
+@pytest.mark.parametrize("error", [paramiko.SSHException("broken"), EOFError(), socket.timeout()])
+def test_broken_connection_is_discarded(clients, pool, error):
+    with pytest.raises(type(error)):
+        with pool.session("example.org", "user", "password"):
+            raise error
+
+    assert clients[0].closed
+    assert pool.connections == {}
+
+    with pool.session("example.org", "user", "password"):
+        pass
+
+    assert len(clients) == 2
+
+
+def test_other_errors_keep_the_connection(clients, pool):
+    with pytest.raises(FileNotFoundError):
+        with pool.session("example.org", "user", "password"):
+            raise FileNotFoundError("vault.db")
+
+    assert not clients[0].closed
+
+    with pool.session("example.org", "user", "password"):
+        pass
+
+    assert len(clients) == 1
+
+
+def test_timeout_only_applies_to_the_session(clients, pool):
+    with pool.session("example.org", "user", "password", timeout=10) as sftp:
+        assert sftp.get_channel().gettimeout() == 10
+
+    assert clients[0].sftp.channel.gettimeout() is None
+
+    with pytest.raises(FileNotFoundError):
+        with pool.session("example.org", "user", "password", timeout=20):
+            raise FileNotFoundError("vault.db")
+
+    assert clients[0].sftp.channel.gettimeout() is None
+
+
+def test_close(clients, pool):
+    with pool.session("example.org", "user", "password"):
+        pass
+
+    with pool.session("example.com", "user", "password"):
+        pass
+
+    pool.close("example.org")
+
+    assert clients[0].closed and clients[0].sftp.closed
+    assert not clients[1].closed
+
+    pool.close_all()
+
+    assert clients[1].closed
+    assert pool.connections == {}
+
+
+def test_idle_connections_get_closed(clients):
+    pool = connection_pool.ConnectionPool(idle_timeout=0.1)
+
+    with pool.session("example.org", "user", "password"):
+        pass
+
+    reaper = pool.reaper
+
+    # the reaper checks at least once a second
+    deadline = time.monotonic() + 5
+
+    while not clients[0].closed and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert clients[0].closed
+    assert pool.connections == {}
+
+    reaper.join(timeout=5)
+
+    assert not reaper.is_alive()
+    assert pool.reaper is None
@@ -0,0 +1,150 @@
+import os
+
+import pytest
+
+from pw_manager.db_sync import delta
+
+from tests.fake_sftp import FakeSFTP
+
+
+SIZE = 3 * 1024 * 1024
+
+
+@pytest.fixture
+def files(tmp_path):
+    remote_folder = tmp_path / "remote"
+    remote_folder.mkdir()
+
+    return str(tmp_path / "vault.db"), str(remote_folder / "vault.db")
+
+
+def write_file(path: str, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def change(data: bytes, offset: int, length: int) -> bytes:
+    return data[:offset] + os.urandom(length) + data[offset + length:]
+
+
+def test_signature_round_trip():
+    data = os.urandom(10000)
+    signature = delta.compute_signature(data, file_mtime=1234)
+
+    read_signature = delta.Signature.from_bytes(signature.to_bytes())
+
+    assert read_signature.file_size == len(data)
+    assert read_signature.file_mtime == 1234
+    assert read_signature.file_hash == signature.file_hash
+    assert read_signature.strong_checksums == signature.strong_checksums
+
+    assert delta.Signature.from_bytes(b"not a signature") is None
+
+
+def test_find_blocks_that_moved():
+    data = os.urandom(10 * delta.BLOCK_SIZE)
+    signature = delta.compute_signature(data)
+
+    # 100 bytes were inserted before the third block, every block after it moved
+    found = delta.find_blocks(data[:2 * delta.BLOCK_SIZE] + os.urandom(100) + data[2 * delta.BLOCK_SIZE:], signature)
+
+    assert found == {index: index * delta.BLOCK_SIZE + (100 if index >= 2 else 0) for index in range(10)}
+
+
+@pytest.mark.parametrize("offset", [0, SIZE // 2, SIZE - 10])
+def test_upload_copies_the_unchanged_blocks(files, offset):
+    local_path, remote_path = files
+    data = os.urandom(SIZE)
+
+    write_file(local_path, data)
+    delta.upload(FakeSFTP(copy_data=True), local_path, remote_path)
+
+    data = change(data, offset, 10)
+    write_file(local_path, data)
+
+    sftp = FakeSFTP(copy_data=True)
+    sent = delta.upload(sftp, local_path, remote_path)
+
+    # only the changed block gets sent, the server copies the rest
+    assert sent <= 2 * delta.BLOCK_SIZE
+    assert sftp.copied >= SIZE - 2 * delta.BLOCK_SIZE
+    assert read_file(remote_path) == data
+    assert delta.read_remote_signature(sftp, remote_path) is not None
+
+
+def test_upload_of_an_appended_file(files):
+    local_path, remote_path = files
+    data = os.urandom(SIZE)
+
+    write_file(local_path, data)
+    delta.upload(FakeSFTP(copy_data=True), local_path, remote_path)
+
+    data += os.urandom(1000)
+    write_file(local_path, data)
+
+    sent = delta.upload(FakeSFTP(copy_data=True), local_path, remote_path)
+
+    assert sent < delta.BLOCK_SIZE + 1000
+    assert read_file(remote_path) == data
+
+
+def test_upload_without_copy_data_sends_the_whole_file(files):
+    local_path, remote_path = files
+    data = os.urandom(SIZE)
+
+    write_file(local_path, data)
+    delta.upload(FakeSFTP(), local_path, remote_path)
+
+    data = change(data, 100, 10)
+    write_file(local_path, data)
+
+    sftp = FakeSFTP()
+
+    assert delta.upload(sftp, local_path, remote_path) == SIZE
+    assert sftp.copied == 0
+    assert read_file(remote_path) == data
+
+
+def test_upload_after_someone_else_replaced_the_remote_file(files):
+    local_path, remote_path = files
+    data = os.urandom(SIZE)
+
+    write_file(local_path, data)
+    delta.upload(FakeSFTP(copy_data=True), local_path, remote_path)
+
+    # an older version uploaded without updating the signature file
+    write_file(remote_path, os.urandom(SIZE + 1))
+
+    data = change(data, 100, 10)
+    write_file(local_path, data)
+
+    assert delta.upload(FakeSFTP(copy_data=True), local_path, remote_path) == SIZE
+    assert read_file(remote_path) == data
+
+
+def test_download_only_reads_the_changed_blocks(files, tmp_path):
+    local_path, remote_path = files
+    data = os.urandom(SIZE)
+
+    write_file(local_path, data)
+    delta.upload(FakeSFTP(), local_path, remote_path)
+
+    # another installation changes the remote file
+    other_path = str(tmp_path / "other.db")
+    write_file(other_path, change(data, SIZE // 2, 10))
+    delta.upload(FakeSFTP(), other_path, remote_path)
+
+    sftp = FakeSFTP()
+    received = delta.download(sftp, remote_path, local_path)
+
+    assert received <= 2 * delta.BLOCK_SIZE
+
+    # besides the changed blocks only the signature file was read
+    assert sftp.received == received + os.path.getsize(remote_path + delta.SIGNATURE_SUFFIX)
+    assert read_file(local_path) == read_file(other_path)
+    assert read_file(local_path + ".old") == data
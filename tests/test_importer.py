@@ -0,0 +1,122 @@
+import json
+
+import pytest
+
+from pw_manager import importer
+from pw_manager.db import Database
+
+from tests.conftest import open_db, get_fields
+
+
+def write_file(path, content: str) -> str:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+    return str(path)
+
+
+CSV_EXPORT = """name,url,username,password,notes
+GitHub,https://github.com,octocat,hunter2,
+Mail,,me@example.org,s3cr3t,the old one
+Mail,,me@example.org,s3cr3t,the old one
+No password,,someone,,
+,https://nameless.example.org,someone,password,
+"""
+
+
+def get_websites(db: Database) -> list[str]:
+    return sorted(entry.website_or_usage for entry in db.get_all_entries())
+
+
+def test_csv(create_db, tmp_path):
+    db = create_db(entries=[])
+
+    report = importer.import_file(db, write_file(tmp_path / "export.csv", CSV_EXPORT))
+
+    assert (report.read, report.imported, report.duplicates) == (5, 3, 1)
+    assert report.rejected == [(4, "no password")]
+
+    # the name wins over the url, and the url is used if there is no name
+    assert get_websites(db) == ["GitHub", "Mail", "https://nameless.example.org"]
+    assert db.search_entries("github")[0].username == "octocat"
+    assert db.search_entries("mail")[0].description == "the old one"
+
+    assert get_fields(open_db(db.path)) == get_fields(db)
+
+
+def test_importing_again_only_finds_duplicates(create_db, tmp_path):
+    db = create_db(entries=[])
+    path = write_file(tmp_path / "export.csv", CSV_EXPORT)
+
+    importer.import_file(db, path)
+
+    report = importer.import_file(open_db(db.path), path)
+
+    assert (report.imported, report.duplicates) == (0, 4)
+    assert len(open_db(db.path).content) == 3
+
+
+def test_existing_entries_are_duplicates(create_db):
+    db = create_db()
+
+    report = importer.import_records(db, [
+        {"website_or_usage": "github.com", "description": "work account", "username": "octocat", "password": "hunter2"},
+        {"website_or_usage": "github.com", "description": "work account", "username": "octocat", "password": "a different one"},
+    ])
+
+    assert (report.imported, report.duplicates) == (1, 1)
+    assert len(db.search_entries("github")) == 2
+
+
+def test_json_document(create_db, tmp_path):
+    db = create_db(entries=[])
+
+    # the json export of Bitwarden nests the login
+    document = {"items": [
+        {"name": "GitHub", "notes": None, "login": {"username": "octocat", "password": "hunter2", "uris": [{"uri": "https://github.com"}]}},
+        {"name": "Card", "notes": "no login"},
+        "not an object",
+    ]}
+
+    report = importer.import_file(db, write_file(tmp_path / "export.json", json.dumps(document)))
+
+    assert report.imported == 1
+    assert report.rejected == [(2, "no password"), (3, "not an object")]
+    assert db.search_entries("github")[0].password == "hunter2"
+
+
+def test_json_lines(create_db, tmp_path):
+    db = create_db(entries=[])
+
+    lines = "\n".join(json.dumps({"title": f"site {i}", "email": f"user{i}@example.org", "pass": f"password {i}"}) for i in range(100))
+
+    report = importer.import_file(db, write_file(tmp_path / "export.jsonl", lines + "\n\n"))
+
+    assert (report.read, report.imported) == (100, 100)
+    assert db.search_entries("user42@")[0].password == "password 42"
+
+
+def test_import_is_a_single_write(create_db, monkeypatch):
+    db = create_db(entries=[])
+    db.write()
+
+    writes = []
+    write_content = Database.__write_content__
+
+    def counting_write_content(written_db):
+        writes.append(written_db.path)
+        write_content(written_db)
+
+    monkeypatch.setattr(Database, "__write_content__", counting_write_content)
+
+    importer.import_records(db, ({"website_or_usage": f"site {i}", "password": "password"} for i in range(500)))
+
+    assert len(writes) == 1
+    assert len(open_db(db.path).content) == 500
+
+
+def test_unknown_format(create_db, tmp_path):
+    db = create_db(entries=[])
+
+    with pytest.raises(ValueError):
+        importer.import_file(db, write_file(tmp_path / "export.txt", "something"))
@@ -0,0 +1,145 @@
+import pytest
+
+from pw_manager import db as db_module
+from pw_manager.db import FORMAT_BINARY, FORMAT_PER_ENTRY
+from pw_manager.db_entry import DatabaseEntry
+
+from tests.conftest import open_db, get_fields
+
+
+pytestmark = pytest.mark.parametrize("storage_format", [FORMAT_BINARY, FORMAT_PER_ENTRY])
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def append_to_file(path: str, data: bytes) -> None:
+    with open(path, "ab") as f:
+        f.write(data)
+
+
+def test_changes_are_appended(create_db, storage_format):
+    db = create_db(storage_format=storage_format)
+    db.write()
+
+    body = read_file(db.path)
+
+    db.add_database_entry(website_or_usage="new", description="", username="someone", password="password")
+
+    content = read_file(db.path)
+
+    assert content.startswith(body)
+    assert content.endswith(b"\n")
+    assert db.journal_records == 1
+
+
+def test_replay(create_db, storage_format):
+    db = create_db(storage_format=storage_format)
+    db.write()
+
+    github = db.search_entries("github")[0]
+    bank = db.search_entries("bank")[0]
+
+    db.add_database_entry(website_or_usage="new", description="", username="someone", password="password")
+    db.update_entry(github, DatabaseEntry(website_or_usage="github.com", description="work account", username="octocat", password="hunter3"))
+    db.delete_entry(bank)
+
+    read_db = open_db(db.path)
+
+    assert read_db.journal_records == 3
+    assert read_db.skipped_journal_records == 0
+    assert get_fields(read_db) == get_fields(db)
+    assert read_db.get_entry_by_id(github.entry_id).password == "hunter3"
+
+
+def test_incomplete_record_is_ignored(create_db, storage_format):
+    db = create_db(storage_format=storage_format)
+    db.write()
+
+    body = read_file(db.path)
+
+    db.add_database_entry(website_or_usage="new", description="", username="someone", password="password")
+
+    # an append that was interrupted before its newline got written
+    append_to_file(db.path, read_file(db.path)[len(body):len(body) + 20])
+
+    read_db = open_db(db.path)
+
+    assert get_fields(read_db) == get_fields(db)
+
+
+def test_damaged_record_is_skipped(create_db, storage_format):
+    db = create_db(storage_format=storage_format)
+    db.write()
+
+    db.add_database_entry(website_or_usage="new", description="", username="someone", password="password")
+
+    append_to_file(db.path, b"not a record\n")
+
+    read_db = open_db(db.path)
+
+    assert read_db.skipped_journal_records == 1
+    assert read_db.needs_full_write
+    assert get_fields(read_db) == get_fields(db)
+
+    # the next change compacts the journal instead of appending after the damaged record
+    read_db.add_database_entry(website_or_usage="newer", description="", username="someone", password="password")
+
+    assert read_db.journal_records == 0
+    assert get_fields(open_db(db.path)) == get_fields(read_db)
+
+
+def test_compaction(create_db, storage_format):
+    db = create_db(storage_format=storage_format)
+    db.write()
+
+    github = db.search_entries("github")[0]
+
+    for i in range(db_module.JOURNAL_MIN_RECORDS + 10):
+        github = db.get_entry_by_id(github.entry_id)
+        db.update_entry(github, DatabaseEntry(website_or_usage="github.com", description="", username="octocat", password=f"password {i}"))
+
+    assert db.journal_records < db_module.JOURNAL_MIN_RECORDS
+
+    read_db = open_db(db.path)
+
+    assert read_db.get_entry_by_id(github.entry_id).password == f"password {db_module.JOURNAL_MIN_RECORDS + 9}"
+    assert get_fields(read_db) == get_fields(db)
+
+
+def test_compaction_keeps_the_changes_of_other_writers(create_db, storage_format):
+    db = create_db(storage_format=storage_format)
+    db.write()
+
+    other_db = open_db(db.path)
+    other_db.add_database_entry(website_or_usage="other writer", description="", username="someone", password="password")
+
+    db.add_database_entry(website_or_usage="first writer", description="", username="someone", password="password")
+    db.write()
+
+    read_db = open_db(db.path)
+
+    assert sorted(entry.website_or_usage for entry in read_db.content) == sorted(["github.com", "mail.example.org", "Bank", "other writer", "first writer"])
+
+    # the other writer appends to the compacted file again
+    other_db.add_database_entry(website_or_usage="other writer again", description="", username="someone", password="password")
+
+    assert len(open_db(db.path).content) == 6
+
+
+def test_unpersisted_change_wins_over_other_writers(create_db, storage_format):
+    db = create_db(storage_format=storage_format)
+    db.write()
+
+    github = db.search_entries("github")[0]
+
+    other_db = open_db(db.path)
+    other_db.update_entry(other_db.get_entry_by_id(github.entry_id),
+                          DatabaseEntry(website_or_usage="github.com", description="", username="octocat", password="from the other writer"))
+
+    with db.transaction():
+        db.update_entry(github, DatabaseEntry(website_or_usage="github.com", description="", username="octocat", password="from the first writer"))
+
+    assert open_db(db.path).get_entry_by_id(github.entry_id).password == "from the first writer"
@@ -0,0 +1,115 @@
+import pytest
+from cryptography.fernet import InvalidToken
+
+from pw_manager import kdf
+from pw_manager.db import FORMAT_BINARY, FORMAT_PER_ENTRY
+from pw_manager.db_entry import DatabaseEntry
+from pw_manager.utils import utils, key_cache
+
+from tests.conftest import PASSWORD, open_db, get_fields
+
+
+@pytest.fixture
+def derivations(monkeypatch):
+    salts = []
+    derive = kdf.KdfParameters.derive
+
+    def counting_derive(parameters, password: bytes, salt: bytes) -> bytes:
+        salts.append(salt)
+        return derive(parameters, password, salt)
+
+    monkeypatch.setattr(kdf.KdfParameters, "derive", counting_derive)
+
+    return salts
+
+
+@pytest.mark.parametrize("storage_format", [FORMAT_BINARY, FORMAT_PER_ENTRY])
+def test_key_is_derived_once_per_session(create_db, derivations, storage_format):
+    db = create_db(storage_format=storage_format)
+    db.write()
+
+    github = db.search_entries("github")[0]
+
+    db.update_entry(github, DatabaseEntry(website_or_usage="github.com", description="", username="octocat", password="changed"))
+    db.write()
+
+    read_db = open_db(db.path)
+    _ = [entry.password for entry in read_db.content]
+
+    assert len(derivations) == 1
+
+
+def test_wrong_password_never_gets_the_cached_key(create_db, derivations):
+    db = create_db()
+    db.write()
+
+    with pytest.raises(InvalidToken):
+        open_db(db.path, password="wrong")
+
+    # the wrong password got its own derivation, and a failed read wipes every key of the file
+    assert len(derivations) == 2
+    assert key_cache.get(db.get_absolute_path(), db.salt, db.kdf_parameters.as_tuple(), "wrong") is None
+    assert key_cache.get(db.get_absolute_path(), db.salt, db.kdf_parameters.as_tuple(), PASSWORD) is None
+
+    open_db(db.path)
+    open_db(db.path)
+
+    assert len(derivations) == 3
+
+
+def test_lock_wipes_the_key(create_db, derivations):
+    db = create_db()
+    db.write()
+    db.lock()
+
+    assert key_cache.get(db.get_absolute_path(), db.salt, db.kdf_parameters.as_tuple(), PASSWORD) is None
+
+    open_db(db.path)
+
+    assert len(derivations) == 2
+
+
+def test_selecting_the_same_file_again_keeps_the_key(create_db, derivations):
+    db = create_db()
+    db.write()
+
+    read_db = open_db(db.path)
+    utils.make_current_db(read_db, db)
+
+    assert db.content == []
+    assert get_fields(read_db) != []
+
+    # the previous instance of the same file got locked, but the new one still has the key
+    _ = [entry.password for entry in read_db.content]
+    utils.make_current_db(open_db(db.path), read_db)
+
+    assert len(derivations) == 1
+
+
+def test_selecting_another_file_wipes_the_key(create_db, derivations):
+    db = create_db()
+    db.write()
+
+    other_db = create_db(name="other.db")
+
+    utils.make_current_db(other_db, db)
+
+    assert key_cache.get(db.get_absolute_path(), db.salt, db.kdf_parameters.as_tuple(), PASSWORD) is None
+    assert len(derivations) == 2
+
+
+def test_rekey_derives_a_new_key(create_db, derivations):
+    db = create_db()
+    db.write()
+
+    old_salt = db.salt
+    fields = get_fields(db)
+
+    db.rekey(kdf.KdfParameters())
+
+    assert db.salt != old_salt
+    assert key_cache.get(db.get_absolute_path(), old_salt, db.kdf_parameters.as_tuple(), PASSWORD) is None
+    assert derivations == [old_salt, db.salt]
+
+    assert get_fields(open_db(db.path)) == fields
+    assert len(derivations) == 2
@@ -0,0 +1,128 @@
+from pw_manager.db_entry import DatabaseEntry
+from pw_manager.db_sync import merge
+
+from tests.conftest import open_db
+
+
+def make_entry(entry_id: str, password: str, modified: int = 1, website_or_usage: str = None) -> DatabaseEntry:
+    return DatabaseEntry(website_or_usage=website_or_usage or entry_id, username="someone", description="", password=password,
+                         entry_id=entry_id, modified=modified)
+
+
+def changed(entry: DatabaseEntry, password: str, modified: int) -> DatabaseEntry:
+    return make_entry(entry.entry_id, password, modified, entry.website_or_usage)
+
+
+def get_local_changes(result: merge.MergeResult) -> dict[str, str]:
+    return {entry.entry_id: entry.password for entry in result.local_changes}
+
+
+BASE = [make_entry("a", "a"), make_entry("b", "b"), make_entry("c", "c")]
+
+
+def test_unchanged():
+    result = merge.three_way_merge(BASE, list(BASE), list(BASE))
+
+    assert not result.changes_local()
+    assert not result.changes_remote()
+    assert result.conflicts == []
+
+
+def test_changed_on_one_side():
+    local = [changed(BASE[0], "local a", 2), BASE[1], BASE[2], make_entry("local", "new")]
+    remote = [BASE[0], changed(BASE[1], "remote b", 2), BASE[2], make_entry("remote", "new")]
+
+    result = merge.three_way_merge(BASE, local, remote)
+
+    assert get_local_changes(result) == {"b": "remote b", "remote": "new"}
+    assert result.local_deletions == []
+    assert (result.remote_additions, result.remote_updates, result.remote_deletions) == (1, 1, 0)
+    assert result.conflicts == []
+
+
+def test_deleted_on_one_side():
+    result = merge.three_way_merge(BASE, [BASE[1], BASE[2]], [BASE[0], BASE[1]])
+
+    assert result.local_deletions == ["c"]
+    assert result.remote_deletions == 1
+    assert result.conflicts == []
+
+
+def test_changed_the_same_way_on_both_sides():
+    result = merge.three_way_merge(BASE, [changed(BASE[0], "same", 2), BASE[1], BASE[2]], [changed(BASE[0], "same", 3), BASE[1], BASE[2]])
+
+    assert not result.changes_local()
+    assert not result.changes_remote()
+    assert result.conflicts == []
+
+
+def test_conflict_newer_change_wins():
+    local = [changed(BASE[0], "local a", 5), changed(BASE[1], "local b", 2), BASE[2]]
+    remote = [changed(BASE[0], "remote a", 3), changed(BASE[1], "remote b", 4), BASE[2]]
+
+    result = merge.three_way_merge(BASE, local, remote)
+
+    assert get_local_changes(result) == {"b": "remote b"}
+    assert result.remote_updates == 1
+
+    assert {conflict.entry_id: conflict.resolution for conflict in result.conflicts} == {"a": merge.RESOLUTION_LOCAL, "b": merge.RESOLUTION_REMOTE}
+
+
+def test_conflict_with_the_same_clock_goes_to_the_remote_side():
+    result = merge.three_way_merge(BASE, [changed(BASE[0], "local a", 2)], [changed(BASE[0], "remote a", 2)])
+
+    assert get_local_changes(result) == {"a": "remote a"}
+    assert [conflict.resolution for conflict in result.conflicts] == [merge.RESOLUTION_REMOTE]
+
+
+def test_conflict_change_wins_over_deletion():
+    local = [changed(BASE[0], "local a", 2), BASE[2]]
+    remote = [changed(BASE[1], "remote b", 2), BASE[2]]
+
+    result = merge.three_way_merge(BASE, local, remote)
+
+    # a was deleted remotely and b locally, but both got changed on the other side
+    assert get_local_changes(result) == {"b": "remote b"}
+    assert result.local_deletions == []
+    assert (result.remote_additions, result.remote_updates, result.remote_deletions) == (1, 0, 0)
+
+    assert {conflict.entry_id: conflict.resolution for conflict in result.conflicts} == {"a": merge.RESOLUTION_LOCAL, "b": merge.RESOLUTION_REMOTE}
+
+
+def test_without_base():
+    local = [BASE[0], changed(BASE[1], "local b", 5)]
+    remote = [BASE[1], BASE[2]]
+
+    result = merge.three_way_merge([], local, remote)
+
+    # nothing is deleted on the first merge, and entries that differ are conflicts
+    assert get_local_changes(result) == {"c": "c"}
+    assert result.local_deletions == []
+    assert (result.remote_additions, result.remote_updates, result.remote_deletions) == (1, 1, 0)
+    assert [(conflict.entry_id, conflict.resolution) for conflict in result.conflicts] == [("b", merge.RESOLUTION_LOCAL)]
+
+
+def test_merged_entries_are_taken_over(create_db):
+    db = create_db()
+    db.write()
+
+    github, mail, bank = (db.search_entries(term)[0] for term in ("github", "mail", "bank"))
+
+    remote = [changed(github, "remote", github.modified + 10), mail, make_entry("remote", "new")]
+
+    result = merge.three_way_merge(list(db.content), list(db.content), remote)
+    db.merge_entries(result.local_changes, result.local_deletions)
+
+    read_db = open_db(db.path)
+
+    assert sorted((entry.entry_id, entry.password) for entry in read_db.content) == \
+           sorted([(github.entry_id, "remote"), (mail.entry_id, mail.password), ("remote", "new")])
+
+    # the changes keep the clock they were made with
+    assert read_db.get_entry_by_id(github.entry_id).modified == github.modified + 10
+
+    # nothing is left to merge afterwards
+    result = merge.three_way_merge(remote, list(read_db.content), remote)
+
+    assert not result.changes_local()
+    assert not result.changes_remote()
@@ -0,0 +1,112 @@
+import json
+
+import pytest
+from cryptography.fernet import InvalidToken
+
+from pw_manager.db import FORMAT_PER_ENTRY
+from pw_manager.db_entry import DatabaseEntry
+
+from tests.conftest import open_db, get_fields
+
+
+def read_document(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_document(path: str, document: dict) -> None:
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
+
+
+def test_round_trip(create_db):
+    db = create_db(storage_format=FORMAT_PER_ENTRY)
+    db.write()
+
+    document = read_document(db.path)
+
+    assert document.get("format") == FORMAT_PER_ENTRY
+    assert sorted(document.get("entries").keys()) == sorted(entry.entry_id for entry in db.content)
+
+    read_db = open_db(db.path)
+
+    assert read_db.storage_format == FORMAT_PER_ENTRY
+    assert get_fields(read_db) == get_fields(db)
+
+
+def test_only_the_index_gets_decrypted(create_db):
+    db = create_db(storage_format=FORMAT_PER_ENTRY)
+    db.write()
+
+    read_db = open_db(db.path)
+
+    assert all(entry.is_sealed() for entry in read_db.content)
+
+    # going through the fields doesn't unseal the entries either
+    assert len(list(read_db.iter_entry_fields())) == len(read_db.content)
+    assert len(read_db.search_entries("example")) == 1
+    assert all(entry.is_sealed() for entry in read_db.content)
+
+
+def test_unchanged_entries_keep_their_ciphertext(create_db):
+    db = create_db(storage_format=FORMAT_PER_ENTRY)
+    db.write()
+
+    before = read_document(db.path).get("entries")
+
+    read_db = open_db(db.path)
+    changed_entry = read_db.search_entries("github")[0]
+
+    read_db.update_entry(changed_entry, DatabaseEntry(website_or_usage="github.com", description="work account", username="octocat", password="hunter3"))
+    read_db.write()
+
+    after = read_document(db.path).get("entries")
+
+    assert after.get(changed_entry.entry_id) != before.get(changed_entry.entry_id)
+    assert {entry_id: token for entry_id, token in after.items() if entry_id != changed_entry.entry_id} == \
+           {entry_id: token for entry_id, token in before.items() if entry_id != changed_entry.entry_id}
+
+    assert open_db(db.path).get_entry_by_id(changed_entry.entry_id).password == "hunter3"
+
+
+def test_damaged_entry(create_db):
+    db = create_db(storage_format=FORMAT_PER_ENTRY)
+    db.write()
+
+    damaged_entry = db.search_entries("bank")[0]
+
+    document = read_document(db.path)
+    token = document.get("entries").get(damaged_entry.entry_id)
+    document.get("entries")[damaged_entry.entry_id] = token[:40] + ("A" if token[40] != "A" else "B") + token[41:]
+    write_document(db.path, document)
+
+    read_db = open_db(db.path)
+
+    with pytest.raises(InvalidToken):
+        _ = read_db.get_entry_by_id(damaged_entry.entry_id).password
+
+    # the other entries are encrypted on their own and can still be read
+    assert sorted(entry.password for entry in read_db.content if entry.entry_id != damaged_entry.entry_id) == ["hunter2", "s3cr3t"]
+
+
+def test_damaged_index(create_db):
+    db = create_db(storage_format=FORMAT_PER_ENTRY)
+    db.write()
+
+    document = read_document(db.path)
+    document["index"] = document.get("index")[:-8] + "AAAAAAAA"
+    write_document(db.path, document)
+
+    with pytest.raises(InvalidToken):
+        open_db(db.path)
+
+
+def test_truncated_file(create_db):
+    db = create_db(storage_format=FORMAT_PER_ENTRY)
+    db.write()
+
+    with open(db.path, "r+") as f:
+        f.truncate(db.file_identity[2] // 2)
+
+    with pytest.raises(ValueError):
+        open_db(db.path)
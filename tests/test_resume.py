@@ -0,0 +1,167 @@
+import hashlib
+import os
+
+import pytest
+
+from pw_manager.db_sync import delta
+
+from tests.fake_sftp import FakeSFTP
+
+
+SIZE = 5 * 1024 * 1024
+
+
+@pytest.fixture
+def files(tmp_path):
+    remote_folder = tmp_path / "remote"
+    remote_folder.mkdir()
+
+    return str(tmp_path / "vault.db"), str(remote_folder / "vault.db")
+
+
+def write_file(path: str, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def get_upload_part_path(remote_path: str, data: bytes) -> str:
+    return f"{remote_path}.{hashlib.sha256(data).hexdigest()[:16]}{delta.PART_SUFFIX}"
+
+
+def test_upload_is_not_read_back(files):
+    local_path, remote_path = files
+    data = os.urandom(SIZE)
+    write_file(local_path, data)
+
+    sftp = FakeSFTP()
+
+    assert delta.upload(sftp, local_path, remote_path) == SIZE
+    assert sftp.received == 0
+
+    assert read_file(remote_path) == data
+    assert delta.read_remote_signature(sftp, remote_path).file_hash == hashlib.sha256(data).digest()
+    assert not os.path.exists(get_upload_part_path(remote_path, data))
+
+
+@pytest.mark.parametrize("check_file", [False, True])
+def test_upload_continues_an_interrupted_one(files, check_file):
+    local_path, remote_path = files
+    data = os.urandom(SIZE)
+    write_file(local_path, data)
+
+    write_file(get_upload_part_path(remote_path, data), data[:3 * 1024 * 1024])
+
+    sftp = FakeSFTP(check_file=check_file)
+
+    assert delta.upload(sftp, local_path, remote_path) == SIZE - 3 * 1024 * 1024
+    assert read_file(remote_path) == data
+
+    if check_file:
+        # the server hashed the part, nothing was read back
+        assert sftp.received == 0
+        assert sftp.checked == 3 * 1024 * 1024
+    else:
+        assert sftp.received == 3 * 1024 * 1024
+
+
+@pytest.mark.parametrize("check_file", [False, True])
+def test_upload_continues_at_the_first_gap(files, check_file):
+    local_path, remote_path = files
+    data = os.urandom(SIZE)
+    write_file(local_path, data)
+
+    # a pipelined write that was never confirmed left a gap before the end of the part
+    part = bytearray(data[:3 * 1024 * 1024])
+    part[1000000:1000100] = bytes(100)
+    write_file(get_upload_part_path(remote_path, data), bytes(part))
+
+    sftp = FakeSFTP(check_file=check_file)
+    sent = delta.upload(sftp, local_path, remote_path)
+
+    assert read_file(remote_path) == data
+
+    if check_file:
+        # the part is compared in blocks, the upload continues at the block with the gap
+        assert sent == SIZE - 1000000 // delta.RESUME_HASH_BLOCK_SIZE * delta.RESUME_HASH_BLOCK_SIZE
+    else:
+        assert sent == SIZE - 1000000
+
+
+def test_upload_of_a_part_that_is_longer(files):
+    local_path, remote_path = files
+    data = os.urandom(100)
+    write_file(local_path, data)
+
+    write_file(get_upload_part_path(remote_path, data), data[:50] + os.urandom(100))
+
+    delta.upload(FakeSFTP(), local_path, remote_path)
+
+    assert read_file(remote_path) == data
+
+
+def test_upload_removes_parts_of_other_versions(files):
+    local_path, remote_path = files
+    data = os.urandom(1000)
+    write_file(local_path, data)
+
+    old_part_path = get_upload_part_path(remote_path, b"an older version")
+    write_file(old_part_path, b"an older")
+
+    delta.upload(FakeSFTP(), local_path, remote_path)
+
+    assert not os.path.exists(old_part_path)
+    assert read_file(remote_path) == data
+
+
+def test_download_continues_an_interrupted_one(files):
+    local_path, remote_path = files
+    data = os.urandom(SIZE)
+
+    write_file(local_path, data)
+    delta.upload(FakeSFTP(), local_path, remote_path)
+
+    os.remove(local_path)
+
+    signature = delta.read_remote_signature(FakeSFTP(), remote_path)
+    write_file(f"{local_path}.{signature.file_hash.hex()[:16]}{delta.PART_SUFFIX}", data[:2 * 1024 * 1024])
+
+    sftp = FakeSFTP()
+
+    assert delta.download(sftp, remote_path, local_path) == SIZE - 2 * 1024 * 1024
+    assert read_file(local_path) == data
+
+
+def test_download_that_does_not_match_keeps_the_local_file(files):
+    local_path, remote_path = files
+    local_data = os.urandom(1000)
+    write_file(local_path, local_data)
+
+    # no signature file, and the manifest describes another version
+    write_file(remote_path, os.urandom(1000))
+
+    with pytest.raises(IOError):
+        delta.download(FakeSFTP(), remote_path, local_path, expected_hash=hashlib.sha256(b"another version").digest())
+
+    assert read_file(local_path) == local_data
+    assert [name for name in os.listdir(os.path.dirname(local_path)) if name.endswith(delta.PART_SUFFIX)] == []
+
+
+def test_download_without_anything_to_verify_it(files):
+    local_path, remote_path = files
+    local_data = os.urandom(1000)
+    write_file(local_path, local_data)
+
+    write_file(remote_path, os.urandom(1000))
+
+    def validate(_):
+        raise ValueError("not a database")
+
+    with pytest.raises(IOError):
+        delta.download(FakeSFTP(), remote_path, local_path, validate=validate)
+
+    assert read_file(local_path) == local_data
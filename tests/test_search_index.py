@@ -0,0 +1,123 @@
+import random
+
+import pytest
+
+from pw_manager import search_index
+from pw_manager.db import Database, FORMAT_BINARY, FORMAT_PER_ENTRY
+from pw_manager.db_entry import DatabaseEntry
+
+from tests.conftest import open_db
+
+
+def search_every_entry(db: Database, term: str) -> list[DatabaseEntry]:
+    term = term.lower()
+
+    return sorted(entry for entry in db.get_all_entries() if any(term in getattr(entry, field).lower() for field in db.search_fields))
+
+
+def get_websites(entries: list[DatabaseEntry]) -> list[str]:
+    return sorted(entry.website_or_usage for entry in entries)
+
+
+def test_index_only_keeps_postings():
+    index = search_index.SearchIndex()
+
+    index.add("a", {"website_or_usage": "GitHub", "username": "octocat", "description": "", "password": "hunter2"})
+    index.add("b", {"website_or_usage": "gitlab", "username": "octocat", "description": "", "password": "hunter2"})
+
+    assert index.get_candidates("git") == {"a", "b"}
+    assert index.get_candidates("thub") == {"a"}
+    assert index.get_candidates("octo") == {"a", "b"}
+    assert index.get_candidates("hunter") == set()
+    assert index.get_candidates("gi") is None
+
+    # nothing but trigrams and ids is kept
+    assert all(len(ngram) == search_index.NGRAM_LENGTH for ngram in index.postings.keys())
+
+    index.remove("a", {"website_or_usage": "GitHub", "username": "octocat", "description": "", "password": "hunter2"})
+
+    assert index.get_candidates("git") == {"b"}
+    assert index.get_candidates("thub") == set()
+    assert "thu" not in index.postings
+
+
+@pytest.mark.parametrize("storage_format", [FORMAT_BINARY, FORMAT_PER_ENTRY])
+def test_search(create_db, storage_format):
+    db = create_db(storage_format=storage_format)
+    db.write()
+
+    read_db = open_db(db.path)
+
+    assert get_websites(read_db.search_entries("GITHUB")) == ["github.com"]
+    assert get_websites(read_db.search_entries("example")) == ["mail.example.org"]
+    assert get_websites(read_db.search_entries("card")) == ["Bank"]
+    assert get_websites(read_db.search_entries("o")) == ["Bank", "github.com", "mail.example.org"]
+    assert read_db.search_entries("not there") == []
+
+    # finding candidates and checking them doesn't unseal the entries
+    assert all(entry.is_sealed() for entry in read_db.content)
+
+
+def test_passwords_are_only_searched_when_asked_to(create_db):
+    db = create_db()
+    db.write()
+
+    read_db = open_db(db.path)
+
+    assert "password" not in read_db.search_fields
+    assert read_db.search_entries("hunter2") == []
+
+    read_db.set_search_fields(search_index.ALL_FIELDS)
+
+    assert get_websites(read_db.search_entries("hunter2")) == ["github.com"]
+
+    read_db.set_search_fields(search_index.FIELDS_WITHOUT_PASSWORD)
+
+    assert read_db.search_entries("hunter2") == []
+
+
+@pytest.mark.parametrize("storage_format", [FORMAT_BINARY, FORMAT_PER_ENTRY])
+def test_index_follows_every_change(create_db, storage_format):
+    rng = random.Random(5)
+
+    def text(length: int) -> str:
+        return "".join(rng.choice("abcXYZ01") for _ in range(length))
+
+    db = create_db(storage_format=storage_format, entries=[(text(8), text(6), text(5), text(6)) for _ in range(200)])
+    db.write()
+
+    read_db = open_db(db.path)
+
+    for _ in range(300):
+        operation = rng.random()
+
+        if operation < 0.3:
+            read_db.add_database_entry(website_or_usage=text(8), description=text(6), username=text(5), password=text(6))
+        elif operation < 0.6:
+            read_db.update_entry(rng.choice(read_db.content), DatabaseEntry(website_or_usage=text(8), description=text(6), username=text(5), password=text(6)))
+        elif operation < 0.8:
+            read_db.delete_entry(rng.choice(read_db.content))
+        else:
+            with pytest.raises(KeyError):
+                with read_db.transaction():
+                    read_db.add_database_entry(website_or_usage="rolled back", description="", username="", password="password")
+                    raise KeyError
+
+        term = text(rng.choice([1, 2, 3, 4]))
+
+        assert read_db.search_entries(term) == search_every_entry(read_db, term)
+
+    assert read_db.search_entries("rolled back") == []
+
+
+def test_index_takes_over_the_changes_of_other_writers(create_db):
+    db = create_db()
+    db.write()
+
+    other_db = open_db(db.path)
+    other_db.add_database_entry(website_or_usage="from another writer", description="", username="someone", password="password")
+
+    # the next write catches up with the file first
+    db.add_database_entry(website_or_usage="from this writer", description="", username="someone", password="password")
+
+    assert get_websites(db.search_entries("writer")) == ["from another writer", "from this writer"]
@@ -0,0 +1,128 @@
+import pytest
+
+from pw_manager.db import Database, FORMAT_BINARY, FORMAT_PER_ENTRY
+from pw_manager.db_entry import DatabaseEntry
+
+from tests.conftest import open_db, get_fields
+
+
+pytestmark = pytest.mark.parametrize("storage_format", [FORMAT_BINARY, FORMAT_PER_ENTRY])
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def count_writes(monkeypatch):
+    writes = []
+    write_content = Database.__write_content__
+
+    def counting_write_content(db):
+        writes.append(db.path)
+        write_content(db)
+
+    monkeypatch.setattr(Database, "__write_content__", counting_write_content)
+
+    return writes
+
+
+def test_changes_are_written_once(create_db, count_writes, storage_format):
+    db = create_db(storage_format=storage_format)
+    db.write()
+
+    count_writes.clear()
+    before = read_file(db.path)
+
+    with db.transaction():
+        for i in range(10):
+            db.add_database_entry(website_or_usage=f"site {i}", description="", username="someone", password="password")
+
+        db.delete_entry(db.search_entries("github")[0])
+
+        assert read_file(db.path) == before
+
+    assert len(count_writes) == 1
+    assert get_fields(open_db(db.path)) == get_fields(db)
+
+
+def test_rollback(create_db, storage_format):
+    db = create_db(storage_format=storage_format)
+    db.write()
+
+    before = read_file(db.path)
+    fields = get_fields(db)
+
+    with pytest.raises(KeyError):
+        with db.transaction():
+            db.add_database_entry(website_or_usage="rolled back", description="", username="someone", password="password")
+            db.update_entry(db.search_entries("github")[0], DatabaseEntry(website_or_usage="changed", description="", username="", password="password"))
+
+            raise KeyError
+
+    assert get_fields(db) == fields
+    assert read_file(db.path) == before
+    assert db.search_entries("rolled back") == []
+    assert db.search_entries("changed") == []
+    assert len(db.search_entries("github")) == 1
+
+
+def test_nested_transactions_are_part_of_the_outer_one(create_db, count_writes, storage_format):
+    db = create_db(storage_format=storage_format)
+    db.write()
+
+    count_writes.clear()
+    fields = get_fields(db)
+
+    with pytest.raises(KeyError):
+        with db.transaction():
+            with db.transaction():
+                db.add_database_entry(website_or_usage="inner", description="", username="someone", password="password")
+
+            assert count_writes == []
+
+            raise KeyError
+
+    assert get_fields(db) == fields
+    assert get_fields(open_db(db.path)) == fields
+
+
+def test_failed_write_rolls_back(create_db, monkeypatch, storage_format):
+    db = create_db(storage_format=storage_format)
+    db.write()
+
+    fields = get_fields(db)
+
+    def failing_write_content(_):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(Database, "__write_content__", failing_write_content)
+
+    with pytest.raises(OSError):
+        with db.transaction():
+            db.add_database_entry(website_or_usage="not written", description="", username="someone", password="password")
+
+    assert get_fields(db) == fields
+
+    monkeypatch.undo()
+
+    assert get_fields(open_db(db.path)) == fields
+
+
+def test_write_behind(create_db, storage_format):
+    db = create_db(storage_format=storage_format)
+    db.write()
+
+    db.enable_write_behind(delay=0.01)
+
+    with db.transaction():
+        db.add_database_entry(website_or_usage="in the background", description="", username="someone", password="password")
+
+    db.add_database_entry(website_or_usage="after the transaction", description="", username="someone", password="password")
+
+    db.flush()
+
+    assert get_fields(open_db(db.path)) == get_fields(db)
+
+    db.disable_write_behind()